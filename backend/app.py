@@ -1,10 +1,17 @@
 import os
 import os
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, send_file
 from flask_cors import CORS
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from supabase import Client
 import uuid
+import time
+import json
+import heapq
+import itertools
+import numpy as np
+import csv
+import hmac
 from functools import wraps
 import jwt # PyJWT library needed: pip install PyJWT cryptography
 
@@ -17,6 +24,52 @@ CORS(app)
 
 # Import routes
 from routes.users import users_bp
+from services.identity_cache import identity_cache
+from services.supabase_clients import clients
+from services.location_ingest import (
+    LOCATION_BATCH_MAX_FIXES, create_location_buffer, format_timestamp, normalize_fix, parse_time_param,
+    parse_timestamp
+)
+from services.location_spool import LOCATION_SPOOL_ENABLED, create_location_spool
+from services.positions import create_position_sync, position_index
+from services.change_feed import change_feed
+from services.stream_hub import STREAM_DEFAULT_INTERVAL, encode_event, stream_hub
+from services.location_index import LOCATION_FIELDS, LocationIndex
+from services.supabase_clients import fetch_pages
+from services.geo import haversine_m
+from services.geofence import GEOFENCE_ENABLED, GeofenceEngine
+from services.coverage import COVERAGE_ENABLED, COVERAGE_FLUSH_INTERVAL, coverage_store
+from services.archive import (
+    ARCHIVE_AFTER_DAYS, ARCHIVE_DELETE_CHUNK, ARCHIVE_MAX_DAYS_PER_RUN, ARCHIVE_QUERY_MAX_ROWS, day_of, day_start,
+    id_bytes, location_archive
+)
+from services.auth_directory import auth_directory
+from services.jobs import QueueFullError, jobs
+from services.auth_admin import delete_auth_user
+from services.onboarding import (
+    BULK_ONBOARD_MAX_ROWS, BULK_ONBOARD_SYNC_MAX_ROWS, BulkOnboarding, parse_csv_rows, summarize, validate_rows
+)
+from services.logs import get_logger, should_log_request
+from services.workers import single_worker
+from services.profiling import request_profiler
+from services.response_cache import response_cache
+from services.wire import (
+    COMPRESSIBLE_MIMETYPES, COORDINATE_SCALE, MSGPACK_MIMETYPES, TIME_SCALE, WireError, decode_fix_columns, encode_columns, json_provider,
+    wire_codec
+)
+from services.routing import ROUTE_MAX_STOPS, distance_matrices, optimize_route
+from services.dispatch import (
+    DISPATCH_DEFAULT_CAPACITY, DISPATCH_MAX_CREWS, DISPATCH_MAX_POSITION_AGE_MINUTES, DISPATCH_MAX_SITES,
+    DISPATCH_ROLES, cost_matrix, dispatcher
+)
+from services.metrics import http_request_duration, http_requests, registry as metrics_registry, stage_duration
+from services.tracks import (
+    TRACK_DEFAULT_TOLERANCE_M, TRACK_DEFAULT_WINDOW_HOURS, TRACK_MAX_RAW_POINTS, TRACK_MAX_TOLERANCE_M,
+    TRACK_MAX_WINDOW_HOURS, TRACK_PAGE_SIZE, deadband_filter, simplify_stream
+)
+
+# orjson-backed jsonify/get_json when available
+app.json = json_provider(app)
 
 # Register blueprints
 app.register_blueprint(users_bp, url_prefix='/api/users')
@@ -26,31 +79,42 @@ SUPABASE_URL = os.getenv('SUPABASE_URL', '')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY', '') # Public anon key
 SUPABASE_SERVICE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY', '') # Service role key
 SUPABASE_JWT_SECRET = os.getenv('JWT_SECRET_KEY', '') # JWT Secret (Using the key name from user's .env)
+POSITION_WARM_WAIT_SECONDS = float(os.getenv('POSITION_WARM_WAIT_SECONDS', '5'))
+NEARBY_DEFAULT_RADIUS_M = float(os.getenv('NEARBY_DEFAULT_RADIUS_M', '5000'))
+NEARBY_MAX_RADIUS_M = float(os.getenv('NEARBY_MAX_RADIUS_M', '100000'))
+RANK_MAX_ORIGINS = int(os.getenv('RANK_MAX_ORIGINS', '1000'))
+DB_WEBHOOK_SECRET = os.getenv('DB_WEBHOOK_SECRET', '') # Shared secret for Supabase database webhooks
+BULK_DELETE_MAX_IDS = int(os.getenv('BULK_DELETE_MAX_IDS', '1000'))
+# Bearer token required by GET /metrics (unset = open, for scrapers on a private network)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+log = get_logger('app')
 
-supabase = None # Client for general use (using anon key)
-if SUPABASE_URL and SUPABASE_KEY:
+def get_public_client():
+    """Shared client for general use (using anon key), or None when not configured"""
     try:
-        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+        return clients.public()
     except Exception as e:
-        print(f"Error initializing public Supabase client: {e}")
+        log.error("Error initializing public Supabase client: %s", e)
+        return None
 
 # Helper function to decode JWT and get user info
 def get_user_from_token():
-    print("--- Entering get_user_from_token ---") # DEBUG LOG
+    log.debug("Entering get_user_from_token")
     auth_header = request.headers.get('Authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
-        print("DEBUG: Missing or invalid Authorization header") # DEBUG LOG
+        log.debug("Missing or invalid Authorization header")
         return None, {"error": "Missing or invalid Authorization header"}
 
     token = auth_header.split(' ')[1]
-    print(f"DEBUG: Token received: {token[:10]}...") # DEBUG LOG (log prefix only)
+    log.debug("Token received: %s...", token[:10])
     try:
         # Ensure JWT Secret is loaded
         if not SUPABASE_JWT_SECRET:
-            print("DEBUG: SUPABASE_JWT_SECRET (from JWT_SECRET_KEY) is missing!") # DEBUG LOG
+            log.error("SUPABASE_JWT_SECRET (from JWT_SECRET_KEY) is missing!")
             raise Exception("Backend JWT secret not configured (JWT_SECRET_KEY missing in .env?)")
             
-        print("DEBUG: Attempting to decode JWT...") # DEBUG LOG
+        log.debug("Attempting to decode JWT...")
         # Decode the token using the Supabase JWT secret
         payload = jwt.decode(
             token,
@@ -58,26 +122,36 @@ def get_user_from_token():
             audience='authenticated',
             algorithms=['HS256']
         )
-        print(f"DEBUG: JWT decoded successfully. Payload sub: {payload.get('sub')}") # DEBUG LOG
+        log.debug("JWT decoded successfully. Payload sub: %s", payload.get('sub'))
+        # Reject tokens issued before the user was removed (crew/user deletion)
+        if identity_cache.is_revoked(payload):
+            return None, {"error": "User not found in authentication system"}
+
+        # Serve from the verified-identity cache (or trusted claims) when possible
+        cached_user = identity_cache.get(payload)
+        if cached_user is not None:
+            return cached_user, None
+
         # Fetch user details using the service role client for reliability
         # Ensure service key is available
         if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
-             print("DEBUG: SUPABASE_SERVICE_KEY is missing!") # DEBUG LOG
+             log.error("SUPABASE_SERVICE_KEY is missing!")
              raise Exception("Backend service key not configured")
              
-        print("DEBUG: Creating admin client to fetch user details...") # DEBUG LOG
-        admin_supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+        log.debug("Using shared admin client to fetch user details...")
+        admin_supabase: Client = clients.admin()
         user_response = admin_supabase.auth.admin.get_user_by_id(payload['sub']) # Use get_user_by_id
-        print(f"DEBUG: Fetched user details: {user_response.user.id if user_response.user else 'Not Found'}") # DEBUG LOG
+        log.debug("Fetched user details: %s", user_response.user.id if user_response.user else 'Not Found')
+        identity_cache.put(payload, user_response.user)
         return user_response.user, None
     except jwt.ExpiredSignatureError:
-        print("DEBUG: JWT expired") # DEBUG LOG
+        log.debug("JWT expired")
         return None, {"error": "Token has expired"}
     except jwt.InvalidTokenError as e:
-        print(f"DEBUG: Invalid JWT: {e}") # DEBUG LOG
+        log.debug("Invalid JWT: %s", e)
         return None, {"error": "Invalid token"}
     except Exception as e:
-        print(f"DEBUG: Exception in get_user_from_token: {e}") # DEBUG LOG
+        log.debug("Exception in get_user_from_token: %s", e)
         # Check if it's a Supabase specific error (like user not found)
         if hasattr(e, 'status_code') and e.status_code == 404:
              return None, {"error": "User not found in authentication system"}
@@ -87,49 +161,211 @@ def get_user_from_token():
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        print(f"--- Entering @admin_required for route {f.__name__} ---") # DEBUG LOG
+        log.debug("Entering @admin_required for route %s", f.__name__)
         user, error = get_user_from_token()
         if error:
-            print(f"DEBUG: @admin_required - Auth error: {error}") # DEBUG LOG
+            log.debug("@admin_required - Auth error: %s", error)
             return jsonify(error), 401
             
         user_role = user.user_metadata.get('role') if user and user.user_metadata else None
-        print(f"DEBUG: @admin_required - User role: {user_role}") # DEBUG LOG
+        log.debug("@admin_required - User role: %s", user_role)
         
         if not user or user_role != 'admin':
-            print("DEBUG: @admin_required - Admin check failed!") # DEBUG LOG
+            log.debug("@admin_required - Admin check failed!")
             return jsonify({"error": "Admin privileges required"}), 403
             
         # Pass user object to the route function if needed
-        print("DEBUG: @admin_required - Admin check passed.") # DEBUG LOG
+        log.debug("@admin_required - Admin check passed.")
+        g.organization_id = user.user_metadata.get('organization_id')
         kwargs['requesting_user'] = user
         return f(*args, **kwargs)
     return decorated_function
 
-# Add a hook to log every incoming request before routing
+# Decorator for routes any signed-in member of the organization may use
+def member_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        user, error = get_user_from_token()
+        if error:
+            log.debug("@member_required - Auth error: %s", error)
+            return jsonify(error), 401
+
+        organization_id = user.user_metadata.get('organization_id') if user and user.user_metadata else None
+        if not organization_id:
+            return jsonify({"error": "User is missing organization ID in metadata"}), 403
+        # Routes under /api/organization/<org_id> are limited to the caller's own organization
+        if 'org_id' in kwargs and str(kwargs['org_id']) != str(organization_id):
+            log.debug("@member_required - User is not in organization %s", kwargs['org_id'])
+            return jsonify({"error": "Not a member of this organization"}), 403
+
+        g.organization_id = organization_id
+        kwargs['requesting_user'] = user
+        return f(*args, **kwargs)
+    return decorated_function
+
+def in_caller_organization(client, crew_member_id):
+    """True when the crew member belongs to the organization of the user checked by @member_required"""
+    organization_id = fetch_member_organization(client, crew_member_id)
+    return organization_id is not None and str(organization_id) == str(g.organization_id)
+
+# Start the request timer before routing (first hook, so auth/warm-up are included)
+@app.before_request
+def start_request_timer():
+    request.environ['crewtrack.started'] = time.perf_counter()
+    request.environ['crewtrack.profile'] = request_profiler.begin(request.headers)
+
+def finish_request_profile(status, duration_ms):
+    """Hand the request's profile/upstream breakdown to the profiler (once per request)"""
+    state = request.environ.pop('crewtrack.profile', None)
+    if state is None:
+        return
+    view_args = request.view_args or {}
+    request_profiler.end(state, {
+        "method": request.method,
+        "path": request.path,
+        "route": request.url_rule.rule if request.url_rule is not None else 'unmatched',
+        "status": status,
+        "organization_id": view_args.get('org_id') or g.get('organization_id'),
+        "duration_ms": round(duration_ms, 2),
+    })
+
+# Per-route latency/status metrics and a sampled structured access log
+@app.after_request
+def record_request_metrics(response):
+    started = request.environ.get('crewtrack.started')
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    http_request_duration.observe(elapsed, request.method, route)
+    http_requests.inc(request.method, route, str(response.status_code))
+    duration_ms = elapsed * 1000
+    finish_request_profile(response.status_code, duration_ms)
+    if should_log_request(route, response.status_code, duration_ms):
+        log.info("request", extra={"method": request.method, "path": request.path, "route": route,
+                                   "status": response.status_code, "duration_ms": round(duration_ms, 2)})
+    return response
+
+# Requests that never reached the after_request hooks still stop their profiler
+@app.teardown_request
+def stop_request_profile(error=None):
+    started = request.environ.get('crewtrack.started')
+    if started is not None and 'crewtrack.profile' in request.environ:
+        finish_request_profile(500, (time.perf_counter() - started) * 1000)
+
+# Compress response bodies for clients that accept it (streamed responses are left alone)
+@app.after_request
+def compress_response(response):
+    if (response.direct_passthrough or response.is_streamed or response.status_code < 200
+            or response.status_code in (204, 304) or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(wire_codec.response_encodings)
+    if encoding is None or response.content_length is None or response.content_length < wire_codec.compress_min_bytes:
+        return response
+    response.set_data(wire_codec.compress(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+@app.errorhandler(WireError)
+def wire_error(error):
+    return jsonify({"error": str(error)}), error.status
+
+def request_payload():
+    """
+    The request body decoded per its Content-Encoding (gzip, br) and
+    Content-Type (JSON or MessagePack); raises WireError (answered as 4xx)
+    """
+    return wire_codec.decode(request.get_data(), request.mimetype, request.headers.get('Content-Encoding'),
+                             app.json.loads)
+
+def negotiated_mimetype():
+    """application/json, or a MessagePack type when the Accept header prefers it"""
+    return request.accept_mimetypes.best_match(wire_codec.response_mimetypes) or 'application/json'
+
+def negotiated_response(payload, status=200, packed=None):
+    """
+    JSON response, or MessagePack when the client asks for it in Accept;
+    packed() builds a more compact payload for MessagePack (default: payload)
+    """
+    mimetype = negotiated_mimetype()
+    if mimetype in MSGPACK_MIMETYPES:
+        response = app.response_class(wire_codec.pack(packed() if packed else payload), mimetype=mimetype)
+    else:
+        wire_codec.record_json_response()
+        response = jsonify(payload)
+    response.status_code = status
+    response.vary.add('Accept')
+    return response
+
+# Warm the in-memory latest-position index once per worker process
 @app.before_request
-def log_request_info():
-    print(f"--- BEFORE REQUEST ---")
-    print(f"Path: {request.path}")
-    print(f"Method: {request.method}")
-    print(f"Headers: {request.headers}")
+def warm_position_index():
+    position_index.ensure_warm(lambda: clients.admin() or get_public_client())
+
+def publish_position_changes(crew_member_ids):
+    """Fan position changes out to the per-organization change feed"""
+    by_org = {}
+    for crew_member_id in crew_member_ids:
+        organization_id = position_index.organization_of(crew_member_id)
+        if organization_id:
+            by_org.setdefault(organization_id, []).append(crew_member_id)
+    for organization_id, member_ids in by_org.items():
+        change_feed.positions_changed(organization_id, member_ids)
+        if stream_hub.has_subscribers(organization_id):
+            rows = position_index.compact_rows(member_ids)
+            stream_hub.publish(organization_id, 'position', [(row[0], row) for row in rows])
+
+def sync_position_index(client):
+    """
+    Push what the position index learned on ingest back to / from the database:
+    resolve organizations of newly seen crew members and write last_active_at
+    for members that are due (at most once per member per interval).
+    """
+    if client is None:
+        return
+    try:
+        unresolved = position_index.take_unresolved()
+        if unresolved:
+            response = client.table('crew_members').select('id, organization_id').in_('id', unresolved).execute()
+            found = {member['id']: member.get('organization_id') for member in response.data or []}
+            for crew_member_id in unresolved:
+                position_index.set_member_org(crew_member_id, found.get(crew_member_id))
+            publish_position_changes(unresolved)
+
+        due = position_index.take_due_last_active()
+        if due:
+            (client.table('crew_members')
+             .update({'last_active_at': format_timestamp(time.time())}, returning='minimal')
+             .in_('id', due)
+             .execute())
+    except Exception as e:
+        log.error("Error syncing position index: %s", e)
+
+# Runs sync_position_index off the single-fix request path
+position_sync = create_position_sync(lambda: sync_position_index(clients.admin() or get_public_client()))
 
 
 @app.route('/api/crew/location', methods=['POST'])
 def update_crew_location():
     """
     Update crew member's location
-    Expects JSON payload with:
+    Expects a JSON (or MessagePack, optionally gzip/br compressed) payload with:
     - crew_member_id
     - latitude
     - longitude
     """
-    data = request.get_json()
+    data = request_payload()
     
     # Validate input
-    if not all(key in data for key in ['crew_member_id', 'latitude', 'longitude']):
+    if not isinstance(data, dict) or not all(key in data for key in ['crew_member_id', 'latitude', 'longitude']):
         return jsonify({"error": "Missing required location data"}), 400
 
+    if LOCATION_SPOOL_ENABLED:
+        return spool_crew_location(data)
+
+    supabase = get_public_client()
     if supabase:
         try:
             # Insert new location record
@@ -141,10 +377,25 @@ def update_crew_location():
                 'timestamp': 'now()'  # Supabase will use current timestamp
             }
 
-            # Insert location into Supabase
-            response = supabase.table('crew_locations').insert(location_data).execute()
+            crew_member_id = str(data['crew_member_id'])
+            fix = (crew_member_id, float(data['latitude']), float(data['longitude']), time.time())
+
+            # Insert location into Supabase unless the dead-band filter drops it
+            stored = bool(deadband_filter.admit([fix]))
+            if stored:
+                response = supabase.table('crew_locations').insert(location_data).execute()
+                deadband_filter.remember([fix])
 
-            return jsonify({"message": "Location updated successfully"}), 200
+            # Keep the latest-position index current (timestamp ~ DB now())
+            with stage_duration.time('position_index'):
+                if position_index.record(*fix):
+                    publish_position_changes([crew_member_id])
+            position_sync.request()
+            with stage_duration.time('geofences'):
+                run_geofences([fix])
+            record_coverage([fix])
+
+            return negotiated_response({"message": "Location updated successfully", "stored": stored})
         except Exception as e:
             return jsonify({"error": str(e)}), 500
     else:
@@ -159,23 +410,167 @@ def update_crew_location():
             }
         }), 200
 
+def write_location_rows(rows):
+    """
+    Bulk insert crew_locations rows in a single PostgREST round trip
+    Fixes inside the dead-band of the member's last stored fix are not written,
+    but still reach the geofence engine
+    """
+    client = clients.admin() or get_public_client()
+    if client is None:
+        # Mock mode for development: nothing to persist to
+        return
+    fixes = [(str(row['crew_member_id']), row['latitude'], row['longitude'], parse_timestamp(row['timestamp']))
+             for row in rows]
+    kept = deadband_filter.admit(fixes)
+    if kept:
+        # Rows keep their id through retries and spool replays; ones already stored are skipped
+        (client.table('crew_locations')
+         .upsert([rows[i] for i in kept], on_conflict='id', ignore_duplicates=True, returning='minimal')
+         .execute())
+        deadband_filter.remember([fixes[i] for i in kept])
+    with stage_duration.time('sync_position_index'):
+        sync_position_index(client)
+    with stage_duration.time('geofences'):
+        run_geofences(fixes)
+    record_coverage(fixes)
+
+# Server-side write buffer behind the batched ingest endpoint
+location_buffer = create_location_buffer(write_location_rows)
+# Durable local spool in front of both ingest endpoints; forwarded once Supabase is configured
+location_spool = create_location_spool(
+    write_location_rows, ready=lambda: (clients.admin() or get_public_client()) is not None)
+location_sink = location_spool if LOCATION_SPOOL_ENABLED else location_buffer
+
+# Forward fixes an earlier process left in the spool
+@app.before_request
+def start_location_spool():
+    if LOCATION_SPOOL_ENABLED:
+        location_spool.start()
+
+def spool_crew_location(data):
+    """Single-fix ingest through the spool: acknowledged once the fix is on local disk"""
+    row, error = normalize_fix(data)
+    if error:
+        return jsonify({"error": error}), 400
+    try:
+        with stage_duration.time('spool_append'):
+            accepted = location_spool.submit([row])
+    except Exception as e:
+        log.error("Error spooling location: %s", e)
+        return jsonify({"error": str(e)}), 500
+    if not accepted:
+        response = jsonify({"error": "Location spool is full, retry later"})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    with stage_duration.time('position_index'):
+        publish_position_changes(position_index.record_rows([row]))
+    return negotiated_response({"message": "Location updated successfully", "queued": True, "id": row['id']})
+
+@app.route('/api/crew/location/batch', methods=['POST'])
+def update_crew_locations_batch():
+    """
+    Queue a batch of timestamped location fixes for bulk insertion
+    Expects JSON payload with:
+    - fixes: list of {crew_member_id, latitude, longitude, timestamp}
+    - crew_member_id (optional): default for fixes that omit it
+    A bare JSON list of fixes is also accepted, and so is the columnar form of
+    services.wire.encode_columns (delta-encoded coordinates and timestamps),
+    typically as MessagePack. Bodies may be gzip or br compressed.
+    """
+    data = request_payload()
+    if isinstance(data, dict) and 'columns' in data:
+        fixes = decode_fix_columns(data, LOCATION_BATCH_MAX_FIXES)
+        default_member_id = data.get('crew_member_id')
+    elif isinstance(data, dict):
+        fixes = data.get('fixes')
+        default_member_id = data.get('crew_member_id')
+    else:
+        fixes = data
+        default_member_id = None
+
+    if not isinstance(fixes, list) or not fixes:
+        return jsonify({"error": "Expected a non-empty list of fixes"}), 400
+    if len(fixes) > LOCATION_BATCH_MAX_FIXES:
+        return jsonify({"error": f"Too many fixes in one batch (max {LOCATION_BATCH_MAX_FIXES})"}), 413
+
+    rows = []
+    rejected = []
+    for index, raw_fix in enumerate(fixes):
+        row, error = normalize_fix(raw_fix, default_member_id)
+        if error:
+            rejected.append({"index": index, "error": error})
+        else:
+            rows.append(row)
+
+    if not rows:
+        return jsonify({"error": "No valid fixes in batch", "rejected": rejected}), 400
+
+    # Backpressure: refuse the whole batch so the client retries it later
+    try:
+        accepted = location_sink.submit(rows)
+    except Exception as e:
+        log.error("Error queueing location batch: %s", e)
+        return jsonify({"error": str(e)}), 500
+    if not accepted:
+        response = jsonify({"error": "Location ingest buffer is full, retry later"})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+
+    publish_position_changes(position_index.record_rows(rows))
+
+    return negotiated_response({
+        "message": "Locations queued successfully",
+        "accepted": len(rows),
+        "rejected": rejected,
+        "queue_depth": location_sink.depth
+    }, 202)
+
+def fetch_latest_location(client, crew_member_id):
+    """Most recent crew_locations row for a member (seeding the position index), or None"""
+    response = (client.table('crew_locations')
+                .select('*')
+                .eq('crew_member_id', crew_member_id)
+                .order('timestamp', desc=True)
+                .limit(1)
+                .execute())
+    if not response.data:
+        return None
+    latest = response.data[0]
+    position_index.seed(crew_member_id, float(latest['latitude']), float(latest['longitude']),
+                        parse_timestamp(latest['timestamp']))
+    return latest
+
+def fetch_member_organization(client, crew_member_id):
+    """Organization id of a crew member, cached in the position index"""
+    organization_id = position_index.organization_of(crew_member_id)
+    if organization_id or client is None:
+        return organization_id
+    response = (client.table('crew_members')
+                .select('organization_id')
+                .eq('id', crew_member_id)
+                .limit(1)
+                .execute())
+    if not response.data:
+        return None
+    organization_id = response.data[0].get('organization_id')
+    position_index.set_member_org(crew_member_id, organization_id)
+    return organization_id
+
 @app.route('/api/crew/current-location/<crew_member_id>', methods=['GET'])
 def get_current_location(crew_member_id):
     """
     Get the most recent location for a specific crew member
+    Always read from the database: the crew app inserts its fixes into
+    Supabase directly, so the position index may not have seen the latest one
     """
+    supabase = get_public_client()
     if supabase:
         try:
             # Fetch the most recent location for the crew member
-            response = (supabase.table('crew_locations')
-                        .select('*')
-                        .eq('crew_member_id', crew_member_id)
-                        .order('timestamp', desc=True)
-                        .limit(1)
-                        .execute())
-
-            if response.data:
-                return jsonify(response.data[0]), 200
+            latest = fetch_latest_location(supabase, crew_member_id)
+            if latest:
+                return negotiated_response(latest)
             else:
                 return jsonify({"error": "No location found"}), 404
         except Exception as e:
@@ -189,26 +584,851 @@ def get_current_location(crew_member_id):
             "timestamp": "2025-04-08T13:45:00Z"
         }), 200
 
+def load_org_locations(organization_id):
+    """All locations (sites) of an organization, for the spatial index"""
+    client = clients.admin() or get_public_client()
+    if client is None:
+        return []
+    return list(fetch_pages(lambda: (client.table('locations')
+                                     .select(LOCATION_FIELDS)
+                                     .eq('organization_id', organization_id)
+                                     .order('id'))))
+
+# Per-organization spatial index over locations.latitude/longitude
+location_index = LocationIndex(load_org_locations)
+geofence_engine = GeofenceEngine(location_index)
+
+def run_geofences(fixes):
+    """
+    Feed (crew_member_id, latitude, longitude, epoch_timestamp) fixes through the
+    geofence engine, grouped by organization, and apply the resulting events
+    """
+    if not GEOFENCE_ENABLED or not fixes:
+        return
+    try:
+        by_org = {}
+        for fix in fixes:
+            organization_id = position_index.organization_of(fix[0])
+            if organization_id:
+                by_org.setdefault(organization_id, []).append(fix)
+        for organization_id, org_fixes in by_org.items():
+            events = geofence_engine.process(organization_id, org_fixes)
+            if events:
+                apply_geofence_events(events)
+    except Exception as e:
+        log.error("Error running geofences: %s", e)
+
+def record_coverage(fixes):
+    """Count (crew_member_id, latitude, longitude, epoch_timestamp) fixes into their organizations' coverage tiles"""
+    if not COVERAGE_ENABLED or not fixes:
+        return
+    try:
+        by_org = {}
+        for fix in fixes:
+            organization_id = position_index.organization_of(fix[0])
+            if organization_id:
+                by_org.setdefault(organization_id, []).append(fix)
+        for organization_id, org_fixes in by_org.items():
+            _, lats, lons, timestamps = zip(*org_fixes)
+            coverage_store.record(organization_id, lats, lons, timestamps)
+    except Exception as e:
+        log.error("Error recording coverage: %s", e)
+
+def apply_geofence_events(events):
+    """
+    Move matching assignments pending -> in_progress on arrival and
+    in_progress -> completed on a departure long enough to count as a service
+    visit (also stamping locations.last_serviced_date), then notify viewers
+    """
+    client = clients.admin()
+    for event in events:
+        log.info("Geofence %s: crew member %s at location %s", event['type'], event['crew_member_id'], event['location_id'])
+        if client is not None:
+            try:
+                if event['type'] == 'enter':
+                    (client.table('crew_assignments')
+                     .update({'status': 'in_progress'}, returning='minimal')
+                     .eq('crew_member_id', event['crew_member_id'])
+                     .eq('location_id', event['location_id'])
+                     .eq('status', 'pending')
+                     .execute())
+                elif event['serviced']:
+                    response = (client.table('crew_assignments')
+                                .update({'status': 'completed'})
+                                .eq('crew_member_id', event['crew_member_id'])
+                                .eq('location_id', event['location_id'])
+                                .eq('status', 'in_progress')
+                                .execute())
+                    if response.data:
+                        (client.table('locations')
+                         .update({'last_serviced_date': format_timestamp(event['timestamp'])}, returning='minimal')
+                         .eq('id', event['location_id'])
+                         .execute())
+            except Exception as e:
+                # e.g. a completed assignment for the same member/location already exists
+                log.error("Error applying geofence %s for assignment at %s: %s", event['type'], event['location_id'], e)
+        stream_hub.publish(event['organization_id'], 'geofence',
+                           [(f"{event['crew_member_id']}:{event['location_id']}", event)])
+    # Assignment and site rows changed
+    for organization_id in {event['organization_id'] for event in events}:
+        response_cache.invalidate(organization_id)
+
+def location_summary(row, distance_m):
+    return {
+        "id": row['id'],
+        "name": row.get('name'),
+        "address": row.get('address'),
+        "latitude": float(row['latitude']),
+        "longitude": float(row['longitude']),
+        "status": row.get('status'),
+        "distance_m": round(distance_m, 1),
+    }
+
+@app.route('/api/crew/<crew_member_id>/nearby-locations', methods=['GET'])
+@member_required
+def get_nearby_locations(crew_member_id, requesting_user):
+    """
+    Get the organization's locations near a crew member's latest position
+    Requires a token of a member of the crew member's organization
+    Query params:
+    - radius: search radius in metres (default NEARBY_DEFAULT_RADIUS_M)
+    - limit: maximum number of locations to return
+    - status: only locations with this status (e.g. active)
+    """
+    try:
+        radius = float(request.args.get('radius', NEARBY_DEFAULT_RADIUS_M))
+        limit = int(request.args['limit']) if request.args.get('limit') else None
+    except ValueError:
+        return jsonify({"error": "radius and limit must be numbers"}), 400
+    if radius <= 0 or radius > NEARBY_MAX_RADIUS_M or (limit is not None and limit <= 0):
+        return jsonify({"error": f"radius must be in (0, {NEARBY_MAX_RADIUS_M:g}] and limit positive"}), 400
+
+    supabase = clients.admin() or get_public_client()
+    try:
+        if not in_caller_organization(supabase, crew_member_id):
+            return jsonify({"error": "Crew member not found"}), 404
+        organization_id = g.organization_id
+
+        position = position_index.get(crew_member_id)
+        if position is None and supabase:
+            position = fetch_latest_location(supabase, crew_member_id)
+        if position is None:
+            return jsonify({"error": "No location found"}), 404
+
+        nearby = location_index.nearby(organization_id, float(position['latitude']), float(position['longitude']),
+                                       radius, limit, request.args.get('status'))
+        return jsonify({
+            "crew_member_id": crew_member_id,
+            "origin": {"latitude": float(position['latitude']), "longitude": float(position['longitude'])},
+            "radius_m": radius,
+            "locations": [location_summary(row, distance) for row, distance in nearby]
+        }), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+ROUTE_STOP_FIELDS = 'id, status, location_id, locations(id, name, address, latitude, longitude, status)'
+
+@app.route('/api/crew/<crew_member_id>/route', methods=['GET'])
+@member_required
+def get_crew_route(crew_member_id, requesting_user):
+    """
+    Suggested visiting order for a crew member's open (pending/in_progress) assignments
+    Starts at the member's latest position (or anywhere when it is unknown) and
+    ends at the last stop. Assignments whose location has no coordinates are
+    returned under "unrouted".
+    Requires a token of a member of the crew member's organization
+    """
+    supabase = clients.admin() or get_public_client()
+    if supabase is None:
+        return jsonify({"error": "Database not configured"}), 500
+    try:
+        if not in_caller_organization(supabase, crew_member_id):
+            return jsonify({"error": "Crew member not found"}), 404
+        organization_id = g.organization_id
+        position = position_index.get(crew_member_id) or fetch_latest_location(supabase, crew_member_id)
+
+        assignments = (supabase.table('crew_assignments')
+                       .select(ROUTE_STOP_FIELDS)
+                       .eq('crew_member_id', crew_member_id)
+                       .in_('status', ['pending', 'in_progress'])
+                       .order('assigned_at')
+                       .execute()).data or []
+        stops, unrouted, seen = [], [], set()
+        for assignment in assignments:
+            site = assignment.get('locations') or {}
+            if assignment['location_id'] in seen:
+                continue
+            seen.add(assignment['location_id'])
+            if site.get('latitude') is None or site.get('longitude') is None:
+                unrouted.append({"assignment_id": assignment['id'], "location_id": assignment['location_id']})
+            else:
+                stops.append((assignment, site))
+        if len(stops) > ROUTE_MAX_STOPS:
+            return jsonify({"error": f"Too many open assignments to route (max {ROUTE_MAX_STOPS})"}), 400
+
+        started = time.perf_counter()
+        lats = [float(site['latitude']) for _, site in stops]
+        lons = [float(site['longitude']) for _, site in stops]
+        dist = distance_matrices.distances(organization_id, [(site['id'], lat, lon)
+                                                            for (_, site), lat, lon in zip(stops, lats, lons)])
+        origin = None
+        origin_row = None
+        if position is not None:
+            origin = {"latitude": float(position['latitude']), "longitude": float(position['longitude'])}
+            origin_row = haversine_m(origin['latitude'], origin['longitude'], lats, lons)
+        order, seed_length, length, passes = optimize_route(dist, origin_row)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        route = []
+        for rank, k in enumerate(order):
+            assignment, site = stops[k]
+            if rank:
+                leg = float(dist[order[rank - 1], k])
+            else:
+                leg = float(origin_row[k]) if origin_row is not None else 0.0
+            stop = location_summary(site, leg)
+            stop.update({"assignment_id": assignment['id'], "assignment_status": assignment['status']})
+            route.append(stop)
+        return jsonify({
+            "crew_member_id": crew_member_id,
+            "origin": origin,
+            "stops": route,
+            "unrouted": unrouted,
+            "total_distance_m": round(length, 1),
+            "nearest_neighbour_distance_m": round(seed_length, 1),
+            "improvement_passes": passes,
+            "compute_ms": round(elapsed_ms, 2)
+        }), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/crew/<crew_member_id>/track', methods=['GET'])
+@member_required
+def get_crew_track(crew_member_id, requesting_user):
+    """
+    Douglas-Peucker simplified location history of a crew member, streamed
+    Requires a token of a member of the crew member's organization
+    Query params:
+    - from / to: ISO 8601 or epoch time range (default: the last TRACK_DEFAULT_WINDOW_HOURS)
+    - tolerance: simplification tolerance in metres (default TRACK_DEFAULT_TOLERANCE_M)
+    Points are compact [latitude, longitude, epoch_timestamp] rows (see "fields");
+    raw rows are paged from the database and simplified window by window, so
+    the full history is never held in memory. Archived fixes in the range are
+    read one member-day at a time and merged in by time.
+    """
+    try:
+        to_ts = parse_time_param(request.args.get('to')) or time.time()
+        from_ts = parse_time_param(request.args.get('from')) or to_ts - TRACK_DEFAULT_WINDOW_HOURS * 3600
+        tolerance = float(request.args.get('tolerance', TRACK_DEFAULT_TOLERANCE_M))
+    except (TypeError, ValueError):
+        return jsonify({"error": "from/to must be timestamps and tolerance a number"}), 400
+    if from_ts > to_ts or to_ts - from_ts > TRACK_MAX_WINDOW_HOURS * 3600:
+        return jsonify({"error": f"from must precede to by at most {TRACK_MAX_WINDOW_HOURS:g} hours"}), 400
+    if not 0 <= tolerance <= TRACK_MAX_TOLERANCE_M:
+        return jsonify({"error": f"tolerance must be in [0, {TRACK_MAX_TOLERANCE_M:g}]"}), 400
+
+    supabase = clients.admin() or get_public_client()
+    if supabase is None:
+        return jsonify({"error": "Database not configured"}), 500
+    try:
+        if not in_caller_organization(supabase, crew_member_id):
+            return jsonify({"error": "Crew member not found"}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    organization_id = g.organization_id
+
+    counts = {"raw": 0}
+    def archived_points():
+        # One member-day run of the archive at a time
+        for _, _, lats, lons, timestamps in location_archive.query(organization_id, crew_member_id, from_ts, to_ts):
+            yield from zip(np.round(lats, 6).tolist(), np.round(lons, 6).tolist(), (timestamps / 1000).tolist())
+
+    def live_points():
+        rows = fetch_pages(lambda: (supabase.table('crew_locations')
+                                    .select('id, latitude, longitude, timestamp')
+                                    .eq('crew_member_id', crew_member_id)
+                                    .gte('timestamp', format_timestamp(from_ts))
+                                    .lte('timestamp', format_timestamp(to_ts))
+                                    .order('timestamp')
+                                    .order('id')),
+                           page_size=TRACK_PAGE_SIZE, max_rows=TRACK_MAX_RAW_POINTS)
+        archived_ids, day_begin, day_end = set(), None, None
+        for row in rows:
+            timestamp = parse_timestamp(row['timestamp'])
+            if day_begin is None or not day_begin <= timestamp < day_end:
+                day = day_of(timestamp)
+                day_begin, day_end = day_start(day), day_start(day) + 86400
+                archived_ids = set(location_archive.row_ids(organization_id, crew_member_id, day).tolist())
+            # Rows archived but not yet deleted by an interrupted archive run are skipped
+            if uuid.UUID(str(row['id'])).bytes not in archived_ids:
+                yield float(row['latitude']), float(row['longitude']), timestamp
+
+    def raw_points():
+        for point in heapq.merge(archived_points(), live_points(), key=lambda point: point[2]):
+            counts["raw"] += 1
+            yield point
+
+    points = simplify_stream(raw_points(), tolerance)
+    try:
+        # Pull the first page before responding so database errors still get a 500
+        first = list(itertools.islice(points, 1))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    def generate():
+        header = {
+            "crew_member_id": crew_member_id,
+            "from": format_timestamp(from_ts),
+            "to": format_timestamp(to_ts),
+            "tolerance_m": tolerance,
+            "fields": ["latitude", "longitude", "timestamp"],
+        }
+        yield json.dumps(header)[:-1] + ', "points": ['
+        returned = 0
+        chunk = []
+        try:
+            for point in itertools.chain(first, points):
+                chunk.append(json.dumps(point))
+                returned += 1
+                if len(chunk) >= 500:
+                    yield ("," if returned > len(chunk) else "") + ",".join(chunk)
+                    chunk = []
+            if chunk:
+                yield ("," if returned > len(chunk) else "") + ",".join(chunk)
+            trailer = {"raw_points": counts["raw"], "points_returned": returned}
+        except Exception as e:
+            # Headers are already sent; report the failure in the body instead
+            log.error("Error streaming track for %s: %s", crew_member_id, e)
+            if chunk:
+                yield ("," if returned > len(chunk) else "") + ",".join(chunk)
+            trailer = {"raw_points": counts["raw"], "points_returned": returned, "error": str(e)}
+        yield "], " + json.dumps(trailer)[1:]
+
+    return Response(generate(), mimetype='application/json')
+
+HISTORY_FIELDS = ["crew_member_id", "latitude", "longitude", "timestamp"]
+
+@app.route('/api/organization/<org_id>/locations/history', methods=['GET'])
+@member_required
+def get_organization_location_history(org_id, requesting_user):
+    """
+    Raw location history of an organization, archived and live rows merged
+    Requires a token of a member of the organization
+    Query params:
+    - member: only this crew member
+    - from / to: ISO 8601 or epoch time range (default: the last TRACK_DEFAULT_WINDOW_HOURS)
+    - bbox: min_lat,min_lon,max_lat,max_lon
+    - limit: most rows to return, earliest first (default and cap ARCHIVE_QUERY_MAX_ROWS)
+    Rows are compact [crew_member_id, latitude, longitude, epoch_timestamp]
+    (see "fields"), sorted by time. Archived segments are read only for the
+    days, members and columns the query needs.
+    """
+    try:
+        to_ts = parse_time_param(request.args.get('to')) or time.time()
+        from_ts = parse_time_param(request.args.get('from')) or to_ts - TRACK_DEFAULT_WINDOW_HOURS * 3600
+        limit = int(request.args.get('limit', ARCHIVE_QUERY_MAX_ROWS))
+        bbox = None
+        if request.args.get('bbox'):
+            bbox = [float(value) for value in request.args['bbox'].split(',')]
+            if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+                raise ValueError("bbox")
+    except (TypeError, ValueError):
+        return jsonify({"error": "from/to must be timestamps, limit an integer and bbox "
+                                 "min_lat,min_lon,max_lat,max_lon"}), 400
+    if from_ts > to_ts:
+        return jsonify({"error": "from must precede to"}), 400
+    if not 0 < limit <= ARCHIVE_QUERY_MAX_ROWS:
+        return jsonify({"error": f"limit must be in [1, {ARCHIVE_QUERY_MAX_ROWS}]"}), 400
+
+    supabase = clients.admin() or get_public_client()
+    if supabase is None:
+        return jsonify({"error": "Database not configured"}), 500
+    member = request.args.get('member')
+    try:
+        if member:
+            if str(fetch_member_organization(supabase, member)) != str(org_id):
+                return jsonify({"error": "Crew member not found in this organization"}), 404
+            member_ids = [member]
+        else:
+            member_ids = [str(row['id']) for row in (supabase.table('crew_members')
+                                                     .select('id')
+                                                     .eq('organization_id', org_id)
+                                                     .execute()).data or []]
+
+        started = time.perf_counter()
+        # Days are read in order, so once past the limit only the rest of that day can still sort before it
+        runs, archived_count, cut_day = [], 0, None
+        for run in location_archive.query(org_id, member, from_ts, to_ts, bbox, with_ids=True):
+            day = int(run[4][0]) // 86400000
+            if cut_day is not None and day > cut_day:
+                break
+            runs.append(run)
+            archived_count += len(run[2])
+            if cut_day is None and archived_count > limit:
+                cut_day = day
+        archived_ids = np.concatenate([run[1] for run in runs]) if runs else np.empty(0, dtype='V16')
+
+        live = []
+        for i in range(0, len(member_ids), ARCHIVE_DELETE_CHUNK):
+            def live_query(chunk=member_ids[i:i + ARCHIVE_DELETE_CHUNK]):
+                query = (supabase.table('crew_locations')
+                         .select('id, crew_member_id, latitude, longitude, timestamp')
+                         .in_('crew_member_id', chunk)
+                         .gte('timestamp', format_timestamp(from_ts))
+                         .lte('timestamp', format_timestamp(to_ts)))
+                if bbox is not None:
+                    query = (query.gte('latitude', bbox[0]).lte('latitude', bbox[2])
+                             .gte('longitude', bbox[1]).lte('longitude', bbox[3]))
+                return query.order('timestamp').order('id')
+            live.extend(fetch_pages(live_query, page_size=TRACK_PAGE_SIZE, max_rows=limit + 1))
+        if live and len(archived_ids):
+            # Rows archived but not yet deleted by an interrupted archive run
+            live = [row for row, duplicate in zip(live, np.isin(id_bytes(row['id'] for row in live), archived_ids))
+                    if not duplicate]
+
+        members = np.array([member_id for member_id, _, lats, _, _ in runs for member_id in [member_id] * len(lats)]
+                           + [str(row['crew_member_id']) for row in live], dtype=object)
+        lats = np.concatenate([run[2] for run in runs] + [np.array([float(row['latitude']) for row in live])])
+        lons = np.concatenate([run[3] for run in runs] + [np.array([float(row['longitude']) for row in live])])
+        timestamps = np.concatenate([run[4] / 1000 for run in runs]
+                                    + [np.array([parse_timestamp(row['timestamp']) for row in live])])
+        order = np.argsort(timestamps, kind='stable')
+        truncated = len(order) > limit
+        order = order[:limit]
+        rows = [list(row) for row in zip(members[order].tolist(), np.round(lats[order], 6).tolist(),
+                                         np.round(lons[order], 6).tolist(), timestamps[order].tolist())]
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        return jsonify({
+            "organization_id": org_id,
+            "from": format_timestamp(from_ts),
+            "to": format_timestamp(to_ts),
+            "fields": HISTORY_FIELDS,
+            "rows": rows,
+            "archived_rows": int(np.count_nonzero(order < archived_count)),
+            "live_rows": int(np.count_nonzero(order >= archived_count)),
+            "truncated": truncated,
+            "query_ms": round(elapsed_ms, 2)
+        }), 200
+    except Exception as e:
+        log.error("Error reading location history for org %s: %s", org_id, e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/organization/<org_id>/coverage/<int:z>/<int:x>/<int:y>', methods=['GET'])
+def get_organization_coverage_tile(org_id, z, x, y):
+    """
+    Plow-coverage heatmap tile (Web Mercator z/x/y, as for map tiles)
+    Query params:
+    - since: ISO 8601 or epoch time; cells last visited before it count as unvisited
+    Returns row-major (north-up) "counts" and "last_visit" (epoch seconds, 0 = never)
+    arrays of size x size cells, or 204 when nothing in the tile was visited.
+    """
+    if not COVERAGE_ENABLED:
+        return jsonify({"error": "Coverage tracking is disabled"}), 404
+    if not 0 <= z <= coverage_store.max_request_zoom or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return jsonify({"error": f"z must be in [0, {coverage_store.max_request_zoom}] "
+                                 "and x, y in [0, 2^z)"}), 400
+    try:
+        since = parse_time_param(request.args.get('since'))
+    except (TypeError, ValueError):
+        return jsonify({"error": "since must be a timestamp"}), 400
+
+    try:
+        tile = coverage_store.tile(org_id, z, x, y)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    if tile is not None and since is not None:
+        counts, last_visit = tile
+        stale = last_visit < since
+        tile = (np.where(stale, 0, counts), np.where(stale, 0, last_visit)) if not stale.all() else None
+    if tile is None:
+        return Response(status=204)
+    counts, last_visit = tile
+    response = jsonify({
+        "z": z,
+        "x": x,
+        "y": y,
+        "size": int(counts.shape[0]),
+        "visited_cells": int(np.count_nonzero(counts)),
+        "max_count": int(counts.max()),
+        "counts": counts.ravel().tolist(),
+        "last_visit": last_visit.ravel().tolist()
+    })
+    response.headers['Cache-Control'] = f'private, max-age={max(1, int(COVERAGE_FLUSH_INTERVAL))}'
+    return response, 200
+
+@app.route('/api/organization/<org_id>/rank-locations', methods=['POST'])
+@member_required
+def rank_organization_locations(org_id, requesting_user):
+    """
+    Rank the organization's locations by distance for many origins at once
+    Requires a token of a member of the organization
+    Expects JSON payload with:
+    - origins: list of {crew_member_id} (latest known position) or {latitude, longitude}
+    - location_ids (optional): only rank these locations
+    - limit (optional): keep the nearest N per origin
+    Returns one ranking of [location_id, distance_m] pairs per origin, nearest first.
+    """
+    data = request.get_json(silent=True) or {}
+    origins = data.get('origins')
+    if not isinstance(origins, list) or not origins:
+        return jsonify({"error": "Expected a non-empty list of origins"}), 400
+    if len(origins) > RANK_MAX_ORIGINS:
+        return jsonify({"error": f"Too many origins (max {RANK_MAX_ORIGINS})"}), 413
+    limit = data.get('limit')
+    if limit is not None and (not isinstance(limit, int) or limit <= 0):
+        return jsonify({"error": "limit must be a positive integer"}), 400
+    location_ids = data.get('location_ids')
+    if location_ids is not None and not isinstance(location_ids, list):
+        return jsonify({"error": "location_ids must be a list"}), 400
+
+    lats, lons, resolved, unresolved = [], [], [], []
+    for index, origin in enumerate(origins):
+        if not isinstance(origin, dict):
+            unresolved.append({"index": index, "error": "Origin must be an object"})
+            continue
+        if origin.get('crew_member_id'):
+            crew_member_id = str(origin['crew_member_id'])
+            position = position_index.get(crew_member_id)
+            # Members of other organizations are treated as unknown
+            if position is None or str(position_index.organization_of(crew_member_id)) != str(org_id):
+                unresolved.append({"index": index, "error": "No location found"})
+                continue
+            lat, lon = position['latitude'], position['longitude']
+        else:
+            try:
+                lat, lon = float(origin['latitude']), float(origin['longitude'])
+            except (KeyError, TypeError, ValueError):
+                unresolved.append({"index": index, "error": "Missing or invalid latitude/longitude"})
+                continue
+        lats.append(lat)
+        lons.append(lon)
+        resolved.append(origin)
+
+    try:
+        rankings = location_index.rank(org_id, lats, lons, location_ids, limit)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    return jsonify({
+        "rankings": [
+            {"origin": origin, "locations": [[location_id, round(distance, 1)] for location_id, distance in ranking]}
+            for origin, ranking in zip(resolved, rankings)
+        ],
+        "unresolved": unresolved
+    }), 200
+
+def write_dispatch(client, organization_id, pairs):
+    """Bulk insert pending assignments for (crew_member_id, location_id) pairs; existing ones are skipped"""
+    rows = [{"crew_member_id": crew_member_id, "location_id": location_id,
+             "organization_id": organization_id, "status": "pending"}
+            for crew_member_id, location_id in pairs]
+    if rows:
+        (client.table('crew_assignments')
+         .upsert(rows, on_conflict='crew_member_id,location_id,status', ignore_duplicates=True, returning='minimal')
+         .execute())
+        dispatcher.record_commit(len(rows))
+        response_cache.invalidate(organization_id)
+    return len(rows)
+
+@app.route('/api/organization/<org_id>/dispatch', methods=['POST'])
+@admin_required
+def dispatch_organization_sites(org_id, requesting_user):
+    """
+    Match the organization's unassigned active locations to the nearest available crews
+    Expects JSON payload with (all optional):
+    - capacity: most open assignments per crew member, existing ones included (default DISPATCH_DEFAULT_CAPACITY)
+    - max_distance_m: never assign a site farther than this from the crew
+    - crew_member_ids / location_ids: only dispatch these crews / sites
+    - confirm: false (default) returns a preview, true also writes the assignments
+    - assignments: with confirm, write these [{crew_member_id, location_id}] (e.g. an
+      edited preview) instead of solving again
+    Crews are members with a DISPATCH_ROLES role and a position from the last
+    DISPATCH_MAX_POSITION_AGE_MINUTES. Requires admin privileges for the organization.
+    """
+    if str(requesting_user.user_metadata.get('organization_id')) != str(org_id):
+        return jsonify({"error": "Admins can only dispatch their own organization"}), 403
+    data = request.get_json(silent=True) or {}
+    capacity = data.get('capacity', DISPATCH_DEFAULT_CAPACITY)
+    max_distance_m = data.get('max_distance_m')
+    if not isinstance(capacity, int) or capacity <= 0:
+        return jsonify({"error": "capacity must be a positive integer"}), 400
+    if max_distance_m is not None and (not isinstance(max_distance_m, (int, float)) or max_distance_m <= 0):
+        return jsonify({"error": "max_distance_m must be a positive number"}), 400
+    for key in ('crew_member_ids', 'location_ids', 'assignments'):
+        if data.get(key) is not None and not isinstance(data[key], list):
+            return jsonify({"error": f"{key} must be a list"}), 400
+
+    client = clients.admin()
+    if client is None:
+        return jsonify({"error": "Backend service key not configured"}), 500
+    try:
+        members = (client.table('crew_members')
+                   .select('id, name, role')
+                   .eq('organization_id', org_id)
+                   .in_('role', DISPATCH_ROLES)
+                   .execute()).data or []
+        names = {str(member['id']): member.get('name') for member in members}
+        sites = location_index.sites(org_id)
+
+        if data.get('confirm') and data.get('assignments') is not None:
+            pairs, rejected = [], []
+            for index, item in enumerate(data['assignments']):
+                if (not isinstance(item, dict) or str(item.get('crew_member_id')) not in names
+                        or str(item.get('location_id')) not in sites.position):
+                    rejected.append(index)
+                else:
+                    pairs.append((str(item['crew_member_id']), str(item['location_id'])))
+            if rejected:
+                return jsonify({"error": "Unknown crew member or location in assignments", "indices": rejected}), 400
+            return jsonify({"committed": True, "inserted": write_dispatch(client, org_id, pairs)}), 201
+
+        open_assignments = list(fetch_pages(lambda: (client.table('crew_assignments')
+                                                     .select('id, crew_member_id, location_id')
+                                                     .eq('organization_id', org_id)
+                                                     .in_('status', ['pending', 'in_progress'])
+                                                     .order('id'))))
+        load, taken = {}, set()
+        for row in open_assignments:
+            load[str(row['crew_member_id'])] = load.get(str(row['crew_member_id']), 0) + 1
+            taken.add(str(row['location_id']))
+
+        if not position_index.warmed:
+            position_index.wait_warm(POSITION_WARM_WAIT_SECONDS)
+        wanted = set(map(str, data['crew_member_ids'])) if data.get('crew_member_ids') is not None else None
+        cutoff = time.time() - DISPATCH_MAX_POSITION_AGE_MINUTES * 60
+        crews = [row for row in position_index.compact_rows([member_id for member_id in names
+                                                              if wanted is None or member_id in wanted])
+                 if row[3] >= cutoff]
+        wanted = set(map(str, data['location_ids'])) if data.get('location_ids') is not None else None
+        open_sites = [i for i, row in enumerate(sites.rows)
+                      if row.get('status') == 'active' and sites.ids[i] not in taken
+                      and (wanted is None or sites.ids[i] in wanted)]
+        if len(crews) > DISPATCH_MAX_CREWS or len(open_sites) > DISPATCH_MAX_SITES:
+            return jsonify({"error": f"Too large to dispatch at once (max {DISPATCH_MAX_CREWS} crews, "
+                                     f"{DISPATCH_MAX_SITES} sites)"}), 413
+
+        cost = cost_matrix([row[1] for row in crews], [row[2] for row in crews],
+                           sites.lats[open_sites], sites.lons[open_sites], max_distance_m)
+        room = [max(0, capacity - load.get(row[0], 0)) for row in crews]
+        assigned, solver, solve_ms = dispatcher.solve(cost, room)
+
+        preview, unassigned, total = [], [], 0.0
+        for k, i in enumerate(open_sites):
+            if assigned[k] < 0:
+                unassigned.append(sites.ids[i])
+                continue
+            crew_member_id = crews[assigned[k]][0]
+            distance = float(cost[k, assigned[k]])
+            total += distance
+            preview.append({
+                "crew_member_id": crew_member_id,
+                "crew_member_name": names.get(crew_member_id),
+                "location_id": sites.ids[i],
+                "location_name": sites.rows[i].get('name'),
+                "distance_m": round(distance, 1),
+            })
+        result = {
+            "solver": solver,
+            "solve_ms": round(solve_ms, 2),
+            "crews": len(crews),
+            "sites": len(open_sites),
+            "assignments": preview,
+            "unassigned_location_ids": unassigned,
+            "total_distance_m": round(total, 1),
+            "committed": False,
+        }
+        if data.get('confirm'):
+            result["inserted"] = write_dispatch(client, org_id, [(item['crew_member_id'], item['location_id'])
+                                                                 for item in preview])
+            result["committed"] = True
+            return jsonify(result), 201
+        return jsonify(result), 200
+    except Exception as e:
+        log.error("Error dispatching organization %s: %s", org_id, e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/hooks/locations', methods=['POST'])
+def locations_webhook():
+    """
+    Supabase database webhook for the locations table (INSERT/UPDATE/DELETE)
+    Keeps the in-memory spatial index current. Requires the X-Webhook-Secret header.
+    """
+    if not DB_WEBHOOK_SECRET or not hmac.compare_digest(request.headers.get('X-Webhook-Secret', ''),
+                                                         DB_WEBHOOK_SECRET):
+        return jsonify({"error": "Forbidden"}), 403
+
+    payload = request.get_json(silent=True) or {}
+    event_type = payload.get('type')
+    if event_type in ('INSERT', 'UPDATE') and payload.get('record'):
+        location_index.upsert(payload['record'])
+        distance_matrices.upsert(payload['record'])
+        response_cache.invalidate(payload['record'].get('organization_id'))
+    elif event_type == 'DELETE' and payload.get('old_record'):
+        location_index.remove(payload['old_record']['id'])
+        distance_matrices.remove(payload['old_record']['id'], payload['old_record'].get('organization_id'))
+        response_cache.invalidate(payload['old_record'].get('organization_id'))
+    else:
+        return jsonify({"error": "Unsupported webhook payload"}), 400
+    return jsonify({"message": "ok"}), 200
+
+@app.route('/api/organization/<org_id>/positions', methods=['GET'])
+@member_required
+def get_organization_positions(org_id, requesting_user):
+    """
+    Get the latest known position of every crew member in an organization
+    Requires a token of a member of the organization
+    Served entirely from the in-memory position index; MessagePack responses
+    are columnar (see encode_columns) with epoch times
+    """
+    # Right after startup, give the warm-up a moment to finish
+    if not position_index.warmed:
+        position_index.wait_warm(POSITION_WARM_WAIT_SECONDS)
+    if negotiated_mimetype() in MSGPACK_MIMETYPES:
+        return negotiated_response(None, packed=lambda: encode_position_columns(position_index.members_of(org_id)))
+    return negotiated_response(position_index.for_org(org_id))
+
+POSITION_FIELDS = ["crew_member_id", "latitude", "longitude", "timestamp", "last_active_at"]
+POSITION_SCALES = {"latitude": COORDINATE_SCALE, "longitude": COORDINATE_SCALE,
+                   "timestamp": TIME_SCALE, "last_active_at": TIME_SCALE}
+
+def encode_position_columns(crew_member_ids):
+    """Columnar, delta-encoded positions of these members for MessagePack responses"""
+    return encode_columns(POSITION_FIELDS, position_index.compact_rows(crew_member_ids), POSITION_SCALES)
+MEMBER_FIELDS = 'id, name, email, role, organization_id, user_id, last_active_at'
+
+@app.route('/api/organization/<org_id>/changes', methods=['GET'])
+@member_required
+def get_organization_changes(org_id, requesting_user):
+    """
+    Incremental sync for the crew tracking dashboard
+    Requires a token of a member of the organization (members are read with the service-role key)
+    Query params:
+    - since: cursor returned by the previous call (omit for a full snapshot)
+    Positions are returned as compact rows (see "fields") with epoch-second times,
+    columnar in MessagePack responses.
+    Honors If-None-Match with the ETag of the latest cursor (304 when unchanged).
+    """
+    if not position_index.warmed:
+        position_index.wait_warm(POSITION_WARM_WAIT_SECONDS)
+
+    # Take the cursor before reading so concurrent changes are re-sent next time
+    cursor = change_feed.cursor(org_id)
+    etag = f'W/"{cursor}"'
+    if etag in request.headers.get('If-None-Match', ''):
+        return '', 304, {'ETag': etag}
+
+    since_seq = change_feed.parse_cursor(org_id, request.args.get('since'))
+    if since_seq is not None:
+        position_ids, members, removed = change_feed.changes_since(org_id, since_seq)
+        payload = {
+            "cursor": cursor,
+            "full": False,
+            "members": members,
+            "removed": removed,
+            "positions": {"fields": POSITION_FIELDS, "rows": position_index.compact_rows(position_ids)},
+        }
+    else:
+        supabase = clients.admin() or get_public_client()
+        members = []
+        if supabase:
+            try:
+                members = (supabase.table('crew_members')
+                           .select(MEMBER_FIELDS)
+                           .eq('organization_id', org_id)
+                           .execute()).data or []
+            except Exception as e:
+                return jsonify({"error": str(e)}), 500
+        payload = {
+            "cursor": cursor,
+            "full": True,
+            "members": members,
+            "removed": [],
+            "positions": {"fields": POSITION_FIELDS,
+                          "rows": position_index.compact_rows(position_index.members_of(org_id))},
+        }
+
+    response = negotiated_response(payload, packed=lambda: dict(
+        payload, positions=encode_columns(POSITION_FIELDS, payload["positions"]["rows"], POSITION_SCALES)))
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/organization/<org_id>/stream', methods=['GET'])
+def stream_organization_positions(org_id):
+    """
+    Server-sent events stream of live crew positions for an organization
+    Query params:
+    - interval: minimum seconds between updates for this viewer (clamped server-side)
+    Sends a "snapshot" event first, then "position" events as compact rows
+    (see "fields") and "member_removed" events.
+    Needs a single worker process: events are fanned out within the worker
+    that ingested the fix, so a viewer on any other worker would miss them.
+    """
+    if not single_worker():
+        return jsonify({"error": "The live stream needs a single worker process (GUNICORN_WORKERS=1)"}), 503
+    try:
+        interval = float(request.args.get('interval', STREAM_DEFAULT_INTERVAL))
+    except ValueError:
+        return jsonify({"error": "interval must be a number"}), 400
+
+    subscriber = stream_hub.subscribe(org_id, interval)
+    if subscriber is None:
+        return jsonify({"error": "Too many open streams for this organization"}), 503
+
+    if not position_index.warmed:
+        position_index.wait_warm(POSITION_WARM_WAIT_SECONDS)
+    snapshot = encode_event('snapshot', {
+        "fields": POSITION_FIELDS,
+        "rows": position_index.compact_rows(position_index.members_of(org_id)),
+    })
+    return Response(
+        stream_hub.stream(subscriber, [snapshot]),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+def cached_response(organization_id, name, params, loader):
+    """
+    200 response served from the response cache; loader() returns the data on a miss.
+    JSON or MessagePack as negotiated, each format cached under its own key
+    """
+    mimetype = negotiated_mimetype()
+    if mimetype in MSGPACK_MIMETYPES:
+        body, hit = response_cache.get_or_load(organization_id, name, dict(params, format='msgpack'),
+                                               lambda: wire_codec.pack(loader()))
+    else:
+        wire_codec.record_json_response()
+        body, hit = response_cache.get_or_load(organization_id, name, params,
+                                               lambda: app.json.dumps(loader()).encode())
+    response = app.response_class(body, status=200, mimetype=mimetype)
+    response.headers['X-Cache'] = 'HIT' if hit else 'MISS'
+    response.vary.add('Accept')
+    return response
+
 @app.route('/api/organization/crew', methods=['GET'])
 def get_organization_crew():
     """
     Get all crew members for an organization
     Requires authentication token
+    JSON or MessagePack (Accept: application/msgpack), cached per format
     """
     org_id = request.args.get('org_id')
     
     if not org_id:
         return jsonify({"error": "Organization ID is required"}), 400
 
+    supabase = get_public_client()
     if supabase:
         try:
-            # Fetch crew members
-            response = (supabase.table('crew_members')
-                        .select('*')
-                        .eq('organization_id', org_id)
-                        .execute())
+            # Fetch crew members (read through the response cache)
+            def load_crew():
+                response = (supabase.table('crew_members')
+                            .select('*')
+                            .eq('organization_id', org_id)
+                            .execute())
+                return response.data
 
-            return jsonify(response.data), 200
+            return cached_response(org_id, 'crew', {}, load_crew)
         except Exception as e:
             return jsonify({"error": str(e)}), 500
     else:
@@ -232,74 +1452,155 @@ def get_organization_crew():
         return jsonify(mock_crew), 200
 
 # --- Route for Deleting Crew Member ---
+def crew_removal_task(member):
+    """
+    Job item: delete one crew member row, drop it from the in-memory indexes
+    and delete its auth user. Every step is idempotent, so retries are safe.
+    """
+    admin_supabase: Client = clients.admin()
+    member_id = member['id']
+    target_org_id = member['organization_id']
+    target_user_id = member.get('user_id')
+
+    admin_supabase.table('crew_members').delete(returning='minimal').eq('id', member_id).execute()
+    log.info("Deleted crew member record %s", member_id)
+    response_cache.invalidate(target_org_id)
+    position_index.remove_member(member_id)
+    geofence_engine.forget_member(member_id)
+    deadband_filter.forget_member(member_id)
+    change_feed.member_removed(target_org_id, member_id)
+    stream_hub.publish(target_org_id, 'member_removed', [(member_id, {"crew_member_id": member_id})])
+
+    if target_user_id:
+        log.info("Attempting to delete auth user %s", target_user_id)
+        delete_auth_user(admin_supabase, target_user_id)
+        log.info("Auth user %s deletion successful.", target_user_id)
+    else:
+        log.info("No associated auth user_id found for crew member %s", member_id)
+    return {"crew_member_id": member_id}
+
+def enqueue_crew_removals(members, organization_id):
+    """Queue a crew_removal job (honouring the Idempotency-Key header); returns (response, status)"""
+    idempotency_key = request.headers.get('Idempotency-Key')
+    job, created = jobs.create('crew_removal', organization_id, len(members), idempotency_key)
+    body = dict(job.to_dict(include_results=False), status_url=f"/jobs/{job.id}")
+    if not created:
+        return jsonify(dict(body, message="Crew member removal already requested")), 200
+    try:
+        jobs.enqueue(job, members, crew_removal_task)
+    except QueueFullError as e:
+        response = jsonify({"error": str(e)})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    # Removed members must not keep passing auth on cached identities, even before the job runs
+    # (only once it is queued: a refused removal leaves their tokens valid)
+    for member in members:
+        if member.get('user_id'):
+            identity_cache.invalidate_user(member['user_id'])
+    log.info("Queued crew removal job %s for %s crew member(s) in org %s", job.id, len(members), organization_id)
+    return jsonify(dict(body, message="Crew member removal queued")), 202
+
 # Prefix /api is removed by Vite proxy, so route is just /crew-members/<id>
 @app.route('/crew-members/<member_id>', methods=['DELETE'])
 @admin_required # Apply the admin check decorator
 def remove_crew_member(member_id, requesting_user): # requesting_user is passed by decorator
     """
-    Deletes a crew member record and attempts to delete the auth user.
+    Queues deletion of a crew member record and its auth user.
     Requires admin privileges.
+    Returns 202 with a job to poll at /jobs/<job_id>; an Idempotency-Key header
+    makes retried requests return the original job.
     """
     # Ensure service key is available
     if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
         return jsonify({"error": "Backend service key not configured"}), 500
-        
-    admin_supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+
+    # A retried request returns the job it already queued
+    existing_job = jobs.find_by_key('crew_removal', requesting_user.user_metadata.get('organization_id'),
+                                    request.headers.get('Idempotency-Key'))
+    if existing_job is not None:
+        return jsonify(dict(existing_job.to_dict(include_results=False), status_url=f"/jobs/{existing_job.id}",
+                            message="Crew member removal already requested")), 200
 
     try:
+        admin_supabase: Client = clients.admin()
+
         # 1. Get the crew member details, including org_id and user_id
-        member_response = admin_supabase.table('crew_members').select('user_id, organization_id').eq('id', member_id).maybe_single().execute()
+        member_response = admin_supabase.table('crew_members').select('id, user_id, organization_id').eq('id', member_id).maybe_single().execute()
 
-        if not member_response.data:
+        if not member_response or not member_response.data:
             return jsonify({"error": "Crew member not found"}), 404
 
         member_data = member_response.data
         target_org_id = member_data['organization_id']
-        target_user_id = member_data['user_id'] # Auth user ID to delete
 
         # 2. Verify admin belongs to the same organization
         requesting_user_org_id = requesting_user.user_metadata.get('organization_id')
         if str(requesting_user_org_id) != str(target_org_id): # Compare as strings for safety
-             print(f"Authorization failed: Admin org {requesting_user_org_id} != Target org {target_org_id}")
+             log.warning("Authorization failed: Admin org %s != Target org %s", requesting_user_org_id, target_org_id)
              return jsonify({"error": "Admin not authorized for this organization"}), 403
 
-        # 3. Delete from crew_members table
-        delete_crew_response = admin_supabase.table('crew_members').delete().eq('id', member_id).execute()
-        # Check for errors if needed, though delete often doesn't error if row not found
-
-        print(f"Deleted crew member record {member_id}")
+        # 3. Delete the crew_members row and the auth user in the background
+        return enqueue_crew_removals([member_data], target_org_id)
 
-        # 4. Attempt to delete from auth.users
-        auth_deletion_error = None
-        if target_user_id:
-            try:
-                print(f"Attempting to delete auth user {target_user_id}")
-                # Use the same admin_supabase client
-                auth_response = admin_supabase.auth.admin.delete_user(target_user_id)
-                print(f"Auth user {target_user_id} deletion successful.")
-            except Exception as auth_error:
-                # Check if the error is specifically the 403 we've been seeing
-                error_message = str(auth_error)
-                if 'Forbidden' in error_message or (hasattr(auth_error, 'status') and auth_error.status == 403):
-                     auth_deletion_error = "Forbidden by Supabase (403). Manual deletion might be required."
-                else:
-                    auth_deletion_error = error_message
-                print(f"Failed to delete auth user {target_user_id}: {auth_deletion_error}")
-                # Log this error but don't fail the request, as crew member is removed
-        else:
-             print(f"No associated auth user_id found for crew member {member_id}")
+    except Exception as e:
+        log.error("Error removing crew member %s: %s", member_id, e)
+        return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
 
+@app.route('/crew-members', methods=['DELETE'])
+@admin_required
+def remove_crew_members_bulk(requesting_user):
+    """
+    Queues deletion of several crew members of the admin's organization.
+    Requires admin privileges.
+    Expects JSON payload: {"ids": ["...", ...]}
+    Ids that do not exist in the admin's organization are reported as not_found.
+    """
+    if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
+        return jsonify({"error": "Backend service key not configured"}), 500
 
-        response_data = {"message": "Crew member removed successfully"}
-        if auth_deletion_error:
-            response_data["warning"] = f"Auth user deletion failed: {auth_deletion_error}"
+    data = request.get_json(silent=True) or {}
+    member_ids = data.get('ids')
+    if not isinstance(member_ids, list) or not member_ids or not all(isinstance(i, str) for i in member_ids):
+        return jsonify({"error": "Expected a non-empty list of crew member ids"}), 400
+    member_ids = list(dict.fromkeys(member_ids))
+    if len(member_ids) > BULK_DELETE_MAX_IDS:
+        return jsonify({"error": f"Too many ids in one request (max {BULK_DELETE_MAX_IDS})"}), 413
 
-        return jsonify(response_data), 200
+    admin_org_id = requesting_user.user_metadata.get('organization_id')
+    try:
+        admin_supabase: Client = clients.admin()
+        # One set-based lookup, scoped to the admin's organization
+        response = (admin_supabase.table('crew_members')
+                    .select('id, user_id, organization_id')
+                    .eq('organization_id', admin_org_id)
+                    .in_('id', member_ids)
+                    .execute())
+        members = response.data or []
+        found = {str(member['id']) for member in members}
+        not_found = [member_id for member_id in member_ids if member_id not in found]
+        if not members:
+            return jsonify({"error": "No matching crew members found", "not_found": not_found}), 404
 
+        result, status_code = enqueue_crew_removals(members, admin_org_id)
+        if status_code in (200, 202):
+            result = jsonify(dict(result.get_json(), not_found=not_found))
+        return result, status_code
     except Exception as e:
-        print(f"Error removing crew member {member_id}: {e}")
+        log.error("Error removing crew members: %s", e)
         return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+@admin_required
+def get_job(job_id, requesting_user):
+    """
+    Status, progress and per-item results of a background job.
+    Requires admin privileges in the organization the job belongs to.
+    """
+    job = jobs.get(job_id)
+    if job is None or job.organization_id != str(requesting_user.user_metadata.get('organization_id')):
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict()), 200
+
 # --- Route for Adding Crew Member ---
 # Prefix /api is removed by Vite proxy, so route is just /crew-members
 @app.route('/crew-members', methods=['POST'])
@@ -324,63 +1625,54 @@ def add_crew_member(requesting_user):
 
     # Ensure service key is available and initialize client *before* try block
     if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
-        print("CRITICAL: Backend service key not configured in environment.")
+        log.critical("Backend service key not configured in environment.")
         return jsonify({"error": "Backend service key not configured"}), 500
         
     try:
-        print("DEBUG: Initializing admin_supabase client...")
-        admin_supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
-        print("DEBUG: admin_supabase client initialized.")
+        log.debug("Getting shared admin_supabase client...")
+        admin_supabase: Client = clients.admin()
+        log.debug("admin_supabase client ready.")
     except Exception as client_init_error:
-        print(f"CRITICAL: Failed to initialize admin_supabase client: {client_init_error}")
+        log.critical("Failed to initialize admin_supabase client: %s", client_init_error)
         return jsonify({"error": "Failed to initialize backend Supabase client"}), 500
 
     authUserId = None # Initialize authUserId
 
     try:
         # 1. Check if email already exists in crew_members for this org
-        print("DEBUG: Checking crew_members table...")
+        log.debug("Checking crew_members table...")
         # Removed .maybe_single() - expecting a list response now
         existing_crew_response = admin_supabase.table('crew_members').select('id', count='exact').eq('email', email).eq('organization_id', admin_org_id).limit(1).execute()
-        print(f"DEBUG: existing_crew_response type: {type(existing_crew_response)}") # Log type first
+        log.debug("existing_crew_response type: %s", type(existing_crew_response))
         if existing_crew_response is None:
              raise Exception("Supabase client returned None when checking crew_members.")
         # Now log data access attempt
-        print(f"DEBUG: Accessing existing_crew_response.data...")
+        log.debug("Accessing existing_crew_response.data...")
         # Check if the data list is not empty
         if existing_crew_response.data: 
-            print(f"DEBUG: Found existing crew member data: {existing_crew_response.data}")
+            log.debug("Found existing crew member data: %s", existing_crew_response.data)
             return jsonify({"error": f"Email {email} already exists in this organization's crew list"}), 409 # Conflict
         else:
-             print(f"DEBUG: No existing crew member data found (list is empty).")
+             log.debug("No existing crew member data found (list is empty).")
 
-        # 2. Check if email exists globally in auth.users (using admin list_users)
+        # 2. Check if email exists globally in auth.users (email -> auth user index)
         # Note: This prevents adding someone who might exist in another org or as an orphaned user.
         # Adjust this logic if you want different behavior (e.g., linking existing auth users).
         try:
-            print("DEBUG: Checking auth.users table (fetching all users)...")
-            # Fetch all users and filter manually as 'filter' argument is not supported in this version
-            list_users_response = admin_supabase.auth.admin.list_users()
-            print(f"DEBUG: list_users_response type: {type(list_users_response)}, users: {'Yes' if getattr(list_users_response, 'users', None) else 'No'}")
-            if list_users_response is None:
-                 raise Exception("Supabase client returned None when listing auth users.")
-            if list_users_response.users:
-                 found_global_user = False
-                 for user in list_users_response.users:
-                      if user.email == email:
-                           print(f"DEBUG: Found global user with matching email: {user.id}")
-                           found_global_user = True
-                           break
-                 if found_global_user:
-                      return jsonify({"error": f"User with email {email} already exists in the authentication system"}), 409 # Conflict
-            print("DEBUG: No global user found with that email.")
+            log.debug("Checking auth user directory...")
+            auth_directory.ensure_loaded(clients.admin)
+            existing_user_id = auth_directory.find(admin_supabase, email)
+            if existing_user_id:
+                log.debug("Found global user with matching email: %s", existing_user_id)
+                return jsonify({"error": f"User with email {email} already exists in the authentication system"}), 409 # Conflict
+            log.debug("No global user found with that email.")
         except Exception as list_err:
-             # Handle potential errors from list_users itself
-             print(f"Warning: Could not definitively check global auth users for {email}: {list_err}")
+             # Handle potential errors from the lookup itself
+             log.warning("Could not definitively check global auth users for %s: %s", email, list_err)
              # If checking fails, maybe proceed cautiously? Or return error? Let's proceed for now.
 
         # 3. Invite user via email (creates auth user and sends invite)
-        print(f"DEBUG: Inviting user {email}...")
+        log.debug("Inviting user %s...", email)
         invite_response = admin_supabase.auth.admin.invite_user_by_email(
             email,
             options={
@@ -393,7 +1685,7 @@ def add_crew_member(requesting_user):
                 'redirect_to': f"{os.getenv('FRONTEND_URL', 'http://localhost:5173')}/set-password" 
             }
         )
-        print(f"DEBUG: invite_response type: {type(invite_response)}, user: {'Yes' if getattr(invite_response, 'user', None) else 'No'}")
+        log.debug("invite_response type: %s, user: %s", type(invite_response), 'Yes' if getattr(invite_response, 'user', None) else 'No')
         # Add explicit check for None response
         if invite_response is None:
              raise Exception("Supabase client returned None when inviting user.")
@@ -408,10 +1700,11 @@ def add_crew_member(requesting_user):
 
         new_auth_user = invite_response.user
         authUserId = new_auth_user.id # Assign authUserId here
-        print(f"Auth user created/invited with ID: {authUserId}")
+        auth_directory.add(email, authUserId)
+        log.info("Auth user created/invited with ID: %s", authUserId)
 
         # 4. Insert into crew_members table
-        print(f"DEBUG: Inserting into crew_members table for user {authUserId}...")
+        log.debug("Inserting into crew_members table for user %s...", authUserId)
         # Correct syntax: execute insert, then optionally select the inserted row
         insert_payload = {
             'name': name,
@@ -423,25 +1716,28 @@ def add_crew_member(requesting_user):
         # Execute the insert operation. By default, it returns the inserted data with 'return=representation'
         insert_response = admin_supabase.table('crew_members').insert(insert_payload).execute() 
         
-        print(f"DEBUG: insert_response type: {type(insert_response)}") # Log type
+        log.debug("insert_response type: %s", type(insert_response))
         if insert_response is None:
              raise Exception("Supabase client returned None when inserting into crew_members.")
              
-        print(f"DEBUG: Accessing insert_response.data...")
+        log.debug("Accessing insert_response.data...")
         if not insert_response.data:
-             print(f"CRITICAL ERROR: Auth user {authUserId} created but failed to insert into crew_members. Response: {insert_response}")
+             log.critical("Auth user %s created but failed to insert into crew_members. Response: %s", authUserId, insert_response)
              # Consider attempting to delete the auth user here if insert fails
              # admin_supabase.auth.admin.delete_user(new_auth_user.id) # Be cautious with auto-cleanup
              raise Exception("Failed to insert crew member record after user invitation (no data returned).")
 
         # Assuming insert_response.data contains the inserted row (list with one dict)
         inserted_data = insert_response.data[0] 
-        print(f"Successfully added {email} to crew_members for org {admin_org_id}")
+        position_index.set_member_org(inserted_data['id'], admin_org_id)
+        change_feed.member_upserted(admin_org_id, inserted_data)
+        response_cache.invalidate(admin_org_id)
+        log.info("Successfully added %s to crew_members for org %s", email, admin_org_id)
         return jsonify(inserted_data), 201 # Return the created crew member record
 
     except Exception as e:
         # Log the detailed error
-        print(f"Error adding crew member {email}: {e}")
+        log.error("Error adding crew member %s: %s", email, e)
         # Provide a generic error to the client
         error_message = str(e)
         status_code = 500
@@ -456,6 +1752,256 @@ def add_crew_member(requesting_user):
         return jsonify({"error": f"Failed to add crew member: {error_message}"}), status_code
 
 
+# --- Routes for Bulk Onboarding ---
+# Prefix /api is removed by Vite proxy, so route is just /crew-members/bulk
+@app.route('/crew-members/bulk', methods=['POST'])
+@admin_required
+def add_crew_members_bulk(requesting_user):
+    """
+    Onboards many crew members at once into the admin's organization.
+    Requires admin privileges.
+    Accepts JSON ({"members": [{"name", "email", "role"}, ...]} or a bare list),
+    a text/csv body or a multipart "file" upload with a name,email,role header.
+    Query params:
+    - async: "true" to always run as a background job
+    Small batches return per-row results directly; larger ones return 202 with
+    a job id to poll at /crew-members/bulk/<job_id> (an Idempotency-Key header
+    makes a retried request return the original job).
+    """
+    admin_org_id = requesting_user.user_metadata.get('organization_id')
+    if not admin_org_id:
+        return jsonify({"error": "Admin user is missing organization ID in metadata"}), 400
+    if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
+        return jsonify({"error": "Backend service key not configured"}), 500
+
+    try:
+        if 'file' in request.files:
+            rows = parse_csv_rows(request.files['file'].read().decode('utf-8-sig'))
+        elif request.mimetype in ('text/csv', 'application/csv'):
+            rows = parse_csv_rows(request.get_data(as_text=True))
+        else:
+            data = request.get_json(silent=True)
+            rows = data.get('members') if isinstance(data, dict) else data
+    except (UnicodeDecodeError, csv.Error) as e:
+        return jsonify({"error": f"Could not parse CSV: {e}"}), 400
+    if not isinstance(rows, list) or not rows:
+        return jsonify({"error": "Expected a non-empty list of members (JSON or CSV)"}), 400
+    if len(rows) > BULK_ONBOARD_MAX_ROWS:
+        return jsonify({"error": f"Too many members in one batch (max {BULK_ONBOARD_MAX_ROWS})"}), 413
+
+    members, rejected = validate_rows(rows)
+    onboarding = BulkOnboarding(clients.admin(), admin_org_id,
+                                f"{os.getenv('FRONTEND_URL', 'http://localhost:5173')}/set-password")
+
+    def run(job=None):
+        try:
+            results = onboarding.run(members, job) if members else []
+        finally:
+            response_cache.invalidate(admin_org_id)
+        return sorted(rejected + results, key=lambda result: result['index'])
+
+    if len(members) > BULK_ONBOARD_SYNC_MAX_ROWS or request.args.get('async') == 'true':
+        job, created = jobs.create('crew_onboarding', admin_org_id, len(rows), request.headers.get('Idempotency-Key'))
+        if not created:
+            return jsonify({"job_id": job.id, "status_url": f"/crew-members/bulk/{job.id}", "total": job.total}), 200
+        job.advance(len(rejected))
+        jobs.run_in_background(job, run)
+        log.info("Queued bulk onboarding job %s for %s crew members in org %s", job.id, len(members), admin_org_id)
+        return jsonify({
+            "job_id": job.id,
+            "status_url": f"/crew-members/bulk/{job.id}",
+            "total": len(rows)
+        }), 202
+
+    try:
+        results = run()
+        return jsonify({"summary": summarize(results), "results": results}), 200
+    except Exception as e:
+        log.error("Error bulk onboarding crew members: %s", e)
+        return jsonify({"error": f"Failed to add crew members: {str(e)}"}), 500
+
+@app.route('/crew-members/bulk/<job_id>', methods=['GET'])
+@admin_required
+def get_crew_members_bulk_job(job_id, requesting_user):
+    """
+    Progress of a bulk onboarding job; per-row results once it has finished.
+    Requires admin privileges.
+    """
+    job = jobs.get(job_id)
+    if job is None or job.kind != 'crew_onboarding' or \
+            str(job.organization_id) != str(requesting_user.user_metadata.get('organization_id')):
+        return jsonify({"error": "Job not found"}), 404
+    data = job.to_dict()
+    if 'results' in data:
+        data['summary'] = summarize(data['results'])
+    return jsonify(data), 200
+
+
+# --- Route for archiving old locations ---
+@app.route('/admin/archive', methods=['POST'])
+@admin_required
+def archive_locations(requesting_user):
+    """
+    Moves the admin's organization's crew_locations rows older than
+    older_than_days (default ARCHIVE_AFTER_DAYS) into the columnar archive,
+    at most max_days days (default ARCHIVE_MAX_DAYS_PER_RUN) per run, as a
+    background job polled at /jobs/<job_id>. Requires admin privileges.
+    """
+    admin_org_id = requesting_user.user_metadata.get('organization_id')
+    if not admin_org_id:
+        return jsonify({"error": "Admin user is missing organization ID in metadata"}), 400
+    data = request.get_json(silent=True) or {}
+    older_than_days = data.get('older_than_days', ARCHIVE_AFTER_DAYS)
+    max_days = data.get('max_days', ARCHIVE_MAX_DAYS_PER_RUN)
+    if not isinstance(older_than_days, (int, float)) or older_than_days < 1:
+        return jsonify({"error": "older_than_days must be a number of at least 1"}), 400
+    if not isinstance(max_days, int) or max_days < 1:
+        return jsonify({"error": "max_days must be a positive integer"}), 400
+    client = clients.admin()
+    if client is None:
+        return jsonify({"error": "Backend service key not configured"}), 500
+
+    try:
+        member_ids = [str(row['id']) for row in (client.table('crew_members')
+                                                 .select('id')
+                                                 .eq('organization_id', admin_org_id)
+                                                 .execute()).data or []]
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    job, created = jobs.create('location_archive', admin_org_id, max_days, request.headers.get('Idempotency-Key'))
+    body = dict(job.to_dict(include_results=False), status_url=f"/jobs/{job.id}")
+    if not created:
+        return jsonify(dict(body, message="Archiving already requested")), 200
+
+    def run(job):
+        return location_archive.compact(client, admin_org_id, member_ids, time.time() - older_than_days * 86400,
+                                        max_days=max_days, progress=lambda result: job.advance())
+
+    jobs.run_in_background(job, run)
+    log.info("Queued location archive job %s for org %s", job.id, admin_org_id)
+    return jsonify(dict(body, message="Archiving queued")), 202
+
+
+# --- Route for backend runtime stats ---
+@app.route('/admin/stats', methods=['GET'])
+@admin_required
+def get_admin_stats(requesting_user):
+    """
+    Returns counters for the backend's in-process caches and connection pools.
+    Requires admin privileges.
+    """
+    return jsonify({
+        "identity_cache": identity_cache.stats(),
+        "supabase_pools": clients.stats(),
+        "location_buffer": location_buffer.stats(),
+        "location_spool": location_spool.stats() if LOCATION_SPOOL_ENABLED else None,
+        "position_index": position_index.stats(),
+        "change_feed": change_feed.stats(),
+        "stream_hub": stream_hub.stats(),
+        "location_index": location_index.stats(),
+        "route_matrices": distance_matrices.stats(),
+        "dispatch": dispatcher.stats(),
+        "coverage": coverage_store.stats(),
+        "archive": location_archive.stats(),
+        "geofences": geofence_engine.stats(),
+        "deadband_filter": deadband_filter.stats(),
+        "auth_directory": auth_directory.stats(),
+        "jobs": jobs.stats(),
+        "profiler": request_profiler.stats(),
+        "response_cache": response_cache.stats(),
+        "wire": wire_codec.stats()
+    }), 200
+
+# --- Routes for profiler captures ---
+@app.route('/admin/profiles', methods=['GET'])
+@admin_required
+def list_profiles(requesting_user):
+    """
+    Lists slow-request captures (newest first) of the admin's organization and
+    requests without one. Query params: limit (default 100).
+    Requires admin privileges.
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    admin_org_id = requesting_user.user_metadata.get('organization_id') if requesting_user.user_metadata else None
+    return jsonify({
+        "profiler": request_profiler.stats(),
+        "captures": request_profiler.list_captures(admin_org_id, limit)
+    }), 200
+
+def find_profile(capture_id, requesting_user):
+    """Capture metadata visible to the requesting admin, or None"""
+    metadata = request_profiler.get_capture(capture_id)
+    if metadata is None:
+        return None
+    admin_org_id = requesting_user.user_metadata.get('organization_id') if requesting_user.user_metadata else None
+    if metadata.get('organization_id') not in (None, str(admin_org_id)):
+        return None
+    return metadata
+
+@app.route('/admin/profiles/<capture_id>', methods=['GET'])
+@admin_required
+def get_profile(capture_id, requesting_user):
+    """Returns a capture's metadata including its upstream call timeline. Requires admin privileges."""
+    metadata = find_profile(capture_id, requesting_user)
+    if metadata is None:
+        return jsonify({"error": "Capture not found"}), 404
+    return jsonify(metadata), 200
+
+@app.route('/admin/profiles/<capture_id>/download', methods=['GET'])
+@admin_required
+def download_profile(capture_id, requesting_user):
+    """
+    Downloads a capture's profile: a .pstats file (load with pstats/snakeviz) or
+    collapsed stacks (flamegraph.pl / speedscope). Requires admin privileges.
+    """
+    metadata = find_profile(capture_id, requesting_user)
+    if metadata is None:
+        return jsonify({"error": "Capture not found"}), 404
+    path = request_profiler.profile_path(metadata)
+    if path is None:
+        return jsonify({"error": "Capture has no profile (request was not profiled)"}), 404
+    return send_file(path, as_attachment=True, download_name=os.path.basename(path),
+                     mimetype='application/octet-stream' if path.endswith('.pstats') else 'text/plain')
+
+# Gauges read from the component stats at scrape time
+metrics_registry.gauge('location_buffer_queue_depth', 'Location fixes waiting for a bulk insert',
+                       lambda: {None: location_buffer.stats()['queue_depth']})
+if LOCATION_SPOOL_ENABLED:
+    metrics_registry.gauge('location_spool_depth', 'Location fixes spooled locally and not yet forwarded',
+                           lambda: {None: location_spool.stats()['depth']})
+    metrics_registry.gauge('location_spool_lag_seconds', 'Age of the oldest location fix not yet forwarded',
+                           lambda: {None: location_spool.stats()['lag_seconds']})
+metrics_registry.gauge('position_index_members', 'Crew members in the latest-position index',
+                       lambda: {None: position_index.stats()['members']})
+metrics_registry.gauge('stream_subscribers', 'Open position stream connections',
+                       lambda: {None: stream_hub.stats()['subscribers']})
+metrics_registry.gauge('supabase_pool_checked_out', 'Supabase HTTP requests in flight per pool',
+                       lambda: {(('pool', name),): pool['checked_out'] for name, pool in clients.stats().items()})
+metrics_registry.gauge('supabase_pool_reuse_ratio', 'Share of Supabase requests served on a reused connection',
+                       lambda: {(('pool', name),): pool['reuse_rate'] for name, pool in clients.stats().items()})
+metrics_registry.gauge('job_queued_items', 'Job items waiting for a worker',
+                       lambda: {None: jobs.stats()['queued_items']})
+metrics_registry.gauge('response_cache_hit_ratio', 'Share of response cache lookups served from the cache',
+                       lambda: {None: response_cache.stats()['hit_rate']})
+
+# --- Prometheus metrics ---
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Request, Supabase call and component metrics of this worker process in the
+    Prometheus text format. Requires `Authorization: Bearer <METRICS_TOKEN>`
+    when METRICS_TOKEN is set.
+    """
+    if METRICS_TOKEN:
+        auth_header = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(auth_header, f'Bearer {METRICS_TOKEN}'):
+            return jsonify({"error": "Invalid metrics token"}), 401
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+
 if __name__ == '__main__':
     # Bind to 0.0.0.0 to listen on all interfaces (including localhost and 127.0.0.1)
     app.run(host='0.0.0.0', debug=True, port=8080) # Changed port to 8080
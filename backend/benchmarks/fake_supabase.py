@@ -0,0 +1,332 @@
+"""
+Local stand-in for the Supabase endpoints the backend uses: PostgREST tables
+and RPCs under /rest/v1 and the GoTrue admin/invite API under /auth/v1.
+State is in memory; every request sleeps for the configured latency first.
+"""
+import json
+import random
+import threading
+import time
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+OBJECT_MEDIA_TYPE = 'application/vnd.pgrst.object+json'
+
+
+def _coerce(value):
+    if value == 'null':
+        return None
+    if value in ('true', 'false'):
+        return value == 'true'
+    return value
+
+
+def _matches(row, column, condition):
+    operator, _, operand = condition.partition('.')
+    value = row.get(column)
+    if operator == 'eq':
+        return str(value) == operand
+    if operator == 'neq':
+        return str(value) != operand
+    if operator == 'in':
+        return str(value) in {item.strip('"') for item in operand.strip('()').split(',')}
+    if operator == 'is':
+        return value is _coerce(operand)
+    if value is None:
+        return False
+    if operator == 'gte':
+        return str(value) >= operand
+    if operator == 'lte':
+        return str(value) <= operand
+    if operator == 'gt':
+        return str(value) > operand
+    if operator == 'lt':
+        return str(value) < operand
+    raise ValueError(f"Unsupported filter operator {operator}")
+
+
+class FakeSupabase:
+    """
+    In-memory Supabase stand-in. `latency_ms` is added to every call,
+    per service ('postgrest', 'auth') or as one number for both, plus up
+    to `jitter_ms` of uniform noise.
+    """
+
+    RESERVED_PARAMS = {'select', 'order', 'limit', 'offset', 'on_conflict', 'columns'}
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, seed=None):
+        if not isinstance(latency_ms, dict):
+            latency_ms = {'postgrest': latency_ms, 'auth': latency_ms}
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.tables = {}
+        self.keys = {}  # table -> ids of its rows, built on the first upsert
+        self.users = {}  # auth user id -> user dict
+        self.calls = {}  # "METHOD target" -> count
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    # --- Seeding ---
+
+    def add_user(self, email, user_metadata=None, user_id=None):
+        user = {
+            "id": user_id or str(uuid.uuid4()),
+            "aud": "authenticated",
+            "role": "authenticated",
+            "email": email,
+            "created_at": "2024-01-01T00:00:00Z",
+            "app_metadata": {"provider": "email"},
+            "user_metadata": user_metadata or {},
+        }
+        with self._lock:
+            self.users[user["id"]] = user
+        return user
+
+    def insert(self, table, rows):
+        with self._lock:
+            self._extend(table, [dict(row) for row in rows])
+
+    def _extend(self, table, rows):
+        self.tables.setdefault(table, []).extend(rows)
+        if table in self.keys:
+            self.keys[table].update(row.get('id') for row in rows)
+
+    def count(self, table):
+        with self._lock:
+            return len(self.tables.get(table, []))
+
+    # --- Serving ---
+
+    def start(self, host='127.0.0.1', port=0):
+        fake = self
+
+        class Handler(_Handler):
+            supabase = fake
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='fake-supabase', daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def delay(self, service):
+        latency = self.latency_ms.get(service, 0.0)
+        if self.jitter_ms:
+            latency += self._random.uniform(0, self.jitter_ms)
+        if latency > 0:
+            time.sleep(latency / 1000.0)
+
+    def count_call(self, key):
+        with self._lock:
+            self.calls[key] = self.calls.get(key, 0) + 1
+
+    # --- PostgREST ---
+
+    def _filtered(self, table, params):
+        rows = self.tables.get(table, [])
+        for column, conditions in params.items():
+            if column in self.RESERVED_PARAMS:
+                continue
+            for condition in conditions:
+                rows = [row for row in rows if _matches(row, column, condition)]
+        return rows
+
+    def select(self, table, params):
+        with self._lock:
+            rows = list(self._filtered(table, params))
+        for order in reversed(params.get('order', [''])[0].split(',')):
+            if order:
+                column, _, direction = order.partition('.')
+                rows.sort(key=lambda row: (row.get(column) is None, str(row.get(column))),
+                          reverse=direction.startswith('desc'))
+        offset = int(params.get('offset', ['0'])[0])
+        limit = params.get('limit')
+        rows = rows[offset:offset + int(limit[0])] if limit else rows[offset:]
+        columns = params.get('select', ['*'])[0]
+        if columns != '*':
+            names = [name.strip() for name in columns.split(',')]
+            rows = [{name: row.get(name) for name in names} for row in rows]
+        return rows
+
+    def insert_rows(self, table, body, ignore_duplicates=False):
+        rows = body if isinstance(body, list) else [body]
+        stored = []
+        for row in rows:
+            row = dict(row)
+            row.setdefault('id', str(uuid.uuid4()))
+            if row.get('timestamp') == 'now()':
+                row['timestamp'] = time.strftime('%Y-%m-%dT%H:%M:%S+00:00', time.gmtime())
+            stored.append(row)
+        with self._lock:
+            if ignore_duplicates:
+                # Upsert with resolution=ignore-duplicates on the primary key
+                if table not in self.keys:
+                    self.keys[table] = {row.get('id') for row in self.tables.get(table, [])}
+                seen = self.keys[table]
+                unique = {}
+                for row in stored:
+                    if row['id'] not in seen:
+                        unique.setdefault(row['id'], row)
+                stored = list(unique.values())
+            self._extend(table, stored)
+        return stored
+
+    def update_rows(self, table, params, changes):
+        with self._lock:
+            rows = self._filtered(table, params)
+            for row in rows:
+                row.update(changes)
+            return [dict(row) for row in rows]
+
+    def delete_rows(self, table, params):
+        with self._lock:
+            doomed = {id(row) for row in self._filtered(table, params)}
+            kept = [row for row in self.tables.get(table, []) if id(row) not in doomed]
+            removed = [row for row in self.tables.get(table, []) if id(row) in doomed]
+            self.tables[table] = kept
+            self.keys.pop(table, None)
+            return removed
+
+    def rpc(self, name, body):
+        if name == 'auth_user_id_by_email':
+            email = (body.get('p_email') or '').lower()
+            with self._lock:
+                for user in self.users.values():
+                    if (user.get('email') or '').lower() == email:
+                        return 200, user['id']
+            return 200, None
+        return 404, {"code": "PGRST202", "message": f"Could not find the function public.{name}"}
+
+    # --- GoTrue ---
+
+    def get_user(self, user_id):
+        with self._lock:
+            return self.users.get(user_id)
+
+    def list_users(self, page, per_page):
+        with self._lock:
+            users = list(self.users.values())
+        return users[(page - 1) * per_page:page * per_page]
+
+    def delete_user(self, user_id):
+        with self._lock:
+            return self.users.pop(user_id, None)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without TCP_NODELAY every
+    # response can stall ~40ms on Nagle + delayed ACK
+    disable_nagle_algorithm = True
+    supabase = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=None):
+        payload = b'' if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length)) if length else None
+
+    def _route(self):
+        parsed = urllib.parse.urlparse(self.path)
+        params = urllib.parse.parse_qs(parsed.query, keep_blank_values=True)
+        if parsed.path.startswith('/rest/v1/'):
+            return 'postgrest', parsed.path[len('/rest/v1/'):], params
+        if parsed.path.startswith('/auth/v1/'):
+            return 'auth', parsed.path[len('/auth/v1/'):], params
+        return None, parsed.path, params
+
+    def _handle(self, method):
+        service, target, params = self._route()
+        body = self._body() if method in ('POST', 'PATCH', 'PUT', 'DELETE') else None
+        if service is None:
+            return self._send(404, {"message": "Not found"})
+        self.supabase.count_call(f'{method} {service}:{target.split("/")[0]}')
+        self.supabase.delay(service)
+        try:
+            if service == 'postgrest':
+                return self._postgrest(method, target, params, body)
+            return self._auth(method, target, params, body)
+        except ValueError as e:
+            return self._send(400, {"code": "PGRST100", "message": str(e)})
+
+    def _postgrest(self, method, target, params, body):
+        fake = self.supabase
+        prefer = self.headers.get('Prefer') or ''
+        minimal = 'return=minimal' in prefer
+        if target.startswith('rpc/'):
+            return self._send(*fake.rpc(target[4:], body or {}))
+        if method == 'GET':
+            rows = fake.select(target, params)
+        elif method == 'POST':
+            rows = fake.insert_rows(target, body, 'resolution=ignore-duplicates' in prefer)
+            return self._send(201, None if minimal else rows)
+        elif method == 'PATCH':
+            rows = fake.update_rows(target, params, body or {})
+        elif method == 'DELETE':
+            rows = fake.delete_rows(target, params)
+        else:
+            return self._send(405, {"message": "Method not allowed"})
+        if minimal:
+            return self._send(204 if method != 'GET' else 200, None if method != 'GET' else rows)
+        if OBJECT_MEDIA_TYPE in (self.headers.get('Accept') or ''):
+            if len(rows) != 1:
+                return self._send(406, {"code": "PGRST116", "details": f"The result contains {len(rows)} rows",
+                                        "hint": None, "message": "JSON object requested, multiple (or no) rows returned"})
+            return self._send(200, rows[0])
+        return self._send(200, rows)
+
+    def _auth(self, method, target, params, body):
+        fake = self.supabase
+        if target == 'admin/users' and method == 'GET':
+            page = int(params.get('page', ['1'])[0] or 1)
+            per_page = int(params.get('per_page', ['50'])[0] or 50)
+            return self._send(200, {"users": fake.list_users(page, per_page), "aud": "authenticated"})
+        if target.startswith('admin/users/'):
+            user_id = target[len('admin/users/'):]
+            if method == 'GET':
+                user = fake.get_user(user_id)
+                return self._send(200, user) if user else self._send(404, {"code": 404, "msg": "User not found"})
+            if method == 'DELETE':
+                user = fake.delete_user(user_id)
+                return self._send(200, {}) if user else self._send(404, {"code": 404, "msg": "User not found"})
+        if target == 'invite' and method == 'POST':
+            email = (body or {}).get('email')
+            if any((user.get('email') or '').lower() == (email or '').lower() for user in fake.list_users(1, 10 ** 9)):
+                return self._send(422, {"code": 422, "msg": "A user with this email address has already been registered"})
+            return self._send(200, fake.add_user(email, (body or {}).get('data') or {}))
+        return self._send(404, {"code": 404, "msg": f"No fake for {method} /auth/v1/{target}"})
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
@@ -0,0 +1,558 @@
+"""
+Offline load benchmarks: serves the Flask app against FakeSupabase on
+localhost (each in its own process), drives a scenario with concurrent clients and reports throughput
+and p50/p95/p99 latency per endpoint. Exits non-zero when a result regresses
+past benchmarks/baselines.json (or any request fails).
+
+    cd backend
+    python -m benchmarks.run                      # all scenarios, compare to baselines
+    python -m benchmarks.run -s mixed --duration 30
+    python -m benchmarks.run --update-baselines   # record this machine's numbers
+"""
+import argparse
+import json
+import logging
+import math
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import httpx
+import jwt
+
+from benchmarks.fake_supabase import FakeSupabase
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINES_PATH = os.path.join(BACKEND_DIR, 'benchmarks', 'baselines.json')
+JWT_SECRET = 'benchmark-jwt-secret-not-for-production-use'
+# Latency goals are compared with some slack so tiny values do not flap
+ABSOLUTE_SLACK_MS = 2.0
+# A percentile is only compared when it rests on enough samples to be stable
+MIN_SAMPLES = {'p50_ms': 20, 'p95_ms': 100, 'p99_ms': 500}
+# Settings that must match for a baseline to be comparable
+BASELINE_SETTINGS = ('server', 'workers', 'threads', 'worker_class', 'latency_ms', 'jitter_ms', 'trucks', 'admins',
+                     'organizations', 'sites', 'batch_size', 'bulk_rows')
+
+SCENARIOS = {}
+
+
+def scenario(name):
+    def register(function):
+        SCENARIOS[name] = function
+        return function
+    return register
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Recorder:
+    """Thread-safe collection of (endpoint, latency, ok) samples."""
+
+    def __init__(self):
+        self._samples = {}
+        self._errors = {}  # endpoint -> (count, first few details)
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds, ok, detail=None):
+        with self._lock:
+            self._samples.setdefault(endpoint, []).append(seconds)
+            if not ok:
+                count, details = self._errors.get(endpoint, (0, []))
+                self._errors[endpoint] = (count + 1, details if len(details) >= 5 else details + [detail])
+
+    def summary(self, elapsed):
+        results = {}
+        with self._lock:
+            for endpoint, samples in self._samples.items():
+                ordered = sorted(samples)
+                results[endpoint] = {
+                    "requests": len(ordered),
+                    "errors": self._errors.get(endpoint, (0, []))[0],
+                    "error_samples": self._errors.get(endpoint, (0, []))[1],
+                    "rps": round(len(ordered) / elapsed, 1) if elapsed else 0.0,
+                    "p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+                    "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+                    "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+                    "max_ms": round(ordered[-1] * 1000, 2) if ordered else 0.0,
+                }
+        return results
+
+
+def _serve_fake(seed, latency_ms, jitter_ms, ready):
+    fake = FakeSupabase(latency_ms=latency_ms, jitter_ms=jitter_ms, seed=1)
+    for user in seed['users']:
+        fake.add_user(user['email'], user['user_metadata'], user['id'])
+    for table, rows in seed['tables'].items():
+        fake.insert(table, rows)
+    fake.start()
+    ready.put(fake.url)
+    threading.Event().wait()
+
+
+def _serve_app(environment, ready):
+    os.environ.update(environment)
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    # Imported only now: the app reads its configuration at import time
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    import app as backend
+
+    class RequestHandler(WSGIRequestHandler):
+        disable_nagle_algorithm = True
+
+    server = make_server('127.0.0.1', 0, backend.app, threaded=True, request_handler=RequestHandler)
+    ready.put(server.server_port)
+    server.serve_forever()
+
+
+class Bench:
+    """
+    Fake Supabase and the app on a threaded local server, each in its own
+    process so neither shares the load generator's GIL, seeded with
+    organizations, crews and sites.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.processes = []
+        self.spool_dir = tempfile.mkdtemp(prefix='crewtrack-bench-')
+        self._seed()
+        self.fake_url = self._start(_serve_fake, self.seed, args.latency_ms, args.jitter_ms)
+        # supabase-py only accepts JWT-shaped API keys
+        environment = {
+            'SUPABASE_URL': self.fake_url,
+            'SUPABASE_KEY': jwt.encode({'role': 'anon'}, JWT_SECRET, algorithm='HS256'),
+            'SUPABASE_SERVICE_ROLE_KEY': jwt.encode({'role': 'service_role'}, JWT_SECRET, algorithm='HS256'),
+            'JWT_SECRET_KEY': JWT_SECRET,
+            # A fresh location spool per run, so nothing is left over from earlier runs
+            'LOCATION_SPOOL_PATH': os.path.join(self.spool_dir, 'location_spool.db'),
+        }
+        if args.server == 'gunicorn':
+            port = self._start_gunicorn(environment)
+        else:
+            port = self._start(_serve_app, environment)
+        self.base_url = f'http://127.0.0.1:{port}'
+
+    def _start(self, target, *args):
+        context = multiprocessing.get_context('fork')
+        ready = context.Queue()
+        process = context.Process(target=target, args=args + (ready,), daemon=True)
+        process.start()
+        self.processes.append(process)
+        return ready.get(timeout=60)
+
+    def _start_gunicorn(self, environment):
+        """The production server (gunicorn.conf.py) with the requested worker model."""
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        environment = dict(os.environ, **environment)
+        environment.setdefault('LOG_LEVEL', 'WARNING')
+        environment.update({'GUNICORN_WORKERS': str(self.args.workers), 'GUNICORN_THREADS': str(self.args.threads),
+                            'GUNICORN_WORKER_CLASS': self.args.worker_class, 'GUNICORN_LOG_LEVEL': 'warning'})
+        process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+                                    '--bind', f'127.0.0.1:{port}', 'app:app'],
+                                   cwd=BACKEND_DIR, env=environment)
+        self.processes.append(process)
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"gunicorn exited with status {process.returncode}")
+            try:
+                with socket.create_connection(('127.0.0.1', port), timeout=1):
+                    return port
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError("gunicorn did not start listening within 60s")
+
+    def _seed(self):
+        args = self.args
+        rng = random.Random(7)
+        now = time.strftime('%Y-%m-%dT%H:%M:%S+00:00', time.gmtime())
+        self.organizations = [f'org-{number}' for number in range(args.organizations)]
+        self.trucks = []
+        self.admin_tokens = {}
+        users, members, locations, sites = [], [], [], []
+        for organization_id in self.organizations:
+            admin_id = str(uuid.UUID(int=rng.getrandbits(128)))
+            users.append({'id': admin_id, 'email': f'admin@{organization_id}.test',
+                          'user_metadata': {'role': 'admin', 'organization_id': organization_id}})
+            self.admin_tokens[organization_id] = jwt.encode(
+                {'sub': admin_id, 'aud': 'authenticated', 'iat': int(time.time()),
+                 'exp': int(time.time()) + 24 * 3600}, JWT_SECRET, algorithm='HS256')
+            center = (39.7 + rng.uniform(-0.5, 0.5), -104.9 + rng.uniform(-0.5, 0.5))
+            for number in range(args.trucks // args.organizations or 1):
+                email = f'truck{number}@{organization_id}.test'
+                user_id = str(uuid.UUID(int=rng.getrandbits(128)))
+                users.append({'id': user_id, 'email': email,
+                              'user_metadata': {'role': 'driver', 'organization_id': organization_id}})
+                member_id = f'{organization_id}-truck-{number}'
+                members.append({'id': member_id, 'name': f'Truck {number}', 'email': email, 'role': 'driver',
+                                'organization_id': organization_id, 'user_id': user_id,
+                                'last_active_at': now})
+                position = (center[0] + rng.uniform(-0.05, 0.05), center[1] + rng.uniform(-0.05, 0.05))
+                locations.append({'id': f'{member_id}-seed', 'crew_member_id': member_id,
+                                  'latitude': position[0], 'longitude': position[1], 'timestamp': now})
+                self.trucks.append((organization_id, member_id, position))
+            for number in range(args.sites):
+                sites.append({'id': f'{organization_id}-site-{number}', 'organization_id': organization_id,
+                              'name': f'Site {number}', 'address': f'{number} Main St',
+                              'latitude': center[0] + rng.uniform(-0.05, 0.05),
+                              'longitude': center[1] + rng.uniform(-0.05, 0.05), 'status': 'active',
+                              'geofence_details': None, 'last_serviced_date': None})
+        self.seed = {'users': users,
+                     'tables': {'crew_members': members, 'crew_locations': locations, 'locations': sites}}
+
+    def client(self):
+        return httpx.Client(base_url=self.base_url, timeout=30.0)
+
+    def call(self, client, recorder, endpoint, method, path, expect=(200,), **kwargs):
+        started = time.perf_counter()
+        try:
+            response = client.request(method, path, **kwargs)
+            ok = response.status_code in expect
+            detail = None if ok else f'{response.status_code}: {response.text[:200]}'
+        except httpx.HTTPError as e:
+            response, ok, detail = None, False, repr(e)
+        recorder.record(endpoint, time.perf_counter() - started, ok, detail)
+        return response if ok else None
+
+    def run_workers(self, workers, duration):
+        """Run each worker(client, recorder, deadline) on its own thread; returns (recorder, elapsed)."""
+        recorder = Recorder()
+        deadline = time.perf_counter() + duration
+        started = time.perf_counter()
+
+        def run(worker):
+            with self.client() as client:
+                worker(client, recorder, deadline)
+
+        threads = [threading.Thread(target=run, args=(worker,), daemon=True) for worker in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return recorder, time.perf_counter() - started
+
+    def warm_up(self):
+        """
+        Requests of each kind so the position index, site index and identity
+        cache are populated; repeated on several connections to reach every worker.
+        """
+        def warm():
+            with self.client() as client:
+                organization_id, member_id, position = self.trucks[0]
+                client.get(f'/api/organization/{organization_id}/positions',
+                           headers={'Authorization': f'Bearer {self.admin_tokens[organization_id]}'})
+                for organization_id, member_id, position in self.trucks:
+                    client.post('/api/crew/location', json={'crew_member_id': member_id,
+                                                            'latitude': position[0], 'longitude': position[1]})
+                for organization_id, token in self.admin_tokens.items():
+                    client.get('/admin/stats', headers={'Authorization': f'Bearer {token}'})
+
+        threads = [threading.Thread(target=warm) for _ in range(max(1, self.args.workers) * 2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def close(self):
+        for process in self.processes:
+            process.terminate()
+            if isinstance(process, subprocess.Popen):
+                process.wait(10)
+            else:
+                process.join(5)
+        shutil.rmtree(self.spool_dir, ignore_errors=True)
+
+
+def truck_worker(bench, truck, think_s):
+    organization_id, member_id, (latitude, longitude) = truck
+    rng = random.Random(member_id)
+
+    def work(client, recorder, deadline):
+        lat, lon = latitude, longitude
+        while time.perf_counter() < deadline:
+            lat += rng.uniform(-0.0003, 0.0003)
+            lon += rng.uniform(-0.0003, 0.0003)
+            bench.call(client, recorder, 'POST /api/crew/location', 'POST', '/api/crew/location',
+                       json={'crew_member_id': member_id, 'latitude': lat, 'longitude': lon})
+            if think_s:
+                time.sleep(think_s)
+    return work
+
+
+def batch_worker(bench, truck, batch_size, think_s):
+    organization_id, member_id, (latitude, longitude) = truck
+    rng = random.Random(member_id)
+
+    def work(client, recorder, deadline):
+        while time.perf_counter() < deadline:
+            now = time.time()
+            fixes = [{'latitude': latitude + rng.uniform(-0.001, 0.001),
+                      'longitude': longitude + rng.uniform(-0.001, 0.001),
+                      'timestamp': now - (batch_size - index)} for index in range(batch_size)]
+            bench.call(client, recorder, 'POST /api/crew/location/batch', 'POST', '/api/crew/location/batch',
+                       expect=(202,), json={'crew_member_id': member_id, 'fixes': fixes})
+            if think_s:
+                time.sleep(think_s)
+    return work
+
+
+def admin_poll_worker(bench, organization_id, think_s):
+    token = bench.admin_tokens[organization_id]
+    members = [member_id for org, member_id, _ in bench.trucks if org == organization_id]
+    rng = random.Random(organization_id)
+
+    def work(client, recorder, deadline):
+        headers = {'Authorization': f'Bearer {token}'}
+        while time.perf_counter() < deadline:
+            bench.call(client, recorder, 'GET /api/crew/current-location/<id>', 'GET',
+                       f'/api/crew/current-location/{rng.choice(members)}')
+            bench.call(client, recorder, 'GET /api/organization/<org_id>/positions', 'GET',
+                       f'/api/organization/{organization_id}/positions', headers=headers)
+            bench.call(client, recorder, 'GET /api/organization/crew', 'GET', '/api/organization/crew',
+                       params={'org_id': organization_id}, headers=headers)
+            if think_s:
+                time.sleep(think_s)
+    return work
+
+
+@scenario('ingest')
+def ingest_scenario(bench, args):
+    """Every truck posts single location pings back to back."""
+    return bench.run_workers([truck_worker(bench, truck, args.think_ms / 1000) for truck in bench.trucks],
+                             args.duration)
+
+
+@scenario('batch_ingest')
+def batch_ingest_scenario(bench, args):
+    """Every truck uploads batches of buffered fixes."""
+    return bench.run_workers([batch_worker(bench, truck, args.batch_size, args.think_ms / 1000)
+                              for truck in bench.trucks], args.duration)
+
+
+@scenario('admin_polling')
+def admin_polling_scenario(bench, args):
+    """Admins poll current locations, organization positions and crew lists."""
+    workers = [admin_poll_worker(bench, bench.organizations[index % len(bench.organizations)], args.think_ms / 1000)
+               for index in range(args.admins)]
+    return bench.run_workers(workers, args.duration)
+
+
+@scenario('mixed')
+def mixed_scenario(bench, args):
+    """Trucks pinging while admins poll, the normal daytime load."""
+    workers = [truck_worker(bench, truck, args.think_ms / 1000) for truck in bench.trucks]
+    workers += [admin_poll_worker(bench, bench.organizations[index % len(bench.organizations)], args.think_ms / 1000)
+                for index in range(args.admins)]
+    return bench.run_workers(workers, args.duration)
+
+
+@scenario('bulk_invite')
+def bulk_invite_scenario(bench, args):
+    """Admins onboard batches of new crew members and poll the job until it finishes."""
+    batch_counter = iter(range(10 ** 9))
+    counter_lock = threading.Lock()
+
+    def worker(organization_id):
+        headers = {'Authorization': f'Bearer {bench.admin_tokens[organization_id]}'}
+
+        def work(client, recorder, deadline):
+            while time.perf_counter() < deadline:
+                with counter_lock:
+                    batch = next(batch_counter)
+                members = [{'name': f'New {batch}-{index}', 'email': f'new{batch}-{index}@{organization_id}.test',
+                            'role': 'crew'} for index in range(args.bulk_rows)]
+                started = time.perf_counter()
+                response = bench.call(client, recorder, 'POST /crew-members/bulk', 'POST', '/crew-members/bulk',
+                                      expect=(202,), params={'async': 'true'}, json={'members': members},
+                                      headers=headers)
+                if response is None:
+                    continue
+                status_url = response.json()['status_url']
+                # Polls are not recorded: their count only mirrors how long the job took
+                while True:
+                    job = client.get(status_url, headers=headers)
+                    if job.status_code != 200 or job.json().get('finished_at'):
+                        break
+                    time.sleep(0.02)
+                ok = job.status_code == 200 and job.json().get('status') == 'completed'
+                recorder.record('bulk onboarding job (end to end)', time.perf_counter() - started, ok,
+                                None if ok else f'{job.status_code}: {job.text[:200]}')
+        return work
+
+    return bench.run_workers([worker(bench.organizations[index % len(bench.organizations)])
+                              for index in range(args.admins)], args.duration)
+
+
+def compare(results, baselines, settings, tolerance):
+    """Regression messages for results against stored baselines."""
+    problems = []
+    for name, endpoints in results.items():
+        baseline = baselines.get(name)
+        for endpoint, result in endpoints.items():
+            if result['errors']:
+                problems.append(f"{name} / {endpoint}: {result['errors']} failed request(s), "
+                                f"e.g. {result['error_samples'][0]}")
+        if baseline is None:
+            print(f"  (no baseline for scenario {name})")
+            continue
+        recorded = {key: baseline.get('settings', {}).get(key) for key in BASELINE_SETTINGS}
+        if recorded != {key: settings[key] for key in BASELINE_SETTINGS}:
+            problems.append(f"{name}: baseline was recorded with different settings {recorded}; "
+                            f"rerun with those or --update-baselines")
+            continue
+        for endpoint, expected in baseline['endpoints'].items():
+            result = endpoints.get(endpoint)
+            if result is None:
+                problems.append(f"{name} / {endpoint}: no requests recorded")
+                continue
+            for key, min_samples in MIN_SAMPLES.items():
+                if result['requests'] < min_samples:
+                    continue
+                limit = expected[key] * (1 + tolerance) + ABSOLUTE_SLACK_MS
+                if result[key] > limit:
+                    problems.append(f"{name} / {endpoint}: {key} {result[key]} > {limit:.2f} "
+                                    f"(baseline {expected[key]})")
+            floor = expected['rps'] * (1 - tolerance)
+            if result['rps'] < floor:
+                problems.append(f"{name} / {endpoint}: rps {result['rps']} < {floor:.1f} (baseline {expected['rps']})")
+    return problems
+
+
+def print_table(name, endpoints):
+    print(f"\n== {name}")
+    print(f"  {'endpoint':<42} {'requests':>8} {'errors':>6} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'max ms':>8}")
+    for endpoint, result in sorted(endpoints.items()):
+        print(f"  {endpoint:<42} {result['requests']:>8} {result['errors']:>6} {result['rps']:>8} "
+              f"{result['p50_ms']:>8} {result['p95_ms']:>8} {result['p99_ms']:>8} {result['max_ms']:>8}")
+
+
+def run_scenarios(args):
+    bench = Bench(args)
+    results = {}
+    try:
+        bench.warm_up()
+        for name in args.scenario or list(SCENARIOS):
+            recorder, elapsed = SCENARIOS[name](bench, args)
+            results[name] = recorder.summary(elapsed)
+            print_table(name, results[name])
+    finally:
+        bench.close()
+    return results
+
+
+def scale_workers(args):
+    """Run the scenarios under gunicorn once per worker count and compare throughput."""
+    counts = [int(count) for count in args.scale_workers.split(',') if count.strip()]
+    rows = []
+    failed = False
+    for count in counts:
+        run_args = argparse.Namespace(**vars(args))
+        run_args.server, run_args.workers = 'gunicorn', count
+        print(f"\n##### {count} worker(s), {args.worker_class}, {args.threads} thread(s) each")
+        for name, endpoints in run_scenarios(run_args).items():
+            for endpoint, result in endpoints.items():
+                rows.append((name, endpoint, count, result))
+                failed = failed or result['errors'] > 0
+    print(f"\n== Scaling ({args.worker_class}, {args.threads} thread(s) per worker, "
+          f"{os.cpu_count()} CPU(s), {args.latency_ms}ms upstream latency)")
+    print(f"  {'scenario / endpoint':<56} {'workers':>7} {'rps':>8} {'speedup':>7} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8}")
+    first = {}
+    for name, endpoint, count, result in sorted(rows, key=lambda row: (row[0], row[1], row[2])):
+        base = first.setdefault((name, endpoint), result['rps'] or 1)
+        print(f"  {name + ' / ' + endpoint:<56} {count:>7} {result['rps']:>8} {result['rps'] / base:>6.2f}x "
+              f"{result['p50_ms']:>8} {result['p95_ms']:>8} {result['p99_ms']:>8}")
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-s', '--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='scenario to run (repeatable, default: all)')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per scenario')
+    parser.add_argument('--latency-ms', type=float, default=5.0, help='injected latency per Supabase call')
+    parser.add_argument('--jitter-ms', type=float, default=2.0, help='extra uniform random latency per call')
+    parser.add_argument('--trucks', type=int, default=20, help='crew members pinging locations')
+    parser.add_argument('--admins', type=int, default=4, help='concurrent admin clients')
+    parser.add_argument('--organizations', type=int, default=2)
+    parser.add_argument('--sites', type=int, default=200, help='locations (geofenced sites) per organization')
+    parser.add_argument('--batch-size', type=int, default=20, help='fixes per batch upload')
+    parser.add_argument('--bulk-rows', type=int, default=50, help='members per bulk onboarding request')
+    parser.add_argument('--think-ms', type=float, default=0.0, help='pause between a client\'s requests')
+    parser.add_argument('--server', choices=('werkzeug', 'gunicorn'), default='werkzeug',
+                        help='serve the app with the threaded dev server or gunicorn.conf.py')
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=16, help='threads per gunicorn gthread worker')
+    parser.add_argument('--worker-class', default='gthread', choices=('gthread', 'gevent', 'sync'))
+    parser.add_argument('--scale-workers', help='comma-separated gunicorn worker counts to compare, e.g. 1,2,4 '
+                                                '(prints a scaling table; no baseline comparison)')
+    parser.add_argument('--tolerance', type=float, default=0.30,
+                        help='allowed relative regression against the baselines')
+    parser.add_argument('--baselines', default=BASELINES_PATH)
+    parser.add_argument('--update-baselines', action='store_true', help='store these results as the new baselines')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+    args.organizations = max(1, args.organizations)
+    if args.worker_class == 'sync':
+        args.threads = 1  # gunicorn turns sync workers with threads into gthread ones
+    if args.server == 'werkzeug' and not args.scale_workers:
+        args.workers, args.threads, args.worker_class = 1, 0, 'thread'
+
+    if args.scale_workers:
+        return scale_workers(args)
+
+    settings = {key: getattr(args, key) for key in BASELINE_SETTINGS}
+    print(f"Benchmark settings: {settings}, duration {args.duration}s")
+    results = run_scenarios(args)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"settings": settings, "duration": args.duration, "results": results}, f, indent=2)
+
+    try:
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+    except FileNotFoundError:
+        baselines = {}
+
+    if args.update_baselines:
+        for name, endpoints in results.items():
+            baselines[name] = {"settings": settings, "endpoints": {
+                endpoint: {key: result[key] for key in ('rps', 'p50_ms', 'p95_ms', 'p99_ms')}
+                for endpoint, result in endpoints.items()}}
+        with open(args.baselines, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"\nBaselines written to {args.baselines}")
+        return 0
+
+    problems = compare(results, baselines, settings, args.tolerance)
+    if problems:
+        print("\nREGRESSIONS:")
+        for problem in problems:
+            print(f"  - {problem}")
+        return 1
+    print("\nNo regressions against baselines.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,184 @@
+"""
+Wire format benchmark: bytes on the wire and encode/decode CPU per 1,000
+fixes for the location batch upload and the positions response, today's
+plain JSON against orjson, gzip/brotli and columnar MessagePack.
+
+    cd backend
+    python -m benchmarks.wire_formats
+    python -m benchmarks.wire_formats --fixes 5000 --repeat 100
+
+Encode is the sender's work (client for uploads, server for responses),
+decode the receiver's, both including compression. No server is started.
+Formats whose optional package (orjson, msgpack, brotli) is missing are
+skipped.
+"""
+import argparse
+import gzip
+import json
+import math
+import random
+import statistics
+import time
+import uuid
+
+from services.location_ingest import format_timestamp, parse_timestamp
+from services.wire import (
+    COORDINATE_SCALE, TIME_SCALE, WIRE_BROTLI_QUALITY, WIRE_GZIP_LEVEL, brotli, decode_columns, encode_columns,
+    msgpack, orjson
+)
+
+FIX_FIELDS = ["crew_member_id", "latitude", "longitude", "timestamp"]
+FIX_SCALES = {"latitude": COORDINATE_SCALE, "longitude": COORDINATE_SCALE, "timestamp": TIME_SCALE}
+POSITION_FIELDS = ["crew_member_id", "latitude", "longitude", "timestamp", "last_active_at"]
+POSITION_SCALES = dict(FIX_SCALES, last_active_at=TIME_SCALE)
+
+
+def drive(count, seed=1):
+    """One truck's 1 Hz track: (lat, lon, epoch seconds) with GPS-like full-precision doubles."""
+    rng = random.Random(seed)
+    lat, lon, heading, ts = 39.7392, -104.9903, rng.uniform(0, 2 * math.pi), time.time() - count
+    points = []
+    for _ in range(count):
+        heading += rng.gauss(0, 0.1)
+        speed = rng.uniform(3, 12)  # m/s
+        lat += speed * math.cos(heading) / 111_320 + rng.gauss(0, 2e-6)
+        lon += speed * math.sin(heading) / (111_320 * math.cos(math.radians(lat))) + rng.gauss(0, 2e-6)
+        ts += 1 + rng.uniform(-0.05, 0.05)
+        points.append((lat, lon, ts))
+    return points
+
+
+def stdlib_dumps(obj):
+    # What Flask's default provider and most clients produce
+    return json.dumps(obj, sort_keys=True, separators=(',', ':')).encode()
+
+
+def gzip_codec(data):
+    return gzip.compress(data, compresslevel=WIRE_GZIP_LEVEL, mtime=0)
+
+
+def brotli_codec(data):
+    return brotli.compress(data, quality=WIRE_BROTLI_QUALITY)
+
+
+def upload_formats(count):
+    """(name, encode(), decode(body)) for a batch upload of `count` fixes from one crew member."""
+    member_id = str(uuid.uuid4())
+    points = drive(count)
+
+    def fixes_payload():
+        return {"fixes": [{"crew_member_id": member_id, "latitude": lat, "longitude": lon,
+                           "timestamp": format_timestamp(ts)} for lat, lon, ts in points]}
+
+    def parse_fixes(payload):
+        return [(fix['crew_member_id'], float(fix['latitude']), float(fix['longitude']),
+                 parse_timestamp(fix['timestamp'])) for fix in payload['fixes']]
+
+    def columnar_payload():
+        return encode_columns(FIX_FIELDS, [[member_id, lat, lon, ts] for lat, lon, ts in points], FIX_SCALES)
+
+    formats = [("json (today)", lambda: stdlib_dumps(fixes_payload()),
+                lambda body: parse_fixes(json.loads(body)))]
+    if orjson is not None:
+        formats.append(("json, orjson", lambda: orjson.dumps(fixes_payload()),
+                        lambda body: parse_fixes(orjson.loads(body))))
+    formats.append(("json + gzip", lambda: gzip_codec(stdlib_dumps(fixes_payload())),
+                    lambda body: parse_fixes(json.loads(gzip.decompress(body)))))
+    if brotli is not None:
+        formats.append(("json + br", lambda: brotli_codec(stdlib_dumps(fixes_payload())),
+                        lambda body: parse_fixes(json.loads(brotli.decompress(body)))))
+    if msgpack is not None:
+        formats.append(("msgpack columnar", lambda: msgpack.packb(columnar_payload()),
+                        lambda body: decode_columns(msgpack.unpackb(body))))
+        formats.append(("msgpack columnar + gzip", lambda: gzip_codec(msgpack.packb(columnar_payload())),
+                        lambda body: decode_columns(msgpack.unpackb(gzip.decompress(body)))))
+        if brotli is not None:
+            formats.append(("msgpack columnar + br", lambda: brotli_codec(msgpack.packb(columnar_payload())),
+                            lambda body: decode_columns(msgpack.unpackb(brotli.decompress(body)))))
+    return formats
+
+
+def positions_formats(count):
+    """(name, encode(), decode(body)) for GET /api/organization/<id>/positions with `count` members."""
+    rng = random.Random(2)
+    now = time.time()
+    rows = [[str(uuid.uuid4()), round(39.6 + rng.random() * 0.4, 6), round(-105.1 + rng.random() * 0.4, 6),
+             round(now - rng.random() * 600, 3), round(now - rng.random() * 60, 3)] for _ in range(count)]
+
+    def dict_payload():
+        return [{"crew_member_id": member_id, "latitude": lat, "longitude": lon,
+                 "timestamp": format_timestamp(ts), "last_active_at": format_timestamp(active)}
+                for member_id, lat, lon, ts, active in rows]
+
+    formats = [("json (today)", lambda: stdlib_dumps(dict_payload()), json.loads)]
+    if orjson is not None:
+        formats.append(("json, orjson", lambda: orjson.dumps(dict_payload(), option=orjson.OPT_SORT_KEYS),
+                        orjson.loads))
+    formats.append(("json + gzip", lambda: gzip_codec(stdlib_dumps(dict_payload())),
+                    lambda body: json.loads(gzip.decompress(body))))
+    if brotli is not None:
+        formats.append(("json + br", lambda: brotli_codec(stdlib_dumps(dict_payload())),
+                        lambda body: json.loads(brotli.decompress(body))))
+    if msgpack is not None:
+        formats.append(("msgpack columnar",
+                        lambda: msgpack.packb(encode_columns(POSITION_FIELDS, rows, POSITION_SCALES)),
+                        lambda body: decode_columns(msgpack.unpackb(body))))
+        formats.append(("msgpack columnar + gzip",
+                        lambda: gzip_codec(msgpack.packb(encode_columns(POSITION_FIELDS, rows, POSITION_SCALES))),
+                        lambda body: decode_columns(msgpack.unpackb(gzip.decompress(body)))))
+    return formats
+
+
+def measure(encode, decode, repeat):
+    """(bytes, median encode ms, median decode ms)."""
+    body = encode()
+    encode_ms, decode_ms = [], []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = encode()
+        encode_ms.append((time.perf_counter() - started) * 1000)
+        started = time.perf_counter()
+        decode(body)
+        decode_ms.append((time.perf_counter() - started) * 1000)
+    return len(body), statistics.median(encode_ms), statistics.median(decode_ms)
+
+
+def report(title, formats, count, repeat):
+    scale = 1000 / count
+    print(f"\n{title} (per 1,000 fixes, median of {repeat} runs)")
+    print(f"  {'format':<26}{'bytes':>10}{'vs today':>10}{'encode ms':>11}{'decode ms':>11}")
+    results = []
+    baseline = None
+    for name, encode, decode in formats:
+        size, encode_ms, decode_ms = measure(encode, decode, repeat)
+        size, encode_ms, decode_ms = size * scale, encode_ms * scale, decode_ms * scale
+        baseline = baseline or size
+        print(f"  {name:<26}{size:>10.0f}{size / baseline:>9.0%} {encode_ms:>10.2f}{decode_ms:>11.2f}")
+        results.append({"format": name, "bytes": round(size), "encode_ms": round(encode_ms, 3),
+                        "decode_ms": round(decode_ms, 3)})
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fixes', type=int, default=1000, help='fixes per upload / members per positions response')
+    parser.add_argument('--repeat', type=int, default=50, help='timed runs per format')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    missing = [name for name, module in (('orjson', orjson), ('msgpack', msgpack), ('brotli', brotli))
+               if module is None]
+    if missing:
+        print(f"Not installed, formats skipped: {', '.join(missing)}")
+    results = {
+        "upload": report("POST /api/crew/location/batch", upload_formats(args.fixes), args.fixes, args.repeat),
+        "positions": report("GET /api/organization/<id>/positions", positions_formats(args.fixes), args.fixes,
+                            args.repeat),
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+# Gunicorn settings for the backend (gunicorn -c gunicorn.conf.py app:app)
+#
+# Every request spends most of its time waiting on Supabase HTTP calls, so
+# concurrency comes from threads (gthread, default) or greenlets (gevent)
+# inside one worker process rather than from many sync workers. The position
+# index, change-feed cursors, live stream, geofence state, jobs and response
+# cache live in that process; a second worker would not see them.
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# "gthread" (threads per worker) or "gevent" (needs `pip install gevent`);
+# "sync" with GUNICORN_THREADS > 1 also runs as gthread
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+# More than one only once that per-process state is acceptable (see the README)
+workers = int(os.getenv('GUNICORN_WORKERS', '1'))
+# Concurrent requests per gthread worker; keep it <= SUPABASE_POOL_MAX_CONNECTIONS
+threads = int(os.getenv('GUNICORN_THREADS', '16'))
+# Concurrent requests per gevent worker
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '500'))
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+# Trucks and dashboards reuse their connections between requests
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '15'))
+# Recycle workers now and then (0 disables); jitter keeps them from restarting together
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '100'))
+# Import the app once in the master; the services reset their pools and threads after fork
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+
+accesslog = None  # the app writes its own sampled access log
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+gevent_missing = False
+if worker_class == 'gevent':
+    try:
+        import gevent  # noqa: F401
+    except ImportError:
+        gevent_missing = True
+        worker_class = 'gthread'
+    else:
+        # The app must be imported after the worker monkey-patches the stdlib
+        preload_app = False
+
+
+def on_starting(server):
+    if gevent_missing:
+        server.log.warning("gevent is not installed, falling back to the gthread worker")
+    if server.cfg.workers > 1:
+        server.log.warning("Running %s workers: positions, change-feed cursors, the live stream, jobs and the "
+                           "response cache are per worker process", server.cfg.workers)
+
+
+def post_fork(server, worker):
+    # The app reads this to tell whether its in-process state is the only copy (services/workers.py)
+    os.environ['GUNICORN_WORKERS'] = str(server.cfg.workers)
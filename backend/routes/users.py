@@ -1,11 +1,14 @@
 from flask import Blueprint, request, jsonify
 import os
-from supabase import create_client, Client
+from supabase import Client
+from services.identity_cache import identity_cache
+from services.auth_admin import delete_auth_user
+from services.jobs import QueueFullError, jobs
+from services.supabase_clients import clients
+from services.logs import get_logger
+from services.response_cache import response_cache
 
-# Initialize Supabase client with admin privileges
-url = os.environ.get("SUPABASE_URL")
-key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")  # Use service role key for admin operations
-supabase: Client = create_client(url, key)
+log = get_logger('users')
 
 users_bp = Blueprint('users', __name__)
 
@@ -20,44 +23,75 @@ def delete_user(user_id):
     """
     Delete a user from Supabase Auth
     This requires admin privileges and can only be done from the backend
+    The deletion runs as a background job (retried on transient errors);
+    poll /jobs/<job_id> for its outcome. An Idempotency-Key header makes a
+    retried request return the original job.
     """
     try:
         # Log the request for debugging
-        print(f"Attempting to delete user with ID: {user_id}")
-        
-        # Check if the user exists first
-        try:
-            user_data = supabase.auth.admin.get_user(user_id)
-            print(f"User found: {user_data}")
-        except Exception as user_error:
-            print(f"Error getting user: {user_error}")
+        log.info("Attempting to delete user with ID: %s", user_id)
+
+        # Shared service role client (pooled connections) for admin operations
+        supabase: Client = clients.admin()
+        if supabase is None:
             return jsonify({
                 'success': False,
-                'message': f"User not found: {str(user_error)}"
-            }), 404
-        
-        # Try to delete the user from Supabase Auth using the Python client library
-        try:
-            # Explicitly create a new client instance with the service role key for this operation
-            admin_supabase: Client = create_client(url, key)
-            response = admin_supabase.auth.admin.delete_user(user_id)
-            # The delete_user function doesn't return much on success, 
-            # but will raise an exception on failure.
-            print(f"User {user_id} deletion attempted via client library.")
-            
-            # Assuming no exception means success
+                'message': 'Backend service key not configured'
+            }), 500
+
+        # A retried request returns the job it already queued (the user may be gone by now,
+        # so the key is looked up per deleted user rather than per organization)
+        idempotency_key = request.headers.get('Idempotency-Key')
+        key_scope = f'user:{user_id}'
+        job = jobs.find_by_key('user_deletion', key_scope, idempotency_key)
+        if job is None:
+            # Check if the user exists first; only a queued deletion claims the key
+            try:
+                user_data = supabase.auth.admin.get_user_by_id(user_id)
+                log.info("User found: %s", user_data.user.id if user_data and user_data.user else None)
+            except Exception as user_error:
+                log.error("Error getting user: %s", user_error)
+                return jsonify({
+                    'success': False,
+                    'message': f"User not found: {str(user_error)}"
+                }), 404
+            # The job belongs to the user's organization, whose admins may read it
+            user_metadata = getattr(getattr(user_data, 'user', None), 'user_metadata', None) or {}
+            job, created = jobs.create('user_deletion', user_metadata.get('organization_id'), 1, idempotency_key,
+                                       key_scope=key_scope)
+        else:
+            created = False
+        if not created:
             return jsonify({
                 'success': True,
-                'message': f'User {user_id} deleted successfully'
+                'message': f'Deletion of user {user_id} already requested',
+                'job_id': job.id,
+                'status': job.status,
+                'status_url': f'/jobs/{job.id}'
             }), 200
-        except Exception as delete_error:
-            print(f"Error deleting user via client library: {delete_error}")
-            # Re-raise the error to be caught by the outer try-except block
-            raise delete_error
+
+        try:
+            jobs.enqueue(job, [user_id], lambda item: delete_auth_user(clients.admin(), item))
+        except QueueFullError as queue_error:
+            return jsonify({
+                'success': False,
+                'message': str(queue_error)
+            }), 503
+        # Stop accepting the user's cached identity right away (once the deletion is queued)
+        identity_cache.invalidate_user(user_id)
+        response_cache.invalidate(job.organization_id)
+        log.info("Queued deletion job %s for user %s", job.id, user_id)
+
+        return jsonify({
+            'success': True,
+            'message': f'Deletion of user {user_id} queued',
+            'job_id': job.id,
+            'status_url': f'/jobs/{job.id}'
+        }), 202
 
     except Exception as e:
-        # Handle potential exceptions from get_user or delete_user
-        print(f"Error during user deletion process for {user_id}: {e}")
+        # Handle potential exceptions from get_user_by_id or queueing
+        log.error("Error during user deletion process for %s: %s", user_id, e)
         return jsonify({
             'success': False,
             'message': f"Unexpected error: {str(e)}"
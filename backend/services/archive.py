@@ -0,0 +1,373 @@
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import numpy as np
+
+from services.location_ingest import format_timestamp, parse_timestamp
+from services.logs import get_logger
+from services.supabase_clients import fetch_pages
+
+log = get_logger('archive')
+
+# Columnar archive of old crew_locations rows (per organization, per UTC day)
+# Put this on a persistent volume; it is shared by all worker processes on the host
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', os.path.join(tempfile.gettempdir(), 'crewtrack-archive'))
+# Whole days older than this are moved out of crew_locations by the archive job
+ARCHIVE_AFTER_DAYS = float(os.getenv('ARCHIVE_AFTER_DAYS', '30'))
+ARCHIVE_MAX_DAYS_PER_RUN = int(os.getenv('ARCHIVE_MAX_DAYS_PER_RUN', '31'))
+ARCHIVE_PAGE_SIZE = int(os.getenv('ARCHIVE_PAGE_SIZE', '1000'))
+# Ids per DELETE (and crew member ids per IN filter), bounded by URL length
+ARCHIVE_DELETE_CHUNK = int(os.getenv('ARCHIVE_DELETE_CHUNK', '200'))
+# Memory-mapped segments kept open per process
+ARCHIVE_OPEN_SEGMENTS = int(os.getenv('ARCHIVE_OPEN_SEGMENTS', '128'))
+# Most rows one history query returns
+ARCHIVE_QUERY_MAX_ROWS = int(os.getenv('ARCHIVE_QUERY_MAX_ROWS', '100000'))
+
+SEGMENT_VERSION = 1
+COLUMNS = ('id', 'latitude', 'longitude', 'timestamp')
+
+
+def day_of(epoch_seconds):
+    return datetime.fromtimestamp(epoch_seconds, tz=timezone.utc).strftime('%Y-%m-%d')
+
+
+def day_start(day):
+    return datetime.strptime(day, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp()
+
+
+def id_bytes(row_ids):
+    """
+    crew_locations UUIDs as a fixed-width 16-byte column. Raw V16 rather than
+    S16, which would drop trailing zero bytes when values are read back.
+    """
+    return np.array([uuid.UUID(str(row_id)).bytes for row_id in row_ids], dtype='V16')
+
+
+class Segment:
+    """
+    One organization-day of fixes: rows sorted by (crew member, time) in
+    memory-mapped .npy columns. latitude/longitude are float32; timestamp is
+    int64 milliseconds, delta-encoded within each member's run (the run's
+    first value is relative to the start of the day). segment.json holds
+    each member's row range and bounding box.
+    """
+
+    def __init__(self, path):
+        # Resolved and mapped up front: the maps outlive a replaced (deleted) version
+        self.path = os.path.realpath(path)
+        with open(os.path.join(self.path, 'segment.json')) as f:
+            self.meta = json.load(f)
+        self.day = self.meta['day']
+        self.base_ms = self.meta['base_ms']
+        self.members = self.meta['members']  # crew_member_id -> [start, end, min_lat, min_lon, max_lat, max_lon]
+        self._columns = {name: np.load(os.path.join(self.path, f'{name}.npy'), mmap_mode='r') for name in COLUMNS}
+        if self._columns['id'].dtype.kind == 'S':
+            # Segments written before ids were stored as V16
+            self._columns['id'] = self._columns['id'].view('V16')
+
+    def column(self, name):
+        """The column as a read-only memory map."""
+        return self._columns[name]
+
+    def __len__(self):
+        return self.meta['rows']
+
+    def timestamps_ms(self, start, end):
+        return self.base_ms + np.cumsum(self.column('timestamp')[start:end])
+
+    def decode(self):
+        """All rows as plain arrays (crew member ids, ids, lats, lons, epoch ms)."""
+        member_ids, timestamps = [], []
+        for crew_member_id, (start, end, *_) in self.members.items():
+            member_ids.extend([crew_member_id] * (end - start))
+            timestamps.append(self.timestamps_ms(start, end))
+        return (member_ids, np.array(self.column('id')), np.array(self.column('latitude')),
+                np.array(self.column('longitude')),
+                np.concatenate(timestamps) if timestamps else np.empty(0, dtype=np.int64))
+
+    def query(self, crew_member_id=None, from_ms=None, to_ms=None, bbox=None, with_ids=False):
+        """
+        Yields (crew_member_id, ids or None, lats, lons, epoch ms) per member run.
+        Only the matching member runs are read; latitude/longitude are zero-copy
+        slices of the memory map unless a bounding box has to filter them.
+        """
+        runs = ([(crew_member_id, self.members[crew_member_id])] if crew_member_id in self.members
+                else [] if crew_member_id is not None else self.members.items())
+        for member_id, (start, end, min_lat, min_lon, max_lat, max_lon) in runs:
+            if bbox is not None and (max_lat < bbox[0] or min_lat > bbox[2] or max_lon < bbox[1] or min_lon > bbox[3]):
+                continue
+            timestamps = self.timestamps_ms(start, end)
+            first = int(np.searchsorted(timestamps, from_ms, 'left')) if from_ms is not None else 0
+            last = int(np.searchsorted(timestamps, to_ms, 'right')) if to_ms is not None else len(timestamps)
+            if first >= last:
+                continue
+            rows = slice(start + first, start + last)
+            lats, lons = self.column('latitude')[rows], self.column('longitude')[rows]
+            ids = self.column('id')[rows] if with_ids else None
+            timestamps = timestamps[first:last]
+            if bbox is not None:
+                inside = (lats >= bbox[0]) & (lats <= bbox[2]) & (lons >= bbox[1]) & (lons <= bbox[3])
+                if not inside.any():
+                    continue
+                if not inside.all():
+                    lats, lons, timestamps = lats[inside], lons[inside], timestamps[inside]
+                    ids = ids[inside] if ids is not None else None
+            yield member_id, ids, lats, lons, timestamps
+
+
+def write_segment(path, organization_id, day, member_ids, ids, lats, lons, timestamps_ms):
+    """Write rows (any order, ids unique) as a segment directory at `path`."""
+    order = np.lexsort((timestamps_ms, np.array(member_ids)))
+    member_ids = [member_ids[i] for i in order]
+    ids, timestamps_ms = ids[order], timestamps_ms[order]
+    lats, lons = lats[order].astype(np.float32), lons[order].astype(np.float32)
+    base_ms = int(day_start(day) * 1000)
+    deltas = np.empty(len(order), dtype=np.int64)
+    members = {}
+    start = 0
+    for end in range(1, len(order) + 1):
+        if end < len(order) and member_ids[end] == member_ids[start]:
+            continue
+        run = slice(start, end)
+        deltas[run] = np.diff(timestamps_ms[run], prepend=base_ms)
+        members[member_ids[start]] = [start, end, float(lats[run].min()), float(lons[run].min()),
+                                      float(lats[run].max()), float(lons[run].max())]
+        start = end
+    os.makedirs(path)
+    np.save(os.path.join(path, 'id.npy'), ids.astype('V16'))
+    np.save(os.path.join(path, 'latitude.npy'), lats)
+    np.save(os.path.join(path, 'longitude.npy'), lons)
+    np.save(os.path.join(path, 'timestamp.npy'), deltas)
+    meta = {
+        "version": SEGMENT_VERSION,
+        "organization_id": str(organization_id),
+        "day": day,
+        "base_ms": base_ms,
+        "rows": len(order),
+        "start_ms": int(timestamps_ms.min()),
+        "end_ms": int(timestamps_ms.max()),
+        "bbox": [float(lats.min()), float(lons.min()), float(lats.max()), float(lons.max())],
+        "members": members,
+    }
+    with open(os.path.join(path, 'segment.json'), 'w') as f:
+        json.dump(meta, f)
+
+
+class LocationArchive:
+    """
+    Per-organization, per-day columnar segments of crew_locations rows moved
+    out of the live table. Each day is a symlink to an immutable segment
+    directory, swapped atomically when the day is rewritten, so readers never
+    see a partial one; open segments are cached per process and reopened
+    when the link changes.
+    """
+
+    def __init__(self, root=ARCHIVE_DIR, max_open=ARCHIVE_OPEN_SEGMENTS):
+        self.root = root
+        self.max_open = max_open
+        self._after_fork()
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._open = OrderedDict()  # day link -> (version directory it pointed at, Segment)
+        self.archived_rows = 0
+        self.deleted_rows = 0
+        self.queries = 0
+        self.segments_read = 0
+
+    def _org_dir(self, organization_id):
+        return os.path.join(self.root, str(organization_id))
+
+    def days(self, organization_id):
+        try:
+            names = os.listdir(self._org_dir(organization_id))
+        except FileNotFoundError:
+            return []
+        return sorted(name for name in names if len(name) == 10 and name[4] == '-' and name[7] == '-')
+
+    def segment(self, organization_id, day):
+        """The day's current segment, or None."""
+        path = os.path.join(self._org_dir(organization_id), day)
+        for _ in range(3):
+            try:
+                version = os.readlink(path)
+            except FileNotFoundError:
+                return None
+            with self._lock:
+                cached = self._open.get(path)
+                if cached is not None and cached[0] == version:
+                    self._open.move_to_end(path)
+                    return cached[1]
+            try:
+                segment = Segment(os.path.join(self._org_dir(organization_id), version))
+                break
+            except FileNotFoundError:
+                continue  # Replaced while opening; the link now points at the new version
+        else:
+            return None
+        with self._lock:
+            self._open[path] = (version, segment)
+            self._open.move_to_end(path)
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+        return segment
+
+    def row_ids(self, organization_id, crew_member_id, day):
+        """Ids of a crew member's rows archived for a day (V16 memory map slice, empty when none)."""
+        segment = self.segment(organization_id, day)
+        if segment is None or crew_member_id not in segment.members:
+            return np.empty(0, dtype='V16')
+        start, end = segment.members[crew_member_id][:2]
+        return segment.column('id')[start:end]
+
+    def write_day(self, organization_id, day, rows):
+        """
+        Add crew_locations rows (dicts) of one organization-day to its segment,
+        merging with what is already archived; rows already archived are skipped.
+        Returns the number of rows added.
+        """
+        org_dir = self._org_dir(organization_id)
+        os.makedirs(org_dir, exist_ok=True)
+        with open(os.path.join(org_dir, '.lock'), 'w') as lock:
+            # Serializes writers across worker processes
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            ids = id_bytes(row['id'] for row in rows)
+            keep = np.zeros(len(rows), dtype=bool)
+            keep[np.unique(ids, return_index=True)[1]] = True
+            existing = self.segment(organization_id, day)
+            if existing is not None:
+                old_members, old_ids, old_lats, old_lons, old_timestamps = existing.decode()
+                keep &= ~np.isin(ids, old_ids)
+            if not keep.any():
+                return 0
+            rows = [row for row, kept in zip(rows, keep) if kept]
+            member_ids = [str(row['crew_member_id']) for row in rows]
+            ids = ids[keep]
+            lats = np.array([float(row['latitude']) for row in rows], dtype=np.float64)
+            lons = np.array([float(row['longitude']) for row in rows], dtype=np.float64)
+            timestamps = np.array([round(parse_timestamp(row['timestamp']) * 1000) for row in rows], dtype=np.int64)
+            if existing is not None:
+                member_ids = old_members + member_ids
+                ids = np.concatenate((old_ids, ids))
+                lats = np.concatenate((old_lats, lats))
+                lons = np.concatenate((old_lons, lons))
+                timestamps = np.concatenate((old_timestamps, timestamps))
+
+            # <day> is a symlink to the current version's directory, swapped atomically
+            final = os.path.join(org_dir, day)
+            version = f'{day}.{uuid.uuid4().hex[:12]}'
+            write_segment(os.path.join(org_dir, version), organization_id, day, member_ids, ids, lats, lons,
+                          timestamps)
+            link = f'{final}.link-{uuid.uuid4().hex[:8]}'
+            os.symlink(version, link)
+            os.replace(link, final)
+            if existing is not None:
+                # Open memory maps of the old files stay valid until they are dropped
+                shutil.rmtree(os.path.realpath(existing.path), ignore_errors=True)
+        with self._lock:
+            self.archived_rows += len(rows)
+        return len(rows)
+
+    def query(self, organization_id, crew_member_id=None, from_ts=None, to_ts=None, bbox=None, with_ids=False):
+        """
+        Archived rows in a time range, as per-run (crew_member_id, ids, lats,
+        lons, epoch ms) arrays. Only segments for days in the range are opened.
+        bbox is (min_lat, min_lon, max_lat, max_lon).
+        """
+        with self._lock:
+            self.queries += 1
+        from_day = day_of(from_ts) if from_ts is not None else None
+        to_day = day_of(to_ts) if to_ts is not None else None
+        from_ms = round(from_ts * 1000) if from_ts is not None else None
+        to_ms = round(to_ts * 1000) if to_ts is not None else None
+        for day in self.days(organization_id):
+            if (from_day and day < from_day) or (to_day and day > to_day):
+                continue
+            segment = self.segment(organization_id, day)
+            if segment is None:
+                continue
+            box = segment.meta['bbox']
+            if bbox is not None and (box[2] < bbox[0] or box[0] > bbox[2] or box[3] < bbox[1] or box[1] > bbox[3]):
+                continue
+            with self._lock:
+                self.segments_read += 1
+            yield from segment.query(crew_member_id, from_ms, to_ms, bbox, with_ids)
+
+    def compact(self, client, organization_id, member_ids, before_ts, max_days=ARCHIVE_MAX_DAYS_PER_RUN,
+                progress=None):
+        """
+        Move the organization's crew_locations rows of whole UTC days before
+        `before_ts` into segments, oldest day first, at most `max_days` days.
+        Rows are deleted from the live table by id only after their segment is
+        written, so a failure at any point loses nothing (a rerun skips rows
+        already archived). Returns one result per day.
+        """
+        member_ids = [str(member_id) for member_id in member_ids]
+        chunks = [member_ids[i:i + ARCHIVE_DELETE_CHUNK] for i in range(0, len(member_ids), ARCHIVE_DELETE_CHUNK)]
+        last_day = day_of(before_ts)  # exclusive: only whole days are archived
+        results = []
+        while len(results) < max_days:
+            # The oldest remaining fix picks the next day, skipping days without any
+            oldest = None
+            for chunk in chunks:
+                response = (client.table('crew_locations')
+                            .select('timestamp')
+                            .in_('crew_member_id', chunk)
+                            .order('timestamp')
+                            .limit(1)
+                            .execute())
+                if response.data:
+                    first = parse_timestamp(response.data[0]['timestamp'])
+                    oldest = first if oldest is None else min(oldest, first)
+            if oldest is None or day_of(oldest) >= last_day:
+                break
+            day = day_of(oldest)
+            if results and day <= results[-1]['day']:
+                raise RuntimeError(f"crew_locations rows of {day} are still live after archiving them")
+            start = day_start(day)
+            rows = []
+            for chunk in chunks:
+                rows.extend(fetch_pages(lambda: (client.table('crew_locations')
+                                                 .select('id, crew_member_id, latitude, longitude, timestamp')
+                                                 .in_('crew_member_id', chunk)
+                                                 .gte('timestamp', format_timestamp(start))
+                                                 .lt('timestamp', format_timestamp(start + 86400))
+                                                 .order('id')),
+                                        page_size=ARCHIVE_PAGE_SIZE))
+            added = self.write_day(organization_id, day, rows) if rows else 0
+            ids = [str(row['id']) for row in rows]
+            for i in range(0, len(ids), ARCHIVE_DELETE_CHUNK):
+                (client.table('crew_locations')
+                 .delete(returning='minimal')
+                 .in_('id', ids[i:i + ARCHIVE_DELETE_CHUNK])
+                 .execute())
+            with self._lock:
+                self.deleted_rows += len(ids)
+            log.info("Archived %s crew_locations rows of org %s for %s", len(ids), organization_id, day)
+            results.append({"day": day, "rows": len(ids), "added": added})
+            if progress is not None:
+                progress(results[-1])
+        return results
+
+    def stats(self):
+        with self._lock:
+            return {
+                "root": self.root,
+                "open_segments": len(self._open),
+                "archived_rows": self.archived_rows,
+                "deleted_rows": self.deleted_rows,
+                "queries": self.queries,
+                "segments_read": self.segments_read,
+            }
+
+
+location_archive = LocationArchive()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=location_archive._after_fork)
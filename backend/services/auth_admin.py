@@ -0,0 +1,26 @@
+from services.auth_directory import auth_directory
+from services.identity_cache import identity_cache
+from services.jobs import PermanentJobError
+from services.logs import get_logger
+
+log = get_logger('auth_admin')
+
+
+def delete_auth_user(admin_supabase, user_id):
+    """
+    Delete an auth user and drop it from the in-process auth caches.
+    "Already deleted" (404) counts as success so job retries are idempotent;
+    a 403 from Supabase is raised as PermanentJobError since retrying cannot fix it.
+    """
+    try:
+        admin_supabase.auth.admin.delete_user(user_id)
+    except Exception as auth_error:
+        status = getattr(auth_error, 'status', None)
+        if status == 404:
+            log.info("Auth user %s was already deleted", user_id)
+        elif status == 403 or 'Forbidden' in str(auth_error):
+            raise PermanentJobError("Forbidden by Supabase (403). Manual deletion might be required.")
+        else:
+            raise
+    identity_cache.invalidate_user(user_id)
+    auth_directory.remove_user(user_id)
@@ -0,0 +1,183 @@
+import os
+import threading
+import time
+
+from services.logs import get_logger
+
+log = get_logger('auth_directory')
+
+# Email -> auth user index configuration
+AUTH_DIRECTORY_PAGE_SIZE = int(os.getenv('AUTH_DIRECTORY_PAGE_SIZE', '1000'))
+# Full reload interval, picks up users created/deleted outside this backend
+AUTH_DIRECTORY_REFRESH_SECONDS = float(os.getenv('AUTH_DIRECTORY_REFRESH_SECONDS', '3600'))
+# Indexed lookup in auth.users (supabase_auth_email_lookup_migration.sql)
+AUTH_DIRECTORY_LOOKUP_RPC = os.getenv('AUTH_DIRECTORY_LOOKUP_RPC', 'auth_user_id_by_email')
+
+# PostgREST "function not found" / Postgres "undefined function"
+RPC_MISSING_CODES = {'PGRST202', '42883', 404}
+
+
+def normalize_email(email):
+    return (email or '').strip().lower()
+
+
+class AuthUserDirectory:
+    """
+    In-memory index of auth user emails -> user ids.
+    Bulk loaded page by page from the GoTrue admin API in the background and
+    kept current on invite/delete, so a duplicate-email check is a dict lookup.
+    A miss is confirmed against the database (indexed RPC on auth.users, or a
+    paginated scan when the RPC is not installed) before it is trusted.
+    """
+
+    def __init__(self, page_size=AUTH_DIRECTORY_PAGE_SIZE, refresh_seconds=AUTH_DIRECTORY_REFRESH_SECONDS):
+        self.page_size = page_size
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._reset_state()
+
+    def _reset_state(self):
+        self._by_email = {}
+        self._email_by_user = {}
+        self._loaded_at = None
+        self._loading_pid = None
+        self._changes_during_load = None  # email -> user_id (None = removed) while a load runs
+        self._rpc_available = True
+        self.hits = 0
+        self.misses = 0
+        self.confirmed = 0
+        self.loads = 0
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._reset_state()
+
+    def _list_pages(self, client):
+        page = 1
+        while True:
+            users = client.auth.admin.list_users(page=page, per_page=self.page_size) or []
+            yield users
+            if len(users) < self.page_size:
+                return
+            page += 1
+
+    def load(self, client):
+        """Rebuild the index from every page of auth users."""
+        with self._lock:
+            self._changes_during_load = {}
+        by_email = {}
+        try:
+            for users in self._list_pages(client):
+                for user in users:
+                    if user.email:
+                        by_email[normalize_email(user.email)] = str(user.id)
+        except Exception:
+            with self._lock:
+                self._changes_during_load = None
+            raise
+        with self._lock:
+            # Invites/deletes that happened while pages were being read win
+            for email, user_id in self._changes_during_load.items():
+                if user_id is None:
+                    by_email.pop(email, None)
+                else:
+                    by_email[email] = user_id
+            self._changes_during_load = None
+            self._by_email = by_email
+            self._email_by_user = {user_id: email for email, user_id in by_email.items()}
+            self._loaded_at = time.monotonic()
+            self.loads += 1
+        log.info("Auth user directory loaded: %s users", len(by_email))
+
+    def ensure_loaded(self, client_factory):
+        """Start a background (re)load when the index is missing or stale, once per process."""
+        with self._lock:
+            fresh = self._loaded_at is not None and time.monotonic() - self._loaded_at < self.refresh_seconds
+            if fresh or self._loading_pid == os.getpid():
+                return
+            self._loading_pid = os.getpid()
+
+        def run():
+            try:
+                client = client_factory()
+                if client is not None:
+                    self.load(client)
+            except Exception as e:
+                log.error("Error loading auth user directory: %s", e)
+            finally:
+                with self._lock:
+                    self._loading_pid = None
+
+        threading.Thread(target=run, name='auth-directory-load', daemon=True).start()
+
+    @property
+    def loaded(self):
+        return self._loaded_at is not None
+
+    def _confirm(self, client, email):
+        if self._rpc_available:
+            try:
+                response = client.rpc(AUTH_DIRECTORY_LOOKUP_RPC, {'p_email': email}).execute()
+                return str(response.data) if response.data else None
+            except Exception as e:
+                # Only a missing function disables the RPC; other failures propagate
+                if getattr(e, 'code', None) not in RPC_MISSING_CODES:
+                    raise
+                log.info("Auth email lookup RPC unavailable, falling back to paginated scan: %s", e)
+                self._rpc_available = False
+        for users in self._list_pages(client):
+            for user in users:
+                if normalize_email(user.email) == email:
+                    return str(user.id)
+        return None
+
+    def find(self, client, email):
+        """Auth user id registered with `email`, or None."""
+        email = normalize_email(email)
+        user_id = self._by_email.get(email)
+        if user_id is not None:
+            self.hits += 1
+            return user_id
+        self.misses += 1
+        user_id = self._confirm(client, email)
+        self.confirmed += 1
+        if user_id is not None:
+            self.add(email, user_id)
+        return user_id
+
+    def add(self, email, user_id):
+        email = normalize_email(email)
+        if not email or not user_id:
+            return
+        with self._lock:
+            self._by_email[email] = str(user_id)
+            self._email_by_user[str(user_id)] = email
+            if self._changes_during_load is not None:
+                self._changes_during_load[email] = str(user_id)
+
+    def remove_user(self, user_id):
+        with self._lock:
+            email = self._email_by_user.pop(str(user_id), None)
+            if email is not None and self._by_email.get(email) == str(user_id):
+                del self._by_email[email]
+                if self._changes_during_load is not None:
+                    self._changes_during_load[email] = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded": self._loaded_at is not None,
+                "users": len(self._by_email),
+                "age_seconds": round(time.monotonic() - self._loaded_at, 1) if self._loaded_at is not None else None,
+                "hits": self.hits,
+                "misses": self.misses,
+                "confirmed_lookups": self.confirmed,
+                "lookup_rpc_available": self._rpc_available,
+                "loads": self.loads,
+            }
+
+
+# Process-wide directory shared by app.py and the route blueprints
+auth_directory = AuthUserDirectory()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=auth_directory._after_fork)
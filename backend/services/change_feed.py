@@ -0,0 +1,151 @@
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+# Removed members remembered per organization for delta clients
+CHANGE_FEED_MAX_TOMBSTONES = int(os.getenv('CHANGE_FEED_MAX_TOMBSTONES', '1000'))
+
+
+class _OrgChanges:
+    __slots__ = ('positions', 'members', 'latest_seq', 'floor_seq')
+
+    def __init__(self):
+        self.positions = OrderedDict()  # crew_member_id -> seq, oldest change first
+        self.members = OrderedDict()    # crew_member_id -> (seq, row or None when removed)
+        self.latest_seq = 0
+        self.floor_seq = 0              # cursors at or below this cannot be served as deltas
+
+
+class ChangeFeed:
+    """
+    Per-organization change log for the crew tracking dashboard.
+    Every roster or position change gets a sequence number; a cursor
+    "<epoch>.<seq>" lets clients ask for what changed since their last sync.
+    The epoch identifies this process, so cursors from another worker or a
+    previous run are answered with a full snapshot instead of a delta.
+    Organizations get state only once something changes in them; until then
+    their cursor is "<epoch>.0".
+    """
+
+    def __init__(self, max_tombstones=CHANGE_FEED_MAX_TOMBSTONES):
+        self.max_tombstones = max_tombstones
+        self._after_fork()
+
+    def _after_fork(self):
+        # A forked worker starts its own log; the parent's epoch must not validate its cursors
+        self.epoch = uuid.uuid4().hex[:8]
+        self._seq = 0
+        self._orgs = {}
+        self._lock = threading.Lock()
+
+    def _org(self, organization_id):
+        changes = self._orgs.get(organization_id)
+        if changes is None:
+            changes = self._orgs[organization_id] = _OrgChanges()
+            # Anything that happened before we started tracking this org is unknown
+            changes.floor_seq = self._seq
+            changes.latest_seq = self._seq
+        return changes
+
+    def _next_seq(self, changes):
+        self._seq += 1
+        changes.latest_seq = self._seq
+        return self._seq
+
+    # --- Producers ---
+
+    def positions_changed(self, organization_id, crew_member_ids):
+        with self._lock:
+            changes = self._org(str(organization_id))
+            for crew_member_id in crew_member_ids:
+                changes.positions[crew_member_id] = self._next_seq(changes)
+                changes.positions.move_to_end(crew_member_id)
+
+    def member_upserted(self, organization_id, member_row):
+        with self._lock:
+            changes = self._org(str(organization_id))
+            crew_member_id = str(member_row['id'])
+            changes.members[crew_member_id] = (self._next_seq(changes), member_row)
+            changes.members.move_to_end(crew_member_id)
+
+    def member_removed(self, organization_id, crew_member_id):
+        crew_member_id = str(crew_member_id)
+        with self._lock:
+            changes = self._org(str(organization_id))
+            changes.positions.pop(crew_member_id, None)
+            changes.members[crew_member_id] = (self._next_seq(changes), None)
+            changes.members.move_to_end(crew_member_id)
+            self._trim_tombstones(changes)
+
+    def _trim_tombstones(self, changes):
+        tombstones = [member_id for member_id, (_, row) in changes.members.items() if row is None]
+        for member_id in tombstones[:max(0, len(tombstones) - self.max_tombstones)]:
+            seq, _ = changes.members.pop(member_id)
+            # Clients older than a forgotten removal must resync from scratch
+            changes.floor_seq = max(changes.floor_seq, seq)
+
+    # --- Consumers ---
+
+    def cursor(self, organization_id):
+        with self._lock:
+            changes = self._orgs.get(str(organization_id))
+            return f"{self.epoch}.{changes.latest_seq if changes is not None else 0}"
+
+    def parse_cursor(self, organization_id, cursor):
+        """Sequence number for a cursor this process can answer with a delta, else None."""
+        if not cursor:
+            return None
+        epoch, _, seq = cursor.partition('.')
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        seq = int(seq)
+        with self._lock:
+            changes = self._orgs.get(str(organization_id))
+            if changes is None:
+                # Nothing has changed in this organization since the cursor was issued
+                return seq if seq == 0 else None
+            if seq < changes.floor_seq or seq > changes.latest_seq:
+                return None
+        return seq
+
+    def changes_since(self, organization_id, since_seq):
+        """
+        Returns (position_member_ids, member_rows, removed_member_ids) changed after
+        `since_seq`. Walks each log from the newest end, so the cost is
+        proportional to what changed rather than to the roster size.
+        """
+        with self._lock:
+            changes = self._orgs.get(str(organization_id))
+            if changes is None:
+                return [], [], []
+            position_ids = []
+            for crew_member_id in reversed(changes.positions):
+                if changes.positions[crew_member_id] <= since_seq:
+                    break
+                position_ids.append(crew_member_id)
+            member_rows = []
+            removed = []
+            for crew_member_id in reversed(changes.members):
+                seq, row = changes.members[crew_member_id]
+                if seq <= since_seq:
+                    break
+                if row is None:
+                    removed.append(crew_member_id)
+                else:
+                    member_rows.append(row)
+        return position_ids, member_rows, removed
+
+    def stats(self):
+        with self._lock:
+            return {
+                "epoch": self.epoch,
+                "seq": self._seq,
+                "organizations": len(self._orgs),
+            }
+
+
+# Process-wide change feed shared by the ingest and dashboard routes
+change_feed = ChangeFeed()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=change_feed._after_fork)
@@ -0,0 +1,289 @@
+import atexit
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from services.logs import get_logger
+
+log = get_logger('coverage')
+
+# Plow-coverage heatmap tiles (/api/organization/<org_id>/coverage/<z>/<x>/<y>)
+COVERAGE_ENABLED = os.getenv('COVERAGE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Shared by all worker processes on the host; put it on a persistent volume
+COVERAGE_PATH = os.getenv('COVERAGE_PATH', os.path.join(tempfile.gettempdir(), 'crewtrack-coverage.db'))
+# Deepest stored zoom level; deeper tiles are cut out of it (cells ~7m at z16, 64-cell tiles, 40°N)
+COVERAGE_MAX_ZOOM = int(os.getenv('COVERAGE_MAX_ZOOM', '16'))
+# Cells per tile side, a power of two
+COVERAGE_TILE_SIZE = int(os.getenv('COVERAGE_TILE_SIZE', '64'))
+# Aggregated fixes are merged into the database this often
+COVERAGE_FLUSH_INTERVAL = float(os.getenv('COVERAGE_FLUSH_INTERVAL', '2.0'))
+# Tiles without a visit for this long are deleted
+COVERAGE_RETENTION_DAYS = float(os.getenv('COVERAGE_RETENTION_DAYS', '30'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tiles (
+    organization_id TEXT NOT NULL,
+    z INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    -- zlib(counts uint32[size * size] + last_visit uint32[size * size]), row-major, north up
+    cells BLOB NOT NULL,
+    last_visit INTEGER NOT NULL,
+    PRIMARY KEY (organization_id, z, x, y)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tiles_last_visit ON tiles (last_visit);
+"""
+
+
+def mercator_pixels(lats, lons, level):
+    """Web Mercator (slippy map) integer coordinates at 2**level cells around the globe."""
+    scale = float(1 << level)
+    lats = np.clip(np.asarray(lats, dtype=np.float64), -85.05112878, 85.05112878)
+    x = (np.asarray(lons, dtype=np.float64) + 180.0) / 360.0 * scale
+    y = (1.0 - np.arcsinh(np.tan(np.radians(lats))) / np.pi) / 2.0 * scale
+    top = (1 << level) - 1
+    return np.clip(x.astype(np.int64), 0, top), np.clip(y.astype(np.int64), 0, top)
+
+
+class CoverageStore:
+    """
+    Per-organization visit counts and last-visit times on a Web Mercator tile
+    pyramid (zoom 0..max_zoom, size x size cells per tile) in a SQLite database
+    shared by the worker processes. record() aggregates fixes into per-tile
+    deltas in memory for every zoom level at once; a background thread merges
+    them into the stored tiles every `flush_interval` seconds, so serving a
+    tile at any zoom is a single keyed read.
+    """
+
+    def __init__(self, path=COVERAGE_PATH, max_zoom=COVERAGE_MAX_ZOOM, tile_size=COVERAGE_TILE_SIZE,
+                 flush_interval=COVERAGE_FLUSH_INTERVAL, retention_days=COVERAGE_RETENTION_DAYS):
+        if tile_size & (tile_size - 1):
+            raise ValueError("COVERAGE_TILE_SIZE must be a power of two")
+        self.path = path
+        self.max_zoom = max_zoom
+        self.tile_size = tile_size
+        self.tile_bits = tile_size.bit_length() - 1
+        self.flush_interval = flush_interval
+        self.retention_seconds = retention_days * 86400
+        self._after_fork()
+
+    def _after_fork(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pending = {}  # (organization_id, z, x, y) -> (counts, last_visit) deltas
+        self._wakeup = threading.Condition()
+        self._thread = None
+        self._pid = os.getpid()
+        self._stopping = False
+        self.recorded = 0
+        self.flushes = 0
+        self.flushed_tiles = 0
+        self.flush_failures = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.tile_reads = 0
+
+    @property
+    def max_request_zoom(self):
+        return self.max_zoom + self.tile_bits
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._wakeup:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='coverage-flusher', daemon=True)
+            self._thread.start()
+
+    def _empty(self):
+        size = self.tile_size
+        return np.zeros((size, size), dtype=np.uint32), np.zeros((size, size), dtype=np.uint32)
+
+    def record(self, organization_id, lats, lons, timestamps):
+        """Count fixes (epoch-second timestamps) into every zoom level of the organization's pyramid."""
+        if not len(lats):
+            return
+        organization_id = str(organization_id)
+        timestamps = np.asarray(timestamps, dtype=np.float64).astype(np.uint32)
+        px, py = mercator_pixels(lats, lons, self.max_zoom + self.tile_bits)
+        mask = self.tile_size - 1
+        deltas = []
+        for z in range(self.max_zoom + 1):
+            shift = self.max_zoom - z
+            cx, cy = px >> shift, py >> shift
+            tx, ty = cx >> self.tile_bits, cy >> self.tile_bits
+            keys = (tx << 32) | ty
+            order = np.argsort(keys, kind='stable')
+            bounds = np.flatnonzero(np.diff(keys[order])) + 1
+            for group in np.split(order, bounds):
+                first = group[0]
+                deltas.append(((organization_id, z, int(tx[first]), int(ty[first])),
+                               cy[group] & mask, cx[group] & mask, timestamps[group]))
+        with self._lock:
+            for key, rows, cols, times in deltas:
+                counts, last = self._pending.get(key) or self._pending.setdefault(key, self._empty())
+                np.add.at(counts, (rows, cols), 1)
+                np.maximum.at(last, (rows, cols), times)
+            self.recorded += len(lats)
+        self._ensure_thread()
+
+    def _merge_pending(self, pending):
+        """Put deltas back after a failed flush."""
+        with self._lock:
+            for key, (counts, last) in pending.items():
+                current = self._pending.get(key)
+                if current is None:
+                    self._pending[key] = (counts, last)
+                else:
+                    current[0][...] += counts
+                    np.maximum(current[1], last, out=current[1])
+
+    def _decode(self, blob):
+        cells = np.frombuffer(zlib.decompress(blob), dtype=np.uint32)
+        size = self.tile_size
+        return cells[:size * size].reshape(size, size), cells[size * size:].reshape(size, size)
+
+    def flush(self):
+        """Merge the pending deltas into the stored tiles in one transaction."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        started = time.perf_counter()
+        conn = self._connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for (organization_id, z, x, y), (counts, last) in pending.items():
+                    row = conn.execute('SELECT cells FROM tiles WHERE organization_id = ? AND z = ? AND x = ? AND y = ?',
+                                       (organization_id, z, x, y)).fetchone()
+                    if row is not None:
+                        stored_counts, stored_last = self._decode(row[0])
+                        counts = counts + stored_counts
+                        last = np.maximum(last, stored_last)
+                    conn.execute('INSERT OR REPLACE INTO tiles (organization_id, z, x, y, cells, last_visit) '
+                                 'VALUES (?, ?, ?, ?, ?, ?)',
+                                 (organization_id, z, x, y, zlib.compress(counts.tobytes() + last.tobytes(), 1),
+                                  int(last.max())))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            self._merge_pending(pending)
+            with self._lock:
+                self.flush_failures += 1
+            log.error("Coverage flush of %s tiles failed: %s", len(pending), e)
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.flushes += 1
+            self.flushed_tiles += len(pending)
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+
+    def _purge(self):
+        self._connection().execute('DELETE FROM tiles WHERE last_visit < ?',
+                                   (int(time.time() - self.retention_seconds),))
+
+    def _run(self):
+        next_purge = 0.0
+        while not self._stopping:
+            with self._wakeup:
+                if not self._stopping:
+                    self._wakeup.wait(self.flush_interval)
+            try:
+                self.flush()
+                if time.monotonic() >= next_purge:
+                    self._purge()
+                    next_purge = time.monotonic() + 3600
+            except Exception as e:
+                log.error("Coverage flusher error: %s", e)
+
+    def close(self, timeout=5.0):
+        """Stop the flusher and write what is still pending."""
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify_all()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+        self.flush()
+
+    def tile(self, organization_id, z, x, y):
+        """
+        (counts, last_visit) uint32 arrays of shape (size, size) for a tile, or
+        None when it has no visits. Tiles deeper than max_zoom are cut out of
+        their max_zoom ancestor, each stored cell spanning several output cells.
+        """
+        depth = max(0, z - self.max_zoom)
+        with self._lock:
+            self.tile_reads += 1
+        row = self._connection().execute(
+            'SELECT cells FROM tiles WHERE organization_id = ? AND z = ? AND x = ? AND y = ?',
+            (str(organization_id), z - depth, x >> depth, y >> depth)).fetchone()
+        if row is None:
+            return None
+        counts, last = self._decode(row[0])
+        if depth:
+            span = self.tile_size >> depth
+            top, left = (y & ((1 << depth) - 1)) * span, (x & ((1 << depth) - 1)) * span
+            counts, last = (np.repeat(np.repeat(cells[top:top + span, left:left + span], 1 << depth, 0), 1 << depth, 1)
+                            for cells in (counts, last))
+            if not counts.any():
+                return None
+        return counts, last
+
+    def stats(self):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = None
+        with self._lock:
+            return {
+                "enabled": COVERAGE_ENABLED,
+                "path": self.path,
+                "bytes": size,
+                "max_zoom": self.max_zoom,
+                "tile_size": self.tile_size,
+                "recorded_fixes": self.recorded,
+                "pending_tiles": len(self._pending),
+                "flushes": self.flushes,
+                "flushed_tiles": self.flushed_tiles,
+                "flush_failures": self.flush_failures,
+                "last_flush_ms": round(self.last_flush_ms, 2),
+                "max_flush_ms": round(self.max_flush_ms, 2),
+                "tile_reads": self.tile_reads,
+            }
+
+
+def create_coverage_store(**kwargs):
+    """The process-wide store; pending deltas are written out when the process exits."""
+    store = CoverageStore(**kwargs)
+    atexit.register(store.close)
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=store._after_fork)
+    return store
+
+
+coverage_store = create_coverage_store()
@@ -0,0 +1,193 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+from services.geo import haversine_matrix
+from services.logs import get_logger
+
+log = get_logger('dispatch')
+
+# Batch auto-dispatch (/api/organization/<org_id>/dispatch) configuration
+DISPATCH_DEFAULT_CAPACITY = int(os.getenv('DISPATCH_DEFAULT_CAPACITY', '25'))
+# Only crew members with these roles and a position at most this old are dispatched
+DISPATCH_ROLES = [role.strip() for role in os.getenv('DISPATCH_ROLES', 'driver,crew').split(',') if role.strip()]
+DISPATCH_MAX_POSITION_AGE_MINUTES = float(os.getenv('DISPATCH_MAX_POSITION_AGE_MINUTES', '60'))
+DISPATCH_MAX_CREWS = int(os.getenv('DISPATCH_MAX_CREWS', '1000'))
+DISPATCH_MAX_SITES = int(os.getenv('DISPATCH_MAX_SITES', '50000'))
+# Crews x sites above which the exact solver gives way to the greedy one
+DISPATCH_EXACT_MAX_PAIRS = int(os.getenv('DISPATCH_EXACT_MAX_PAIRS', '500000'))
+# Nearest crews per site the greedy solver considers before scanning all of them
+DISPATCH_GREEDY_CANDIDATES = int(os.getenv('DISPATCH_GREEDY_CANDIDATES', '8'))
+
+
+def cost_matrix(crew_lats, crew_lons, site_lats, site_lons, max_distance_m=None):
+    """Distances (metres) from every site to every crew, shape (sites, crews); inf beyond max_distance_m."""
+    cost = haversine_matrix(site_lats, site_lons, crew_lats, crew_lons)
+    if max_distance_m is not None:
+        cost[cost > max_distance_m] = np.inf
+    return cost
+
+
+def assign_exact(cost, capacity):
+    """
+    Minimum total distance assignment of sites to crews holding at most
+    capacity[k] sites each, by successive shortest paths. Sites are added
+    nearest first; each is routed to a crew with room either directly or by
+    shifting already assigned sites between crews along the cheapest chain.
+    The residual graph is over crews only: W[j, k] is the cheapest extra
+    distance of moving one of crew j's sites to crew k. When total capacity
+    runs out, the sites farthest from any crew are the ones left over.
+    Returns site -> crew index, -1 for unassigned.
+    """
+    n_sites, n_crews = cost.shape
+    assigned = np.full(n_sites, -1, dtype=np.int64)
+    if not n_sites or not n_crews:
+        return assigned
+    load = np.zeros(n_crews, dtype=np.int64)
+    capacity = np.asarray(capacity, dtype=np.int64)
+    members = [[] for _ in range(n_crews)]
+    moves = np.full((n_crews, n_crews), np.inf)  # W
+    movers = np.zeros((n_crews, n_crews), dtype=np.int64)  # site realizing W[j, k]
+    crews = np.arange(n_crews)
+
+    def refresh(j):
+        if not members[j]:
+            moves[j] = np.inf
+            return
+        sites = np.array(members[j], dtype=np.int64)
+        extra = cost[sites] - cost[sites, j][:, None]
+        best = np.argmin(extra, axis=0)
+        moves[j] = extra[best, crews]
+        movers[j] = sites[best]
+        moves[j, j] = np.inf
+
+    room = int(capacity.sum())
+    for site in np.argsort(cost.min(axis=1), kind='stable'):
+        if room <= 0:
+            break
+        dist = cost[site].copy()
+        nearest = int(np.argmin(dist))
+        if load[nearest] < capacity[nearest] and np.isfinite(dist[nearest]):
+            # Chains from a crew to one with room never cost less than zero while the
+            # assignment is optimal, so a nearest crew with room is the shortest path
+            members[nearest].append(int(site))
+            assigned[site] = nearest
+            load[nearest] += 1
+            room -= 1
+            refresh(nearest)
+            continue
+        pred = np.full(n_crews, -1, dtype=np.int64)
+        # Bellman-Ford over crews; the current assignment is optimal, so there are no negative cycles
+        for _ in range(n_crews):
+            through = dist[:, None] + moves
+            via = np.argmin(through, axis=0)
+            shorter = through[via, crews] < dist - 1e-9
+            if not shorter.any():
+                break
+            dist[shorter] = through[via, crews][shorter]
+            pred[shorter] = via[shorter]
+        open_dist = np.where(load < capacity, dist, np.inf)
+        target = int(np.argmin(open_dist))
+        if not np.isfinite(open_dist[target]):
+            continue  # No crew in reach has room for this site
+
+        path = []  # (site, from crew, to crew), applied after the walk so movers stay valid
+        k = target
+        while pred[k] >= 0:
+            j = int(pred[k])
+            path.append((int(movers[j, k]), j, k))
+            k = j
+        path.append((int(site), -1, k))
+        for moved, j, k in path:
+            if j >= 0:
+                members[j].remove(moved)
+            members[k].append(moved)
+            assigned[moved] = k
+        load[target] += 1
+        room -= 1
+        for j in {j for _, j, k in path if j >= 0} | {k for _, _, k in path}:
+            refresh(j)
+    return assigned
+
+
+def assign_greedy(cost, capacity, candidates=DISPATCH_GREEDY_CANDIDATES):
+    """
+    Approximate assignment for large instances: (site, crew) pairs among each
+    site's `candidates` nearest crews are taken shortest first while the crew
+    has room; sites left over then go to the nearest crew that still has room.
+    Returns site -> crew index, -1 for unassigned.
+    """
+    n_sites, n_crews = cost.shape
+    assigned = np.full(n_sites, -1, dtype=np.int64)
+    room = np.asarray(capacity, dtype=np.int64).copy()
+    if not n_sites or not n_crews:
+        return assigned
+    candidates = min(candidates, n_crews)
+    nearest = (np.argpartition(cost, candidates - 1, axis=1)[:, :candidates]
+               if candidates < n_crews else np.tile(np.arange(n_crews), (n_sites, 1)))
+    pair_cost = np.take_along_axis(cost, nearest, 1).ravel()
+    for flat in np.argsort(pair_cost, kind='stable'):
+        if not np.isfinite(pair_cost[flat]):
+            break
+        site, crew = divmod(int(flat), candidates)
+        crew = int(nearest[site, crew])
+        if assigned[site] < 0 and room[crew] > 0:
+            assigned[site] = crew
+            room[crew] -= 1
+    for site in np.flatnonzero(assigned < 0):
+        if not room.any():
+            break
+        row = np.where(room > 0, cost[site], np.inf)
+        crew = int(np.argmin(row))
+        if np.isfinite(row[crew]):
+            assigned[site] = crew
+            room[crew] -= 1
+    return assigned
+
+
+class Dispatcher:
+    """Chooses and runs an assignment solver and keeps counters for /admin/stats."""
+
+    def __init__(self, exact_max_pairs=DISPATCH_EXACT_MAX_PAIRS):
+        self.exact_max_pairs = exact_max_pairs
+        self._after_fork()
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self.runs = {"exact": 0, "greedy": 0}
+        self.committed = 0
+        self.last = None
+
+    def solve(self, cost, capacity):
+        """Returns (site -> crew index with -1 for unassigned, solver name, elapsed ms)."""
+        started = time.perf_counter()
+        method = 'exact' if cost.size <= self.exact_max_pairs else 'greedy'
+        assigned = assign_exact(cost, capacity) if method == 'exact' else assign_greedy(cost, capacity)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.runs[method] += 1
+            self.last = {"solver": method, "crews": cost.shape[1], "sites": cost.shape[0],
+                         "assigned": int((assigned >= 0).sum()), "solve_ms": round(elapsed_ms, 2)}
+        log.info("Dispatch solved %d sites x %d crews with the %s solver in %.1fms",
+                 cost.shape[0], cost.shape[1], method, elapsed_ms)
+        return assigned, method, elapsed_ms
+
+    def record_commit(self, count):
+        with self._lock:
+            self.committed += count
+
+    def stats(self):
+        with self._lock:
+            return {
+                "runs": dict(self.runs),
+                "assignments_committed": self.committed,
+                "exact_max_pairs": self.exact_max_pairs,
+                "last": self.last,
+            }
+
+
+dispatcher = Dispatcher()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=dispatcher._after_fork)
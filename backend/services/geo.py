@@ -0,0 +1,74 @@
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE_LAT = 111320.0
+
+
+def haversine_m(lat, lon, lats, lons):
+    """Great-circle distance in metres from one point to arrays of points."""
+    lat1 = np.radians(lat)
+    lats2 = np.radians(np.asarray(lats, dtype=np.float64))
+    dlat = lats2 - lat1
+    dlon = np.radians(np.asarray(lons, dtype=np.float64) - lon)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lats2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def haversine_matrix(lats_a, lons_a, lats_b, lons_b):
+    """Pairwise great-circle distances in metres, shape (len(a), len(b))."""
+    lat_a = np.radians(np.asarray(lats_a, dtype=np.float64))[:, None]
+    lon_a = np.radians(np.asarray(lons_a, dtype=np.float64))[:, None]
+    lat_b = np.radians(np.asarray(lats_b, dtype=np.float64))[None, :]
+    lon_b = np.radians(np.asarray(lons_b, dtype=np.float64))[None, :]
+    a = (np.sin((lat_b - lat_a) / 2) ** 2
+         + np.cos(lat_a) * np.cos(lat_b) * np.sin((lon_b - lon_a) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def degree_span(lat, radius_m):
+    """(dlat, dlon) in degrees covering `radius_m` around latitude `lat`."""
+    dlat = radius_m / METERS_PER_DEGREE_LAT
+    cos_lat = max(np.cos(np.radians(lat)), 1e-6)
+    dlon = min(radius_m / (METERS_PER_DEGREE_LAT * cos_lat), 360.0)
+    return dlat, dlon
+
+
+def nearest_k(distances, limit):
+    """Indices of the `limit` smallest distances, nearest first."""
+    if limit is None or limit >= len(distances):
+        return np.argsort(distances, kind='stable')
+    candidates = np.argpartition(distances, limit)[:limit]
+    return candidates[np.argsort(distances[candidates], kind='stable')]
+
+
+def haversine_pairs(lats_a, lons_a, lats_b, lons_b):
+    """Element-wise great-circle distances in metres between two equal-length point arrays."""
+    lat_a = np.radians(np.asarray(lats_a, dtype=np.float64))
+    lat_b = np.radians(np.asarray(lats_b, dtype=np.float64))
+    dlon = np.radians(np.asarray(lons_b, dtype=np.float64) - np.asarray(lons_a, dtype=np.float64))
+    a = np.sin((lat_b - lat_a) / 2) ** 2 + np.cos(lat_a) * np.cos(lat_b) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def point_in_polygon(lat, lon, poly_lats, poly_lons):
+    """Ray-casting test of one point against a polygon given as vertex arrays."""
+    lat_i, lon_i = poly_lats, poly_lons
+    lat_j, lon_j = np.roll(poly_lats, 1), np.roll(poly_lons, 1)
+    crosses = (lat_i > lat) != (lat_j > lat)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        edge_lon = (lon_j - lon_i) * (lat - lat_i) / (lat_j - lat_i) + lon_i
+    return bool(np.count_nonzero(crosses & (lon < edge_lon)) % 2)
+
+
+def distance_to_polygon_edges_m(lat, lon, poly_lats, poly_lons):
+    """Distance in metres from a point to the nearest polygon edge (local flat projection)."""
+    meters_per_degree_lon = METERS_PER_DEGREE_LAT * np.cos(np.radians(lat))
+    x1 = (poly_lons - lon) * meters_per_degree_lon
+    y1 = (poly_lats - lat) * METERS_PER_DEGREE_LAT
+    x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+    dx, dy = x2 - x1, y2 - y1
+    length_sq = dx * dx + dy * dy
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(length_sq > 0, -(x1 * dx + y1 * dy) / length_sq, 0.0)
+    t = np.clip(t, 0.0, 1.0)
+    return float(np.min(np.hypot(x1 + t * dx, y1 + t * dy)))
@@ -0,0 +1,287 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from services.geo import degree_span, distance_to_polygon_edges_m, haversine_pairs, point_in_polygon
+
+# Geofence engine configuration
+GEOFENCE_ENABLED = os.getenv('GEOFENCE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Fence used for sites whose geofence_details do not define one
+GEOFENCE_DEFAULT_RADIUS_M = float(os.getenv('GEOFENCE_DEFAULT_RADIUS_M', '75'))
+# Hysteresis band: once inside, a truck must get this far outside the fence to leave it
+GEOFENCE_EXIT_MARGIN_M = float(os.getenv('GEOFENCE_EXIT_MARGIN_M', '25'))
+# Debounce: consecutive fixes needed to confirm an arrival / a departure
+GEOFENCE_ENTER_CONFIRMATIONS = int(os.getenv('GEOFENCE_ENTER_CONFIRMATIONS', '2'))
+GEOFENCE_EXIT_CONFIRMATIONS = int(os.getenv('GEOFENCE_EXIT_CONFIRMATIONS', '2'))
+# Minimum time on site for a departure to count as a completed service visit
+GEOFENCE_MIN_SERVICE_SECONDS = float(os.getenv('GEOFENCE_MIN_SERVICE_SECONDS', '60'))
+
+CIRCLE = 0
+POLYGON = 1
+# Upper bound on fix x fence cells in one bounding-box prefilter pass
+PREFILTER_MAX_CELLS = 4000000
+
+
+def parse_geofence(details, latitude, longitude):
+    """
+    Normalize locations.geofence_details to ('circle', lat, lon, radius_m) or
+    ('polygon', lats, lons). Supported shapes:
+    - {"radius": 50} / {"radius_m": 50}, optionally with "center": {latitude, longitude}
+    - {"polygon": [[lat, lon], ...]} or [{"latitude": .., "longitude": ..}, ...]
+    - GeoJSON {"type": "Polygon", "coordinates": [[[lon, lat], ...]]}
+    Anything else falls back to a default-radius circle around the site.
+    """
+    if isinstance(details, str):
+        try:
+            details = json.loads(details)
+        except ValueError:
+            details = None
+    details = details if isinstance(details, dict) else {}
+
+    vertices = None
+    if str(details.get('type', '')).lower() == 'polygon' and details.get('coordinates'):
+        ring = details['coordinates'][0]
+        vertices = [(float(point[1]), float(point[0])) for point in ring]
+    elif details.get('polygon'):
+        vertices = [(float(point['latitude']), float(point['longitude'])) if isinstance(point, dict)
+                    else (float(point[0]), float(point[1]))
+                    for point in details['polygon']]
+    if vertices and len(vertices) >= 3:
+        lats, lons = zip(*vertices)
+        return ('polygon', np.array(lats), np.array(lons))
+
+    center = details.get('center') or {}
+    center_lat = float(center.get('latitude', latitude))
+    center_lon = float(center.get('longitude', longitude))
+    radius = details.get('radius_m', details.get('radius', GEOFENCE_DEFAULT_RADIUS_M))
+    return ('circle', center_lat, center_lon, float(radius))
+
+
+class OrgFences:
+    """Fences of one organization compiled to arrays for vectorized tests."""
+
+    def __init__(self, sites, exit_margin_m):
+        self.ids = []
+        kinds, center_lats, center_lons, radii, boxes = [], [], [], [], []
+        self.polygons = {}
+        for row in sites.rows:
+            try:
+                fence = parse_geofence(row.get('geofence_details'), row['latitude'], row['longitude'])
+            except (TypeError, ValueError, KeyError, IndexError):
+                continue
+            index = len(self.ids)
+            self.ids.append(str(row['id']))
+            if fence[0] == 'polygon':
+                _, lats, lons = fence
+                self.polygons[index] = (lats, lons)
+                mid_lat = float(lats.mean())
+                dlat, dlon = degree_span(mid_lat, exit_margin_m)
+                kinds.append(POLYGON)
+                center_lats.append(mid_lat)
+                center_lons.append(float(lons.mean()))
+                radii.append(0.0)
+                boxes.append((lats.min() - dlat, lats.max() + dlat, lons.min() - dlon, lons.max() + dlon))
+            else:
+                _, lat, lon, radius = fence
+                dlat, dlon = degree_span(lat, radius + exit_margin_m)
+                kinds.append(CIRCLE)
+                center_lats.append(lat)
+                center_lons.append(lon)
+                radii.append(radius)
+                boxes.append((lat - dlat, lat + dlat, lon - dlon, lon + dlon))
+        self.kinds = np.array(kinds, dtype=np.int8)
+        self.center_lats = np.array(center_lats, dtype=np.float64)
+        self.center_lons = np.array(center_lons, dtype=np.float64)
+        self.radii = np.array(radii, dtype=np.float64)
+        boxes = np.array(boxes, dtype=np.float64).reshape(-1, 4)
+        self.min_lats, self.max_lats, self.min_lons, self.max_lons = boxes.T
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class _FenceState:
+    __slots__ = ('inside', 'in_count', 'out_count', 'first_seen_at', 'entered_at')
+
+    def __init__(self):
+        self.inside = False
+        self.in_count = 0
+        self.out_count = 0
+        self.first_seen_at = None
+        self.entered_at = None
+
+
+class GeofenceEngine:
+    """
+    Streaming arrival/departure detection over the location ingest path.
+    Fixes are prefiltered against every fence's (hysteresis-expanded) bounding
+    box in one vectorized pass, exact circle/polygon tests run only on the
+    surviving pairs, and a small per member/fence state machine debounces
+    arrivals and departures.
+    """
+
+    def __init__(self, location_index, exit_margin_m=GEOFENCE_EXIT_MARGIN_M,
+                 enter_confirmations=GEOFENCE_ENTER_CONFIRMATIONS,
+                 exit_confirmations=GEOFENCE_EXIT_CONFIRMATIONS,
+                 min_service_seconds=GEOFENCE_MIN_SERVICE_SECONDS):
+        self.location_index = location_index
+        self.exit_margin_m = exit_margin_m
+        self.enter_confirmations = enter_confirmations
+        self.exit_confirmations = exit_confirmations
+        self.min_service_seconds = min_service_seconds
+        self._compiled = {}  # organization_id -> (OrgSites snapshot, OrgFences)
+        self._states = {}    # crew_member_id -> {location_id: _FenceState}
+        self._lock = threading.Lock()
+        self.fixes_processed = 0
+        self.candidate_pairs = 0
+        self.enters = 0
+        self.exits = 0
+        self.total_ms = 0.0
+
+    def fences(self, organization_id):
+        sites = self.location_index.sites(organization_id)
+        compiled = self._compiled.get(organization_id)
+        if compiled is None or compiled[0] is not sites:
+            compiled = (sites, OrgFences(sites, self.exit_margin_m))
+            self._compiled[organization_id] = compiled
+        return compiled[1]
+
+    def _classify(self, fences, lats, lons):
+        """
+        For each fix, the fences it is strictly inside and the fences it is inside
+        of once the hysteresis margin is added. Returns two lists of sets.
+        """
+        strict = [set() for _ in range(len(lats))]
+        expanded = [set() for _ in range(len(lats))]
+        if not len(fences):
+            return strict, expanded
+        chunk = max(1, PREFILTER_MAX_CELLS // len(fences))
+        pairs = []
+        for start in range(0, len(lats), chunk):
+            chunk_lats = lats[start:start + chunk, None]
+            chunk_lons = lons[start:start + chunk, None]
+            in_box = ((chunk_lats >= fences.min_lats) & (chunk_lats <= fences.max_lats)
+                      & (chunk_lons >= fences.min_lons) & (chunk_lons <= fences.max_lons))
+            chunk_fix_idx, chunk_fence_idx = np.nonzero(in_box)
+            pairs.append((chunk_fix_idx + start, chunk_fence_idx))
+        fix_idx = np.concatenate([pair[0] for pair in pairs])
+        fence_idx = np.concatenate([pair[1] for pair in pairs])
+        self.candidate_pairs += len(fix_idx)
+        if not len(fix_idx):
+            return strict, expanded
+
+        circles = fences.kinds[fence_idx] == CIRCLE
+        if circles.any():
+            cf, cg = fix_idx[circles], fence_idx[circles]
+            distances = haversine_pairs(lats[cf], lons[cf], fences.center_lats[cg], fences.center_lons[cg])
+            radii = fences.radii[cg]
+            for f, g, distance, radius in zip(cf.tolist(), cg.tolist(), distances.tolist(), radii.tolist()):
+                if distance <= radius:
+                    strict[f].add(fences.ids[g])
+                if distance <= radius + self.exit_margin_m:
+                    expanded[f].add(fences.ids[g])
+
+        for f, g in zip(fix_idx[~circles].tolist(), fence_idx[~circles].tolist()):
+            poly_lats, poly_lons = fences.polygons[g]
+            if point_in_polygon(lats[f], lons[f], poly_lats, poly_lons):
+                strict[f].add(fences.ids[g])
+                expanded[f].add(fences.ids[g])
+            elif distance_to_polygon_edges_m(lats[f], lons[f], poly_lats, poly_lons) <= self.exit_margin_m:
+                expanded[f].add(fences.ids[g])
+        return strict, expanded
+
+    def _step(self, organization_id, crew_member_id, timestamp, strict, expanded, events):
+        states = self._states.get(crew_member_id)
+        if states is None:
+            if not strict:
+                return
+            states = self._states[crew_member_id] = {}
+
+        for location_id in strict:
+            state = states.get(location_id)
+            if state is None:
+                state = states[location_id] = _FenceState()
+            state.out_count = 0
+            if not state.inside:
+                if state.in_count == 0:
+                    state.first_seen_at = timestamp
+                state.in_count += 1
+                if state.in_count >= self.enter_confirmations:
+                    state.inside = True
+                    state.entered_at = state.first_seen_at
+                    self.enters += 1
+                    events.append({
+                        "type": "enter",
+                        "organization_id": organization_id,
+                        "crew_member_id": crew_member_id,
+                        "location_id": location_id,
+                        "timestamp": state.entered_at,
+                    })
+
+        for location_id in [location_id for location_id in states if location_id not in strict]:
+            state = states[location_id]
+            if not state.inside:
+                del states[location_id]  # Arrival not confirmed; start over
+            elif location_id in expanded:
+                state.out_count = 0      # Inside the hysteresis band
+            else:
+                state.out_count += 1
+                if state.out_count >= self.exit_confirmations:
+                    del states[location_id]
+                    dwell = timestamp - state.entered_at
+                    self.exits += 1
+                    events.append({
+                        "type": "exit",
+                        "organization_id": organization_id,
+                        "crew_member_id": crew_member_id,
+                        "location_id": location_id,
+                        "timestamp": timestamp,
+                        "entered_at": state.entered_at,
+                        "dwell_seconds": round(dwell, 1),
+                        "serviced": dwell >= self.min_service_seconds,
+                    })
+        if not states:
+            del self._states[crew_member_id]
+
+    def process(self, organization_id, fixes):
+        """
+        Run one organization's fixes through the fences.
+        `fixes` is a list of (crew_member_id, latitude, longitude, epoch_timestamp);
+        returns enter/exit events in timestamp order.
+        """
+        if not fixes:
+            return []
+        organization_id = str(organization_id)
+        fences = self.fences(organization_id)
+        started = time.perf_counter()
+        fixes = sorted(fixes, key=lambda fix: fix[3])
+        lats = np.fromiter((fix[1] for fix in fixes), dtype=np.float64, count=len(fixes))
+        lons = np.fromiter((fix[2] for fix in fixes), dtype=np.float64, count=len(fixes))
+        events = []
+        with self._lock:
+            strict, expanded = self._classify(fences, lats, lons)
+            for i, (crew_member_id, _, _, timestamp) in enumerate(fixes):
+                self._step(organization_id, crew_member_id, timestamp, strict[i], expanded[i], events)
+            self.fixes_processed += len(fixes)
+            self.total_ms += (time.perf_counter() - started) * 1000
+        return events
+
+    def forget_member(self, crew_member_id):
+        with self._lock:
+            self._states.pop(str(crew_member_id), None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": GEOFENCE_ENABLED,
+                "organizations": len(self._compiled),
+                "members_tracked": len(self._states),
+                "fixes_processed": self.fixes_processed,
+                "candidate_pairs": self.candidate_pairs,
+                "enters": self.enters,
+                "exits": self.exits,
+                "avg_us_per_fix": round(self.total_ms * 1000 / self.fixes_processed, 2) if self.fixes_processed else 0.0,
+            }
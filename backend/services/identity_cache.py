@@ -0,0 +1,154 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+
+# Identity cache configuration
+AUTH_CACHE_TTL_SECONDS = float(os.getenv('AUTH_CACHE_TTL_SECONDS', '60'))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv('AUTH_CACHE_MAX_ENTRIES', '1024'))
+# When enabled, a verified JWT that already carries role + organization_id in
+# its user_metadata claim is trusted without a GoTrue round trip.
+AUTH_TRUST_JWT_CLAIMS = os.getenv('AUTH_TRUST_JWT_CLAIMS', 'false').lower() in ('1', 'true', 'yes')
+# How long a revoked user id is remembered (should exceed the JWT lifetime)
+AUTH_REVOCATION_TTL_SECONDS = float(os.getenv('AUTH_REVOCATION_TTL_SECONDS', '86400'))
+
+
+class IdentityCache:
+    """
+    Bounded LRU + TTL cache of verified users, keyed by the token's sub/jti.
+    An entry never outlives the token it was verified with (capped at `exp`).
+    """
+
+    def __init__(self, ttl_seconds=AUTH_CACHE_TTL_SECONDS, max_entries=AUTH_CACHE_MAX_ENTRIES,
+                 trust_claims=AUTH_TRUST_JWT_CLAIMS, revocation_ttl=AUTH_REVOCATION_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.trust_claims = trust_claims
+        self.revocation_ttl = revocation_ttl
+        self._entries = OrderedDict()  # (sub, jti) -> (user, expires_at)
+        self._revoked = {}  # user_id -> (revoked_at, forget_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.claims_hits = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _key(payload):
+        # Supabase tokens carry session_id rather than jti; fall back to iat so
+        # every issued token still maps to its own entry.
+        token_id = payload.get('jti') or payload.get('session_id') or payload.get('iat')
+        return (payload.get('sub'), token_id)
+
+    def _expiry_for(self, payload, now):
+        expires_at = now + self.ttl_seconds
+        token_exp = payload.get('exp')
+        if token_exp is not None:
+            expires_at = min(expires_at, float(token_exp))
+        return expires_at
+
+    def is_revoked(self, payload):
+        """True if the token's user was invalidated after the token was issued."""
+        user_id = payload.get('sub')
+        with self._lock:
+            revoked = self._revoked.get(user_id)
+            if revoked is None:
+                return False
+            revoked_at, forget_at = revoked
+            if time.time() >= forget_at:
+                del self._revoked[user_id]
+                return False
+        return float(payload.get('iat', 0)) <= revoked_at
+
+    def get(self, payload):
+        """Return the cached user for a verified token payload, or None."""
+        key = self._key(payload)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                user, expires_at = entry
+                if now < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return user
+                del self._entries[key]
+            if self.trust_claims:
+                user = self.user_from_claims(payload)
+                if user is not None:
+                    self.claims_hits += 1
+                    return user
+            self.misses += 1
+        return None
+
+    def put(self, payload, user):
+        """Cache a user fetched from GoTrue for the lifetime of this token (or the TTL)."""
+        if user is None:
+            return
+        now = time.time()
+        expires_at = self._expiry_for(payload, now)
+        if expires_at <= now:
+            return
+        key = self._key(payload)
+        with self._lock:
+            self._entries[key] = (user, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    @staticmethod
+    def user_from_claims(payload):
+        """
+        Build a lightweight user from verified JWT claims when the claims already
+        hold everything authorization needs (role and organization_id).
+        """
+        metadata = payload.get('user_metadata') or {}
+        if not metadata.get('role') or not metadata.get('organization_id'):
+            return None
+        return SimpleNamespace(
+            id=payload.get('sub'),
+            email=payload.get('email'),
+            user_metadata=dict(metadata),
+            app_metadata=dict(payload.get('app_metadata') or {}),
+        )
+
+    def invalidate_user(self, user_id):
+        """Drop every cached entry for a user and reject tokens issued before now."""
+        if not user_id:
+            return
+        user_id = str(user_id)
+        now = time.time()
+        with self._lock:
+            stale = [key for key in self._entries if key[0] == user_id]
+            for key in stale:
+                del self._entries[key]
+            self._revoked[user_id] = (now, now + self.revocation_ttl)
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.claims_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "trust_claims": self.trust_claims,
+                "hits": self.hits,
+                "claims_hits": self.claims_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.claims_hits) / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "revoked_users": len(self._revoked),
+            }
+
+
+# Process-wide cache shared by app.py and the route blueprints
+identity_cache = IdentityCache()
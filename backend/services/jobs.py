@@ -0,0 +1,326 @@
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from services.logs import get_logger
+
+log = get_logger('jobs')
+
+# Background job tracking configuration
+JOB_RETENTION_SECONDS = float(os.getenv('JOB_RETENTION_SECONDS', '3600'))
+JOB_MAX_RETAINED = int(os.getenv('JOB_MAX_RETAINED', '1000'))
+# Worker pool running queued job items (e.g. crew/user deletions)
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '5'))
+JOB_RETRY_BACKOFF = float(os.getenv('JOB_RETRY_BACKOFF', '1.0'))
+JOB_MAX_QUEUED_ITEMS = int(os.getenv('JOB_MAX_QUEUED_ITEMS', '10000'))
+
+
+class PermanentJobError(Exception):
+    """Raised by a job item handler for failures that retrying cannot fix."""
+
+
+class QueueFullError(Exception):
+    """Raised when a job would push the worker queue past its capacity."""
+
+
+class Job:
+    """Progress and per-item results of one long-running admin operation."""
+
+    def __init__(self, kind, organization_id, total, idempotency_key=None):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.organization_id = str(organization_id) if organization_id else None
+        self.idempotency_key = idempotency_key
+        self.key = None  # (kind, scope, idempotency key) it is registered under
+        self.status = 'queued'
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.results = []
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.started_at is None:
+                self.status = 'running'
+                self.started_at = time.time()
+
+    def advance(self, count=1):
+        with self._lock:
+            self.done += count
+
+    def finish(self, results=None, error=None):
+        with self._lock:
+            if results is not None:
+                self.results = results
+            self.error = error
+            if error:
+                self.status = 'failed'
+            else:
+                self.status = 'completed_with_errors' if self.failed else 'completed'
+            self.finished_at = time.time()
+
+    def record(self, index, result):
+        """Store the outcome of item `index`; finishes the job after its last item."""
+        with self._lock:
+            self.results[index] = result
+            self.done += 1
+            if result.get('status') == 'failed':
+                self.failed += 1
+            last = self.done >= self.total
+        if last:
+            self.finish()
+
+    @property
+    def finished(self):
+        return self.finished_at is not None
+
+    def to_dict(self, include_results=True):
+        with self._lock:
+            data = {
+                "id": self.id,
+                "kind": self.kind,
+                "status": self.status,
+                "organization_id": self.organization_id,
+                "total": self.total,
+                "done": self.done,
+                "failed": self.failed,
+                "progress": round(self.done / self.total, 4) if self.total else 1.0,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+            if self.error:
+                data["error"] = self.error
+            if include_results and (self.finished or self.results):
+                data["results"] = self.results
+            return data
+
+
+class JobRegistry:
+    """
+    In-memory registry of recent jobs for status polling, plus a worker pool
+    for jobs made of independent items. Items are retried with exponential
+    backoff until they succeed, raise PermanentJobError or run out of attempts.
+    Finished jobs are kept for `retention` seconds and at most `max_retained`
+    jobs are kept overall. Jobs, idempotency keys and workers are per process.
+    """
+
+    def __init__(self, retention=JOB_RETENTION_SECONDS, max_retained=JOB_MAX_RETAINED, workers=JOB_WORKERS,
+                 max_attempts=JOB_MAX_ATTEMPTS, retry_backoff=JOB_RETRY_BACKOFF,
+                 max_queued_items=JOB_MAX_QUEUED_ITEMS):
+        self.retention = retention
+        self.max_retained = max_retained
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.max_queued_items = max_queued_items
+        self._jobs = OrderedDict()  # job id -> Job, oldest first
+        self._by_key = {}           # (kind, scope, idempotency key) -> job id; the scope is usually the organization
+        self._lock = threading.Lock()
+        self._reset_queue()
+        self.created = 0
+        self.items_succeeded = 0
+        self.items_failed = 0
+        self.retries = 0
+
+    def _reset_queue(self):
+        self._queue = []  # heap of (ready_at, seq, job, index, item, handler, attempt)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._pid = None
+        self._busy = 0
+
+    def _after_fork(self):
+        # Queued items belong to the parent; the child starts with its own pool
+        self._lock = threading.Lock()
+        self._reset_queue()
+
+    def _prune(self):
+        now = time.time()
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished and now - job.finished_at > self.retention]:
+            self._forget(job_id)
+        while len(self._jobs) > self.max_retained:
+            self._forget(next(iter(self._jobs)))
+
+    def _forget(self, job_id):
+        job = self._jobs.pop(job_id)
+        if job.key:
+            self._by_key.pop(job.key, None)
+
+    def find_by_key(self, kind, scope, idempotency_key):
+        """Job previously created with this idempotency key in this scope (organization id), or None."""
+        if not idempotency_key:
+            return None
+        scope = str(scope) if scope else None
+        with self._lock:
+            self._prune()
+            job_id = self._by_key.get((kind, scope, idempotency_key))
+            return self._jobs.get(job_id) if job_id else None
+
+    def create(self, kind, organization_id, total, idempotency_key=None, key_scope=None):
+        """
+        Register a new job. With an idempotency key, returns (job, False) for a
+        key that was already used instead of creating a duplicate. Keys are
+        scoped to the organization unless `key_scope` names another scope.
+        """
+        job = Job(kind, organization_id, total, idempotency_key)
+        key = (kind, str(key_scope) if key_scope else job.organization_id, idempotency_key)
+        with self._lock:
+            self._prune()
+            if idempotency_key and key in self._by_key:
+                return self._jobs[self._by_key[key]], False
+            self._jobs[job.id] = job
+            if idempotency_key:
+                job.key = key
+                self._by_key[key] = job.id
+            self.created += 1
+        return job, True
+
+    def release_key(self, job):
+        """Let a retry reuse the idempotency key of a job that was never queued."""
+        if not job.key:
+            return
+        with self._lock:
+            if self._by_key.get(job.key) == job.id:
+                del self._by_key[job.key]
+
+    def get(self, job_id):
+        with self._lock:
+            self._prune()
+            return self._jobs.get(job_id)
+
+    def run_in_background(self, job, target, *args):
+        """Run target(job, *args) on a daemon thread; its return value becomes the results."""
+        def run():
+            job.start()
+            try:
+                job.finish(results=target(job, *args))
+            except Exception as e:
+                log.error("Job %s (%s) failed: %s", job.id, job.kind, e)
+                job.finish(error=str(e))
+
+        threading.Thread(target=run, name=f'job-{job.kind}', daemon=True).start()
+
+    # --- Worker pool ---
+
+    def _ensure_workers(self):
+        # Workers are started lazily so each (forked) worker process gets its own
+        if self._pid == os.getpid() and all(thread.is_alive() for thread in self._threads):
+            return
+        self._pid = os.getpid()
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+        for number in range(len(self._threads), max(1, self.workers)):
+            thread = threading.Thread(target=self._work, name=f'job-worker-{number}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def enqueue(self, job, items, handler):
+        """
+        Queue handler(item) for every item of `job`. The handler returns a dict
+        merged into the item's result; items whose handler keeps failing are
+        recorded with status "failed". Raises QueueFullError when over capacity,
+        after failing the job and releasing its idempotency key for the retry.
+        """
+        job.results = [{"item": item, "status": "queued"} for item in items]
+        if not items:
+            job.finish()
+            return
+        now = time.monotonic()
+        with self._cond:
+            full = len(self._queue) + len(items) > self.max_queued_items
+            if not full:
+                for index, item in enumerate(items):
+                    heapq.heappush(self._queue, (now, next(self._seq), job, index, item, handler, 1))
+                self._ensure_workers()
+                self._cond.notify_all()
+        if full:
+            job.finish(error="Job queue is full")
+            self.release_key(job)
+            raise QueueFullError("Job queue is full, retry later")
+
+    def _next_item(self):
+        with self._cond:
+            while True:
+                if not self._queue:
+                    self._cond.wait()
+                    continue
+                ready_at = self._queue[0][0]
+                delay = ready_at - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                self._busy += 1
+                return heapq.heappop(self._queue)
+
+    def _work(self):
+        while True:
+            _, _, job, index, item, handler, attempt = self._next_item()
+            try:
+                job.start()
+                try:
+                    outcome = handler(item) or {}
+                    job.record(index, dict({"item": item, "status": "succeeded", "attempts": attempt}, **outcome))
+                    with self._lock:
+                        self.items_succeeded += 1
+                except PermanentJobError as e:
+                    self._fail(job, index, item, attempt, e)
+                except Exception as e:
+                    if attempt >= self.max_attempts:
+                        self._fail(job, index, item, attempt, e)
+                    else:
+                        # Exponential backoff with jitter, capped at 5 minutes
+                        delay = min(300.0, self.retry_backoff * (2 ** (attempt - 1))) * random.uniform(0.5, 1.0)
+                        log.warning("Job %s item %s failed (attempt %s), retrying in %.1fs: %s", job.id, item, attempt, delay, e)
+                        with self._lock:
+                            job.results[index] = {"item": item, "status": "retrying", "attempts": attempt,
+                                                  "error": str(e)}
+                            self.retries += 1
+                        with self._cond:
+                            heapq.heappush(self._queue, (time.monotonic() + delay, next(self._seq),
+                                                         job, index, item, handler, attempt + 1))
+                            self._cond.notify()
+            finally:
+                with self._cond:
+                    self._busy -= 1
+
+    def _fail(self, job, index, item, attempt, error):
+        log.error("Job %s item %s failed permanently after %s attempt(s): %s", job.id, item, attempt, error)
+        job.record(index, {"item": item, "status": "failed", "attempts": attempt, "error": str(error)})
+        with self._lock:
+            self.items_failed += 1
+
+    def stats(self):
+        with self._lock:
+            statuses = {}
+            for job in self._jobs.values():
+                statuses[job.status] = statuses.get(job.status, 0) + 1
+            return {
+                "retained": len(self._jobs),
+                "created": self.created,
+                "by_status": statuses,
+                "workers": len([thread for thread in self._threads if thread.is_alive()]),
+                "queued_items": len(self._queue),
+                "busy_workers": self._busy,
+                "items_succeeded": self.items_succeeded,
+                "items_failed": self.items_failed,
+                "retries": self.retries,
+            }
+
+
+# Process-wide registry shared by the admin routes
+jobs = JobRegistry()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=jobs._after_fork)
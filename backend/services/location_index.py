@@ -0,0 +1,168 @@
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+from services.geo import degree_span, haversine_m, haversine_matrix, nearest_k
+
+# Spatial index over locations (sites) configuration
+LOCATION_INDEX_TTL_SECONDS = float(os.getenv('LOCATION_INDEX_TTL_SECONDS', '300'))
+LOCATION_INDEX_CELL_DEGREES = float(os.getenv('LOCATION_INDEX_CELL_DEGREES', '0.01'))  # ~1.1 km
+# Above this many grid cells a radius query just scans every site of the org
+LOCATION_INDEX_MAX_CELLS_PER_QUERY = int(os.getenv('LOCATION_INDEX_MAX_CELLS_PER_QUERY', '400'))
+
+LOCATION_FIELDS = 'id, name, address, latitude, longitude, status, geofence_details, last_serviced_date, organization_id'
+
+
+class OrgSites:
+    """Immutable snapshot of one organization's geocoded sites plus a grid over them."""
+
+    def __init__(self, rows, cell_degrees):
+        self.rows = [row for row in rows
+                     if row.get('latitude') is not None and row.get('longitude') is not None]
+        self.ids = [str(row['id']) for row in self.rows]
+        self.position = {location_id: i for i, location_id in enumerate(self.ids)}
+        self.lats = np.array([float(row['latitude']) for row in self.rows], dtype=np.float64)
+        self.lons = np.array([float(row['longitude']) for row in self.rows], dtype=np.float64)
+        self.cell_degrees = cell_degrees
+        cells = {}
+        for i, (lat, lon) in enumerate(zip(self.lats, self.lons)):
+            cells.setdefault(self._cell(lat, lon), []).append(i)
+        self.cells = {key: np.array(indices, dtype=np.int64) for key, indices in cells.items()}
+        self.loaded_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.cell_degrees), math.floor(lon / self.cell_degrees))
+
+    def candidates(self, lat, lon, radius_m):
+        """Indices of sites in grid cells overlapping the radius' bounding box."""
+        dlat, dlon = degree_span(lat, radius_m)
+        lat_lo, lon_lo = self._cell(lat - dlat, lon - dlon)
+        lat_hi, lon_hi = self._cell(lat + dlat, lon + dlon)
+        if (lat_hi - lat_lo + 1) * (lon_hi - lon_lo + 1) > LOCATION_INDEX_MAX_CELLS_PER_QUERY:
+            return np.arange(len(self.rows))
+        found = [self.cells[(i, j)]
+                 for i in range(lat_lo, lat_hi + 1)
+                 for j in range(lon_lo, lon_hi + 1)
+                 if (i, j) in self.cells]
+        return np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+
+    def subset(self, location_ids):
+        """Array indices for the given location ids (unknown ids are skipped)."""
+        return np.array([self.position[str(location_id)] for location_id in location_ids
+                         if str(location_id) in self.position], dtype=np.int64)
+
+
+class LocationIndex:
+    """
+    Per-organization spatial index over locations.latitude/longitude.
+    Snapshots are loaded lazily through `loader(organization_id)`, refreshed
+    after `ttl` seconds and patched immediately by upsert()/remove() when a
+    location changes (backend writes or database webhooks).
+    """
+
+    def __init__(self, loader, ttl=LOCATION_INDEX_TTL_SECONDS, cell_degrees=LOCATION_INDEX_CELL_DEGREES):
+        self.loader = loader  # callable(organization_id) -> list of location rows
+        self.ttl = ttl
+        self.cell_degrees = cell_degrees
+        self._orgs = {}  # organization_id -> OrgSites
+        self._org_by_location = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.queries = 0
+
+    def _store(self, organization_id, rows):
+        sites = OrgSites(rows, self.cell_degrees)
+        with self._lock:
+            self._orgs[organization_id] = sites
+            for location_id in sites.ids:
+                self._org_by_location[location_id] = organization_id
+        return sites
+
+    def sites(self, organization_id):
+        organization_id = str(organization_id)
+        sites = self._orgs.get(organization_id)
+        if sites is None or time.monotonic() - sites.loaded_at > self.ttl:
+            sites = self._store(organization_id, self.loader(organization_id))
+            self.loads += 1
+        return sites
+
+    def upsert(self, row):
+        """Apply an inserted/updated location to its organization's snapshot."""
+        organization_id = str(row.get('organization_id') or self._org_by_location.get(str(row['id'])) or '')
+        if not organization_id:
+            return
+        sites = self._orgs.get(organization_id)
+        if sites is None:
+            return  # Not loaded yet; the next query loads it fresh
+        rows = [existing for existing in sites.rows if str(existing['id']) != str(row['id'])]
+        rows.append(row)
+        self._store(organization_id, rows)
+
+    def remove(self, location_id):
+        location_id = str(location_id)
+        with self._lock:
+            organization_id = self._org_by_location.pop(location_id, None)
+        sites = self._orgs.get(organization_id) if organization_id else None
+        if sites is not None and location_id in sites.position:
+            self._store(organization_id, [row for row in sites.rows if str(row['id']) != location_id])
+
+    def invalidate(self, organization_id=None):
+        with self._lock:
+            if organization_id is None:
+                self._orgs.clear()
+            else:
+                self._orgs.pop(str(organization_id), None)
+
+    def nearby(self, organization_id, lat, lon, radius_m, limit=None, status=None):
+        """Sites within `radius_m` of a point, nearest first, as (row, distance_m) pairs."""
+        self.queries += 1
+        sites = self.sites(organization_id)
+        if not len(sites):
+            return []
+        indices = sites.candidates(lat, lon, radius_m)
+        if status:
+            indices = np.array([i for i in indices if sites.rows[i].get('status') == status], dtype=np.int64)
+        if not len(indices):
+            return []
+        distances = haversine_m(lat, lon, sites.lats[indices], sites.lons[indices])
+        within = distances <= radius_m
+        indices, distances = indices[within], distances[within]
+        order = nearest_k(distances, limit)
+        return [(sites.rows[indices[i]], float(distances[i])) for i in order]
+
+    def rank(self, organization_id, origin_lats, origin_lons, location_ids=None, limit=None):
+        """
+        Rank sites by distance for many origins in one vectorized pass.
+        Returns, per origin, a list of (location_id, distance_m) nearest first.
+        """
+        self.queries += 1
+        sites = self.sites(organization_id)
+        indices = sites.subset(location_ids) if location_ids is not None else np.arange(len(sites))
+        if not len(indices) or not len(origin_lats):
+            return [[] for _ in origin_lats]
+        matrix = haversine_matrix(origin_lats, origin_lons, sites.lats[indices], sites.lons[indices])
+        if limit is None or limit >= len(indices):
+            order = np.argsort(matrix, axis=1, kind='stable')
+        else:
+            partial = np.argpartition(matrix, limit, axis=1)[:, :limit]
+            order = np.take_along_axis(partial, np.argsort(np.take_along_axis(matrix, partial, 1), axis=1), 1)
+        distances = np.take_along_axis(matrix, order, 1)
+        ids = np.array(sites.ids, dtype=object)[indices][order]
+        return [list(zip(id_row, distance_row)) for id_row, distance_row in zip(ids.tolist(), distances.tolist())]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "organizations": len(self._orgs),
+                "sites": sum(len(sites) for sites in self._orgs.values()),
+                "loads": self.loads,
+                "queries": self.queries,
+                "cell_degrees": self.cell_degrees,
+                "ttl_seconds": self.ttl,
+            }
@@ -0,0 +1,327 @@
+import atexit
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+
+from services.logs import get_logger
+
+log = get_logger('location_ingest')
+
+# Location ingest buffer configuration
+LOCATION_BUFFER_CAPACITY = int(os.getenv('LOCATION_BUFFER_CAPACITY', '20000'))
+LOCATION_BUFFER_BATCH_SIZE = int(os.getenv('LOCATION_BUFFER_BATCH_SIZE', '500'))
+LOCATION_BUFFER_MAX_AGE = float(os.getenv('LOCATION_BUFFER_MAX_AGE', '1.0'))
+LOCATION_BUFFER_RETRY_BACKOFF = float(os.getenv('LOCATION_BUFFER_RETRY_BACKOFF', '0.5'))
+LOCATION_BATCH_MAX_FIXES = int(os.getenv('LOCATION_BATCH_MAX_FIXES', '1000'))
+
+# Postgres error classes that condemn the row rather than the request: data exceptions
+# (22P02 bad uuid, 22003 out of range, ...) and integrity violations (23503 missing member, ...)
+PERMANENT_SQLSTATE_CLASSES = ('22', '23')
+# Bare HTTP errors (no PostgREST error body) that the same rows will always get;
+# auth and permission failures are configuration problems and stay retryable
+PERMANENT_HTTP_STATUSES = {400, 409, 413, 422}
+
+
+def parse_timestamp(value):
+    """
+    Convert a fix timestamp to epoch seconds.
+    Accepts ISO 8601 strings, epoch seconds or epoch milliseconds; None means now.
+    """
+    if value is None:
+        return time.time()
+    if isinstance(value, bool):
+        raise ValueError("Invalid timestamp")
+    if isinstance(value, (int, float)):
+        value = float(value)
+        # Anything this large is a JavaScript millisecond timestamp
+        return value / 1000.0 if value > 1e11 else value
+    if isinstance(value, str):
+        text = value.strip()
+        if text.endswith('Z'):
+            text = text[:-1] + '+00:00'
+        parsed = datetime.fromisoformat(text)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+    raise ValueError("Invalid timestamp")
+
+
+def parse_time_param(value):
+    """
+    Epoch seconds of a query-string time (ISO 8601, epoch seconds or epoch
+    milliseconds), or None when the parameter is missing or empty.
+    """
+    if value is None or value == '':
+        return None
+    try:
+        return parse_timestamp(float(value))
+    except ValueError:
+        return parse_timestamp(value)
+
+
+def format_timestamp(epoch_seconds):
+    """Epoch seconds -> ISO 8601 UTC string as stored in crew_locations.timestamp"""
+    return datetime.fromtimestamp(epoch_seconds, tz=timezone.utc).isoformat()
+
+
+def fix_row_id(crew_member_id, fix_id=None):
+    """
+    crew_locations id for a fix. A client-supplied fix id (unique per crew member)
+    always maps to the same row id, so a retried fix is stored once; fixes
+    without one get a random id.
+    """
+    if fix_id is None:
+        # uuid4() reads os.urandom, a GIL-releasing syscall per fix; ids need not be unguessable
+        return str(uuid.UUID(int=random.getrandbits(128), version=4))
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f'crewtrack:fix:{crew_member_id}:{fix_id}'))
+
+
+def normalize_fix(raw, default_crew_member_id=None):
+    """
+    Validate one incoming GPS fix and build its crew_locations row.
+    Returns (row, None) on success or (None, error_message).
+    """
+    if not isinstance(raw, dict):
+        return None, "Fix must be an object"
+    crew_member_id = raw.get('crew_member_id') or default_crew_member_id
+    if not crew_member_id:
+        return None, "Missing crew_member_id"
+    try:
+        # Postgres would refuse anything else, and only once the fix reaches the forwarder
+        crew_member_id = str(uuid.UUID(str(crew_member_id)))
+    except ValueError:
+        return None, "Invalid crew_member_id"
+    try:
+        latitude = float(raw['latitude'])
+        longitude = float(raw['longitude'])
+    except KeyError:
+        return None, "Missing latitude/longitude"
+    except (TypeError, ValueError):
+        return None, "Invalid latitude/longitude"
+    if not (-90.0 <= latitude <= 90.0) or not (-180.0 <= longitude <= 180.0):
+        return None, "Latitude/longitude out of range"
+    try:
+        timestamp = format_timestamp(parse_timestamp(raw.get('timestamp')))
+    except (TypeError, ValueError, OverflowError, OSError):
+        # fromtimestamp() refuses years past 9999 with any of the last three
+        return None, "Invalid timestamp"
+    fix_id = raw.get('fix_id')
+    if fix_id is not None and (isinstance(fix_id, bool) or not isinstance(fix_id, (str, int)) or fix_id == ''):
+        return None, "Invalid fix_id"
+    return {
+        'id': fix_row_id(crew_member_id, fix_id),
+        'crew_member_id': crew_member_id,
+        'latitude': latitude,
+        'longitude': longitude,
+        'timestamp': timestamp,
+    }, None
+
+
+def is_permanent_write_error(error):
+    """True when a failed insert will fail the same way however often it is retried."""
+    code = getattr(error, 'code', None)
+    if isinstance(code, int):
+        return code in PERMANENT_HTTP_STATUSES
+    if isinstance(code, str):
+        if code.isdigit() and len(code) == 3:
+            return int(code) in PERMANENT_HTTP_STATUSES
+        return code[:2] in PERMANENT_SQLSTATE_CLASSES
+    return False
+
+
+def write_isolating_bad_rows(writer, rows):
+    """
+    Write rows through `writer`, bisecting a batch refused with a permanent
+    error until the offending rows are isolated. Returns the refused rows as
+    (row, error) pairs; everything else was written. Transient errors are
+    raised as they are, and a retry of the whole batch is safe because stored
+    row ids are skipped.
+    """
+    try:
+        writer(rows)
+        return []
+    except Exception as e:
+        if not is_permanent_write_error(e):
+            raise
+        if len(rows) == 1:
+            return [(rows[0], e)]
+    middle = len(rows) // 2
+    return write_isolating_bad_rows(writer, rows[:middle]) + write_isolating_bad_rows(writer, rows[middle:])
+
+
+def log_dropped_rows(dropped, source):
+    for row, error in dropped:
+        log.warning("%s dropped a location fix the database refused: %s", source, error,
+                    extra={"fix_row_id": row.get('id'), "crew_member_id": row.get('crew_member_id')})
+
+
+class LocationWriteBuffer:
+    """
+    In-process write buffer for crew_locations rows.
+    A background thread flushes bulk inserts when `batch_size` rows are queued
+    or the oldest queued row is `max_age` seconds old. Failed inserts are
+    retried with backoff, except that rows the database refuses outright are
+    isolated and dropped so they cannot hold up the rest. When `capacity` rows
+    are pending, submit() refuses new rows so callers can apply backpressure.
+    """
+
+    def __init__(self, writer, capacity=LOCATION_BUFFER_CAPACITY, batch_size=LOCATION_BUFFER_BATCH_SIZE,
+                 max_age=LOCATION_BUFFER_MAX_AGE, retry_backoff=LOCATION_BUFFER_RETRY_BACKOFF):
+        self.writer = writer  # callable(rows) performing one bulk insert
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.max_age = max_age
+        self.retry_backoff = retry_backoff
+        self._queue = deque()  # (enqueued_at, row)
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        self._consecutive_failures = 0
+        self._retry_at = 0.0
+        self.enqueued = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.flushed = 0
+        self.flush_count = 0
+        self.flush_failures = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def _ensure_thread(self):
+        # The flusher is started lazily so each (forked) worker gets its own
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='location-write-buffer', daemon=True)
+        self._thread.start()
+
+    def _after_fork(self):
+        # Rows queued in the parent are the parent's to flush
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._thread = None
+        self._stopping = False
+
+    def submit(self, rows):
+        """Queue rows for insertion. Returns False (nothing queued) when the buffer is full."""
+        if not rows:
+            return True
+        now = time.monotonic()
+        with self._cond:
+            if len(self._queue) + len(rows) > self.capacity:
+                self.rejected += len(rows)
+                return False
+            self._queue.extend((now, row) for row in rows)
+            self.enqueued += len(rows)
+            self._ensure_thread()
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+        return True
+
+    @property
+    def depth(self):
+        return len(self._queue)
+
+    def _take_batch(self):
+        count = min(self.batch_size, len(self._queue))
+        return [self._queue.popleft()[1] for _ in range(count)]
+
+    def _wait_for_batch(self):
+        """Block until a batch is due (size, age or shutdown); returns the rows to write."""
+        with self._cond:
+            while True:
+                if not self._queue:
+                    if self._stopping:
+                        return None
+                    self._cond.wait()
+                    continue
+                now = time.monotonic()
+                if now < self._retry_at and not self._stopping:
+                    self._cond.wait(self._retry_at - now)
+                    continue
+                age = now - self._queue[0][0]
+                if self._stopping or len(self._queue) >= self.batch_size or age >= self.max_age:
+                    return self._take_batch()
+                self._cond.wait(self.max_age - age)
+
+    def _write(self, rows):
+        started = time.perf_counter()
+        try:
+            dropped = write_isolating_bad_rows(self.writer, rows)
+        except Exception as e:
+            with self._cond:
+                self.flush_failures += 1
+                self._consecutive_failures += 1
+                # Put the rows back at the front so ordering is preserved
+                requeued_at = time.monotonic()
+                self._queue.extendleft((requeued_at, row) for row in reversed(rows))
+                delay = min(30.0, self.retry_backoff * (2 ** (self._consecutive_failures - 1)))
+                self._retry_at = requeued_at + delay
+            log.warning("Location buffer flush of %s rows failed (retrying in %.1fs): %s", len(rows), delay, e)
+            return False
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        log_dropped_rows(dropped, "Location buffer")
+        with self._cond:
+            self._consecutive_failures = 0
+            self._retry_at = 0.0
+            self.dropped += len(dropped)
+            self.flushed += len(rows) - len(dropped)
+            self.flush_count += 1
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self.total_flush_ms += elapsed_ms
+        return True
+
+    def _run(self):
+        while True:
+            rows = self._wait_for_batch()
+            if rows is None:
+                return
+            if not self._write(rows) and self._stopping:
+                # Give up on shutdown rather than spin on a dead upstream
+                return
+
+    def close(self, timeout=5.0):
+        """Flush what is queued and stop the background thread."""
+        with self._cond:
+            self._stopping = True
+            self._retry_at = 0.0
+            self._cond.notify_all()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+
+    def stats(self):
+        with self._cond:
+            oldest_age = time.monotonic() - self._queue[0][0] if self._queue else 0.0
+            return {
+                "queue_depth": len(self._queue),
+                "capacity": self.capacity,
+                "batch_size": self.batch_size,
+                "max_age_seconds": self.max_age,
+                "oldest_age_seconds": round(oldest_age, 3),
+                "enqueued": self.enqueued,
+                "rejected": self.rejected,
+                "dropped": self.dropped,
+                "flushed": self.flushed,
+                "flush_count": self.flush_count,
+                "flush_failures": self.flush_failures,
+                "last_flush_ms": round(self.last_flush_ms, 2),
+                "avg_flush_ms": round(self.total_flush_ms / self.flush_count, 2) if self.flush_count else 0.0,
+                "max_flush_ms": round(self.max_flush_ms, 2),
+            }
+
+
+def create_location_buffer(writer, **kwargs):
+    """Build a write buffer that flushes what it holds when the process exits."""
+    buffer = LocationWriteBuffer(writer, **kwargs)
+    atexit.register(buffer.close)
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=buffer._after_fork)
+    return buffer
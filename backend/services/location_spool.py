@@ -0,0 +1,372 @@
+import atexit
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+from services.location_ingest import (
+    LOCATION_BUFFER_BATCH_SIZE, LOCATION_BUFFER_MAX_AGE, LOCATION_BUFFER_RETRY_BACKOFF, log_dropped_rows,
+    write_isolating_bad_rows
+)
+from services.logs import get_logger
+
+log = get_logger('location_spool')
+
+# Durable local spool in front of crew_locations; ingest is acknowledged once a fix is on disk
+LOCATION_SPOOL_ENABLED = os.getenv('LOCATION_SPOOL_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Put this on a persistent volume; it is shared by all worker processes on the host
+LOCATION_SPOOL_PATH = os.getenv('LOCATION_SPOOL_PATH',
+                                os.path.join(tempfile.gettempdir(), 'crewtrack-location-spool.db'))
+# Unforwarded fixes held before ingest answers 503
+LOCATION_SPOOL_MAX_ROWS = int(os.getenv('LOCATION_SPOOL_MAX_ROWS', '1000000'))
+# Forwarded fix ids are remembered this long to drop client retries locally
+LOCATION_SPOOL_DEDUPE_SECONDS = float(os.getenv('LOCATION_SPOOL_DEDUPE_SECONDS', '3600'))
+# "NORMAL" survives process crashes; "FULL" also survives power loss at an fsync per append
+LOCATION_SPOOL_SYNCHRONOUS = os.getenv('LOCATION_SPOOL_SYNCHRONOUS', 'NORMAL').upper()
+# One forwarder per spool file holds a lease; the others take over when it lapses
+LOCATION_SPOOL_LEASE_SECONDS = float(os.getenv('LOCATION_SPOOL_LEASE_SECONDS', '30'))
+# How often the forwarder looks for fixes appended by other processes
+LOCATION_SPOOL_POLL_INTERVAL = float(os.getenv('LOCATION_SPOOL_POLL_INTERVAL', '0.5'))
+
+ROW_FIELDS = ('id', 'crew_member_id', 'latitude', 'longitude', 'timestamp')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fixes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    crew_member_id TEXT NOT NULL,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL,
+    timestamp TEXT NOT NULL,
+    enqueued_at REAL NOT NULL
+);
+-- Forwarder lease and progress: rows up to forwarded_seq are in crew_locations
+CREATE TABLE IF NOT EXISTS forwarder (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    forwarded_seq INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO forwarder (id, owner, expires_at, forwarded_seq) VALUES (1, '', 0, 0);
+"""
+
+
+class LocationSpool:
+    """
+    Store-and-forward spool for crew_locations rows in a SQLite database (WAL).
+    submit() appends rows locally and returns; a background forwarder drains
+    them in sequence order, `batch_size` at a time, through `writer` with
+    retry and backoff, and keeps a forwarded-sequence watermark. Rows the
+    database refuses outright are isolated and dropped so the watermark keeps
+    moving past them. Rows are keyed
+    by their id, so a fix resubmitted while it is spooled or recently forwarded
+    is dropped.
+    """
+
+    def __init__(self, writer, path=LOCATION_SPOOL_PATH, ready=None, max_rows=LOCATION_SPOOL_MAX_ROWS,
+                 batch_size=LOCATION_BUFFER_BATCH_SIZE, max_age=LOCATION_BUFFER_MAX_AGE,
+                 retry_backoff=LOCATION_BUFFER_RETRY_BACKOFF, dedupe_seconds=LOCATION_SPOOL_DEDUPE_SECONDS,
+                 lease_seconds=LOCATION_SPOOL_LEASE_SECONDS, poll_interval=LOCATION_SPOOL_POLL_INTERVAL,
+                 synchronous=LOCATION_SPOOL_SYNCHRONOUS):
+        self.writer = writer  # callable(rows) performing one bulk insert
+        self.ready = ready  # callable() -> False while there is nowhere to forward to
+        self.path = path
+        self.max_rows = max_rows
+        self.batch_size = batch_size
+        self.max_age = max_age
+        self.retry_backoff = retry_backoff
+        self.dedupe_seconds = dedupe_seconds
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.synchronous = synchronous if synchronous in ('OFF', 'NORMAL', 'FULL', 'EXTRA') else 'NORMAL'
+        self._stats_lock = threading.Lock()
+        self.appended = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.forwarded = 0
+        self.forward_count = 0
+        self.forward_failures = 0
+        self.last_forward_ms = 0.0
+        self.max_forward_ms = 0.0
+        self.total_forward_ms = 0.0
+        self.last_forward_lag = 0.0
+        self._last_depth = 0
+        self._after_fork()
+
+    def _after_fork(self):
+        # SQLite connections and the forwarder thread must not cross fork()
+        self._local = threading.local()
+        # Writers in one process queue here; SQLite's own busy wait sleeps in coarse steps
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._thread = None
+        self._pid = os.getpid()
+        self._stopping = False
+        self._owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._leader = False
+        self._lease_renew_at = 0.0
+        self._consecutive_failures = 0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Autocommit; transactions are opened explicitly
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(f'PRAGMA synchronous={self.synchronous}')
+            # Checkpoints run on the forwarder thread instead of stalling an ingest commit
+            conn.execute('PRAGMA wal_autocheckpoint=0')
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _ensure_thread(self):
+        # Started lazily so each (forked) worker gets its own
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._wakeup:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='location-spool-forwarder', daemon=True)
+            self._thread.start()
+
+    def start(self):
+        """Start forwarding what an earlier process left in the spool."""
+        self._ensure_thread()
+
+    @staticmethod
+    def _depth(conn):
+        """
+        Unforwarded rows; sequence numbers have no gaps past the watermark.
+        Once purging has emptied the table, MAX(seq) is below the watermark
+        and nothing is pending.
+        """
+        return conn.execute('SELECT MAX(0, COALESCE((SELECT MAX(seq) FROM fixes), 0) - '
+                            '(SELECT forwarded_seq FROM forwarder WHERE id = 1))').fetchone()[0]
+
+    def _pending_bounds(self, conn):
+        """(depth, oldest enqueued_at) of unforwarded rows"""
+        forwarded_seq = conn.execute('SELECT forwarded_seq FROM forwarder WHERE id = 1').fetchone()[0]
+        first = conn.execute('SELECT enqueued_at FROM fixes WHERE seq > ? ORDER BY seq LIMIT 1',
+                             (forwarded_seq,)).fetchone()
+        if first is None:
+            return 0, None
+        return self._depth(conn), first[0]
+
+    def submit(self, rows):
+        """Append rows to the spool. Returns False (nothing appended) when the spool is full."""
+        if not rows:
+            return True
+        conn = self._connection()
+        now = time.time()
+        with self._write_lock:
+            appended = self._append(conn, rows, now)
+        if appended is None:
+            with self._stats_lock:
+                self.rejected += len(rows)
+            return False
+        with self._stats_lock:
+            self.appended += appended
+            self.duplicates += len(rows) - appended
+        self._ensure_thread()
+        # A partial batch waits for its age limit; the forwarder polls for that
+        if appended and self._last_depth >= self.batch_size:
+            with self._wakeup:
+                self._wakeup.notify()
+        return True
+
+    def _append(self, conn, rows, now):
+        """Insert the rows not seen before in one transaction; their count, or None when full."""
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            depth = self._depth(conn)
+            if depth + len(rows) > self.max_rows:
+                conn.execute('ROLLBACK')
+                return None
+            # Drop duplicates up front rather than with INSERT OR IGNORE, which
+            # would burn sequence numbers and break the depth arithmetic
+            by_id = {str(row['id']): row for row in rows}
+            ids = list(by_id)
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                for (seen,) in conn.execute(f'SELECT id FROM fixes WHERE id IN ({",".join("?" * len(chunk))})',
+                                            chunk):
+                    by_id.pop(seen, None)
+            conn.executemany('INSERT INTO fixes (id, crew_member_id, latitude, longitude, timestamp, enqueued_at) '
+                             'VALUES (?, ?, ?, ?, ?, ?)',
+                             [(row_id, str(row['crew_member_id']), row['latitude'], row['longitude'],
+                               row['timestamp'], now) for row_id, row in by_id.items()])
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        self._last_depth = depth + len(by_id)
+        return len(by_id)
+
+    @property
+    def depth(self):
+        """Depth as of this process's last append; stats() reads the current one."""
+        return self._last_depth
+
+    def _hold_lease(self, conn):
+        """Take or renew the forwarder lease; True while this process is the forwarder."""
+        now = time.time()
+        if self._leader and now < self._lease_renew_at:
+            return True
+        with self._write_lock:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                owner, expires_at = conn.execute('SELECT owner, expires_at FROM forwarder WHERE id = 1').fetchone()
+                leader = owner == self._owner or expires_at < now
+                if leader:
+                    conn.execute('UPDATE forwarder SET owner = ?, expires_at = ? WHERE id = 1',
+                                 (self._owner, now + self.lease_seconds))
+                    self._lease_renew_at = now + self.lease_seconds / 3
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        if leader != self._leader:
+            log.info("Location spool forwarder lease %s", "acquired" if leader else "lost",
+                     extra={"owner": self._owner})
+        self._leader = leader
+        return leader
+
+    def _release_lease(self, conn):
+        with self._write_lock:
+            conn.execute("UPDATE forwarder SET owner = '', expires_at = 0 WHERE id = 1 AND owner = ?",
+                         (self._owner,))
+        self._leader = False
+
+    def _wait(self, seconds):
+        with self._wakeup:
+            if not self._stopping:
+                self._wakeup.wait(max(0.0, seconds))
+
+    def _next_batch(self, conn):
+        """The oldest pending rows once a batch is due (size or age), else (None, seconds to wait)."""
+        rows = conn.execute('SELECT seq, enqueued_at, id, crew_member_id, latitude, longitude, timestamp '
+                            'FROM fixes WHERE seq > (SELECT forwarded_seq FROM forwarder WHERE id = 1) '
+                            'ORDER BY seq LIMIT ?', (self.batch_size,)).fetchall()
+        if not rows:
+            return None, self.poll_interval
+        age = time.time() - rows[0][1]
+        if len(rows) < self.batch_size and age < self.max_age and not self._stopping:
+            return None, min(self.poll_interval, self.max_age - age)
+        return rows, 0.0
+
+    def _forward(self, conn, batch):
+        started = time.perf_counter()
+        try:
+            dropped = write_isolating_bad_rows(self.writer, [dict(zip(ROW_FIELDS, fix[2:])) for fix in batch])
+        except Exception as e:
+            self._consecutive_failures += 1
+            delay = min(30.0, self.retry_backoff * (2 ** (self._consecutive_failures - 1)))
+            with self._stats_lock:
+                self.forward_failures += 1
+            log.warning("Location spool forward of %s rows failed (retrying in %.1fs): %s", len(batch), delay, e)
+            return delay
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        now = time.time()
+        log_dropped_rows(dropped, "Location spool")
+        with self._write_lock:
+            conn.execute('UPDATE forwarder SET forwarded_seq = MAX(forwarded_seq, ?) WHERE id = 1', (batch[-1][0],))
+        self._consecutive_failures = 0
+        with self._stats_lock:
+            self.dropped += len(dropped)
+            self.forwarded += len(batch) - len(dropped)
+            self.forward_count += 1
+            self.last_forward_ms = elapsed_ms
+            self.max_forward_ms = max(self.max_forward_ms, elapsed_ms)
+            self.total_forward_ms += elapsed_ms
+            self.last_forward_lag = now - batch[0][1]
+        return 0.0
+
+    def _purge(self, conn):
+        """Forget forwarded rows older than the dedupe window."""
+        with self._write_lock:
+            conn.execute('DELETE FROM fixes WHERE seq <= (SELECT forwarded_seq FROM forwarder WHERE id = 1) '
+                         'AND enqueued_at < ?', (time.time() - self.dedupe_seconds,))
+
+    def _run(self):
+        conn = self._connection()
+        next_purge = 0.0
+        next_checkpoint = 0.0
+        while not self._stopping:
+            try:
+                if time.monotonic() >= next_checkpoint:
+                    conn.execute('PRAGMA wal_checkpoint(PASSIVE)')
+                    next_checkpoint = time.monotonic() + 1.0
+                if self.ready is not None and not self.ready():
+                    self._wait(self.poll_interval)
+                    continue
+                if not self._hold_lease(conn):
+                    self._wait(self.lease_seconds / 2)
+                    continue
+                batch, delay = self._next_batch(conn)
+                if batch is not None:
+                    delay = self._forward(conn, batch)
+                if time.monotonic() >= next_purge:
+                    self._purge(conn)
+                    next_purge = time.monotonic() + 60
+                if delay:
+                    self._wait(delay)
+            except sqlite3.Error as e:
+                log.error("Location spool forwarder error: %s", e)
+                self._wait(1.0)
+        try:
+            self._release_lease(conn)
+        except sqlite3.Error:
+            pass
+
+    def close(self, timeout=5.0):
+        """Stop the forwarder; spooled rows stay on disk for the next process."""
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify_all()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+
+    def stats(self):
+        try:
+            depth, oldest = self._pending_bounds(self._connection())
+        except sqlite3.Error as e:
+            log.error("Error reading location spool depth: %s", e)
+            depth, oldest = None, None
+        with self._stats_lock:
+            return {
+                "path": self.path,
+                "depth": depth,
+                "max_rows": self.max_rows,
+                "lag_seconds": round(time.time() - oldest, 3) if oldest is not None else 0.0,
+                "forwarder": "leader" if self._leader else "standby",
+                "appended": self.appended,
+                "duplicates": self.duplicates,
+                "rejected": self.rejected,
+                "dropped": self.dropped,
+                "forwarded": self.forwarded,
+                "forward_count": self.forward_count,
+                "forward_failures": self.forward_failures,
+                "last_forward_ms": round(self.last_forward_ms, 2),
+                "avg_forward_ms": round(self.total_forward_ms / self.forward_count, 2) if self.forward_count else 0.0,
+                "max_forward_ms": round(self.max_forward_ms, 2),
+                "last_forward_lag_seconds": round(self.last_forward_lag, 3),
+            }
+
+
+def create_location_spool(writer, **kwargs):
+    """Build a spool whose forwarder stops (leaving rows on disk) when the process exits."""
+    spool = LocationSpool(writer, **kwargs)
+    atexit.register(spool.close)
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=spool._after_fork)
+    return spool
@@ -0,0 +1,112 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+
+# Structured logging configuration
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# "json" (one object per line) or "text"
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').lower()
+# Fraction of requests that get an access log line (errors are always logged)
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '1.0'))
+# Same for the high-volume ingest/polling routes below (Flask rule strings); 0 turns them off
+LOG_HOT_ROUTE_SAMPLE_RATE = float(os.getenv('LOG_HOT_ROUTE_SAMPLE_RATE', '0'))
+LOG_HOT_ROUTES = {route.strip() for route in os.getenv(
+    'LOG_HOT_ROUTES',
+    '/api/crew/location,/api/crew/location/batch,/api/crew/current-location/<crew_member_id>,'
+    '/api/organization/<org_id>/positions,/api/organization/<org_id>/changes,'
+    '/api/organization/<org_id>/stream,/metrics').split(',') if route.strip()}
+# Requests slower than this are always logged, sampled or not
+LOG_SLOW_REQUEST_MS = float(os.getenv('LOG_SLOW_REQUEST_MS', '1000'))
+
+# Standard LogRecord attributes; anything else on a record came from `extra`
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and any `extra` fields."""
+
+    def format(self, record):
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Plain `time level logger message key=value ...` lines for local development."""
+
+    def format(self, record):
+        fields = ' '.join(f'{key}={value}' for key, value in vars(record).items()
+                          if key not in _RECORD_FIELDS and not key.startswith('_'))
+        line = (f"{time.strftime('%H:%M:%S', time.localtime(record.created))} {record.levelname:<7} "
+                f"{record.name} {record.getMessage()}" + (f" {fields}" if fields else ''))
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+_listener = None
+
+
+def configure_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, stream=None):
+    """
+    Route the `crewtrack` loggers through a queue to a stdout handler, so request
+    threads only enqueue records and the write itself happens on a listener thread.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+    records = queue.SimpleQueue()
+    root = logging.getLogger('crewtrack')
+    root.handlers[:] = [logging.handlers.QueueHandler(records)]
+    root.setLevel(level)
+    root.propagate = False
+    _listener = logging.handlers.QueueListener(records, handler)
+    _listener.start()
+    return root
+
+
+def _after_fork():
+    # The listener thread does not survive fork(); start a fresh one in the child
+    if _listener is not None:
+        _listener._thread = None
+        _listener.start()
+
+
+def _shutdown():
+    if _listener is not None:
+        _listener.stop()
+
+
+def get_logger(name):
+    return logging.getLogger(f'crewtrack.{name}')
+
+
+def should_log_request(route, status, duration_ms):
+    """Sampling decision for one access log line."""
+    if status >= 500 or duration_ms >= LOG_SLOW_REQUEST_MS:
+        return True
+    rate = LOG_HOT_ROUTE_SAMPLE_RATE if route in LOG_HOT_ROUTES else LOG_SAMPLE_RATE
+    return rate >= 1.0 or (rate > 0 and random.random() < rate)
+
+
+configure_logging()
+atexit.register(_shutdown)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,183 @@
+import bisect
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency histogram buckets in seconds (Prometheus client defaults)
+METRICS_BUCKETS = tuple(float(b) for b in os.getenv(
+    'METRICS_BUCKETS', '0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10').split(','))
+
+_UUID_RE = re.compile(r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with labels."""
+
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, _format_labels(self.labelnames, labels), value) for labels, value in items]
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram with labels."""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=METRICS_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labelvalues)
+            if series is None:
+                series = self._values[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *labelvalues):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labelvalues)
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._values.items()]
+        samples = []
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                samples.append((self.name + '_bucket', _format_labels(self.labelnames, labels, le), cumulative))
+            samples.append((self.name + '_count', _format_labels(self.labelnames, labels), cumulative))
+            samples.append((self.name + '_sum', _format_labels(self.labelnames, labels), series[-1]))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Process-local metric registry rendered in the Prometheus text format.
+    Gauges are read at scrape time from collector callbacks returning
+    {labels_dict_or_None: value} maps, so hot paths never touch them.
+    With several worker processes every worker serves its own numbers.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._gauges = []  # (name, documentation, callback)
+        self._lock = threading.Lock()
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=METRICS_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, documentation, callback):
+        with self._lock:
+            self._gauges.append((name, documentation, callback))
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+            gauges = list(self._gauges)
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_format_value(value)}')
+        for name, documentation, callback in gauges:
+            try:
+                values = callback()
+            except Exception as e:
+                values = {}
+                lines.append(f'# gauge {name} failed: {_escape(e)}')
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} gauge')
+            for labels, value in values.items():
+                label_text = _format_labels(*zip(*sorted(dict(labels).items()))) if labels else ''
+                lines.append(f'{name}{label_text} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def upstream_operation(method, path):
+    """
+    (service, operation, target) labels for a Supabase HTTP call, e.g.
+    ('postgrest', 'insert', 'crew_locations') or ('auth', 'GET', 'admin/users/:id').
+    """
+    if '/rest/v1/' in path:
+        target = path.split('/rest/v1/', 1)[1].split('?', 1)[0]
+        if target.startswith('rpc/'):
+            return 'postgrest', 'rpc', target[4:]
+        operation = {'GET': 'select', 'HEAD': 'select', 'POST': 'insert', 'PATCH': 'update',
+                     'PUT': 'upsert', 'DELETE': 'delete'}.get(method, method)
+        return 'postgrest', operation, target
+    if '/auth/v1/' in path:
+        target = _UUID_RE.sub(':id', path.split('/auth/v1/', 1)[1].split('?', 1)[0])
+        return 'auth', method, target
+    return 'other', method, ''
+
+
+# Process-wide registry and the metrics shared across modules
+registry = MetricsRegistry()
+http_requests = registry.counter(
+    'http_requests_total', 'HTTP requests by route and status code', ('method', 'route', 'status'))
+http_request_duration = registry.histogram(
+    'http_request_duration_seconds', 'Time spent in request handlers by route', ('method', 'route'))
+upstream_requests = registry.counter(
+    'supabase_requests_total', 'Supabase HTTP calls by operation and status code',
+    ('service', 'operation', 'target', 'status'))
+upstream_duration = registry.histogram(
+    'supabase_request_duration_seconds', 'Supabase HTTP call latency (including transport retries)',
+    ('service', 'operation', 'target'))
+stage_duration = registry.histogram(
+    'app_stage_duration_seconds', 'Time spent in named in-process stages of request handling', ('stage',))
@@ -0,0 +1,198 @@
+import csv
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from services.auth_directory import auth_directory, normalize_email
+from services.change_feed import change_feed
+from services.logs import get_logger
+from services.positions import position_index
+from services.supabase_clients import fetch_pages
+
+log = get_logger('onboarding')
+
+# Bulk crew onboarding (POST /crew-members/bulk) configuration
+BULK_ONBOARD_MAX_ROWS = int(os.getenv('BULK_ONBOARD_MAX_ROWS', '2000'))
+BULK_ONBOARD_INVITE_WORKERS = int(os.getenv('BULK_ONBOARD_INVITE_WORKERS', '8'))
+BULK_ONBOARD_INSERT_CHUNK = int(os.getenv('BULK_ONBOARD_INSERT_CHUNK', '200'))
+# Batches larger than this run as a background job with progress polling
+BULK_ONBOARD_SYNC_MAX_ROWS = int(os.getenv('BULK_ONBOARD_SYNC_MAX_ROWS', '25'))
+BULK_ONBOARD_LOOKUP_PAGE_SIZE = int(os.getenv('BULK_ONBOARD_LOOKUP_PAGE_SIZE', '1000'))
+
+REQUIRED_FIELDS = ('name', 'email', 'role')
+
+
+def parse_csv_rows(text):
+    """Rows of a CSV upload with a header line naming (at least) name, email and role."""
+    reader = csv.DictReader(io.StringIO(text.lstrip('﻿')))
+    return [{(key or '').strip().lower(): (value or '').strip() for key, value in row.items()}
+            for row in reader]
+
+
+def validate_rows(rows):
+    """
+    Split raw rows into valid members and per-row results for rejected ones.
+    Returns (members, results); each member is (index, name, email, role)
+    with `email` normalized to lower case.
+    """
+    members = []
+    results = []
+    seen = set()
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            results.append({"index": index, "status": "invalid", "error": "Row must be an object"})
+            continue
+        values = {field: str(row.get(field) or '').strip() for field in REQUIRED_FIELDS}
+        if not all(values.values()):
+            results.append({"index": index, "email": values['email'] or None, "status": "invalid",
+                            "error": "Missing required fields (name, email, role)"})
+            continue
+        email = normalize_email(values['email'])
+        if '@' not in email:
+            results.append({"index": index, "email": values['email'], "status": "invalid", "error": "Invalid email"})
+            continue
+        if email in seen:
+            results.append({"index": index, "email": email, "status": "duplicate",
+                            "error": "Email appears earlier in this batch"})
+            continue
+        seen.add(email)
+        members.append((index, values['name'], email, values['role']))
+    return members, results
+
+
+class BulkOnboarding:
+    """
+    Onboard many crew members into one organization:
+    1. one set-based query of the organization's crew emails for duplicates
+    2. auth duplicate check + invitation per member on a bounded thread pool
+    3. crew_members rows written with bulk inserts; when a chunk fails, the auth
+       users invited for it are deleted again so no orphans are left behind
+    """
+
+    def __init__(self, client, organization_id, redirect_to, workers=BULK_ONBOARD_INVITE_WORKERS,
+                 insert_chunk=BULK_ONBOARD_INSERT_CHUNK):
+        self.client = client
+        self.organization_id = organization_id
+        self.redirect_to = redirect_to
+        self.workers = workers
+        self.insert_chunk = insert_chunk
+
+    def existing_emails(self, emails):
+        """
+        Which of `emails` (normalized) are already on this organization's crew
+        list. One paged query over the crew's emails, compared case-insensitively
+        since crew_members stores addresses as they were entered.
+        """
+        wanted = set(emails)
+        rows = fetch_pages(lambda: (self.client.table('crew_members')
+                                    .select('email')
+                                    .eq('organization_id', self.organization_id)
+                                    .order('id')),
+                           page_size=BULK_ONBOARD_LOOKUP_PAGE_SIZE)
+        return {email for email in (normalize_email(row.get('email')) for row in rows) if email in wanted}
+
+    def _invite(self, member):
+        index, name, email, role = member
+        try:
+            if auth_directory.find(self.client, email):
+                return {"index": index, "email": email, "status": "exists",
+                        "error": f"User with email {email} already exists in the authentication system"}
+            response = self.client.auth.admin.invite_user_by_email(
+                email,
+                options={
+                    'data': {'role': role, 'organization_id': self.organization_id, 'name': name},
+                    'redirect_to': self.redirect_to,
+                }
+            )
+            if response is None or not response.user:
+                raise Exception("Failed to invite user: no user returned")
+            auth_directory.add(email, response.user.id)
+            return {"index": index, "email": email, "status": "invited", "user_id": str(response.user.id),
+                    "row": {'name': name, 'email': email, 'role': role,
+                            'organization_id': self.organization_id, 'user_id': str(response.user.id)}}
+        except Exception as e:
+            return {"index": index, "email": email, "status": "failed", "error": str(e)}
+
+    def _delete_auth_user(self, user_id):
+        try:
+            self.client.auth.admin.delete_user(user_id)
+            auth_directory.remove_user(user_id)
+            return None
+        except Exception as e:
+            return str(e)
+
+    def _insert_chunk(self, pool, invited):
+        """Bulk insert one chunk of crew_members rows, rolling back its invitations on failure."""
+        try:
+            response = self.client.table('crew_members').insert([result.pop('row') for result in invited]).execute()
+            inserted = {normalize_email(row['email']): row for row in response.data or []}
+            if len(inserted) != len(invited):
+                raise Exception("crew_members insert returned fewer rows than were sent")
+        except Exception as e:
+            log.error("Bulk onboarding insert of %s crew members failed, rolling back invitations: %s", len(invited), e)
+            user_ids = [result['user_id'] for result in invited]
+            try:
+                # In case the insert went through but its response was lost
+                self.client.table('crew_members').delete(returning='minimal').in_('user_id', user_ids).execute()
+            except Exception as cleanup_error:
+                log.error("Error removing crew_members rows of a failed bulk insert: %s", cleanup_error)
+            errors = list(pool.map(self._delete_auth_user, user_ids))
+            for result, rollback_error in zip(invited, errors):
+                result['status'] = 'failed'
+                result['error'] = f"Failed to insert crew member record: {e}"
+                if rollback_error:
+                    result['rollback_error'] = rollback_error
+                    log.critical("Could not delete auth user %s after failed insert: %s", result['user_id'], rollback_error)
+                else:
+                    del result['user_id']
+            return
+
+        for result in invited:
+            row = inserted[result['email']]
+            result['status'] = 'created'
+            result['crew_member_id'] = row['id']
+            position_index.set_member_org(row['id'], self.organization_id)
+            change_feed.member_upserted(self.organization_id, row)
+
+    def run(self, members, job=None):
+        """Onboard validated members; returns per-row results."""
+        results = []
+        existing = self.existing_emails(member[2] for member in members)
+        pending = []
+        for member in members:
+            if member[2] in existing:
+                results.append({"index": member[0], "email": member[2], "status": "exists",
+                                "error": f"Email {member[2]} already exists in this organization's crew list"})
+                if job is not None:
+                    job.advance()
+            else:
+                pending.append(member)
+
+        with ThreadPoolExecutor(max_workers=max(1, self.workers), thread_name_prefix='crew-invite') as pool:
+            invited = []
+            for result in pool.map(self._invite, pending):
+                if result['status'] == 'invited':
+                    invited.append(result)
+                    if len(invited) >= self.insert_chunk:
+                        self._insert_chunk(pool, invited)
+                        results.extend(invited)
+                        if job is not None:
+                            job.advance(len(invited))
+                        invited = []
+                else:
+                    results.append(result)
+                    if job is not None:
+                        job.advance()
+            if invited:
+                self._insert_chunk(pool, invited)
+                results.extend(invited)
+                if job is not None:
+                    job.advance(len(invited))
+        return sorted(results, key=lambda result: result['index'])
+
+
+def summarize(results):
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    return counts
@@ -0,0 +1,329 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from services.location_ingest import format_timestamp, parse_timestamp
+from services.logs import get_logger
+from services.supabase_clients import fetch_pages
+
+log = get_logger('positions')
+
+# Latest-position index configuration
+POSITION_INDEX_WARM_WINDOW_HOURS = float(os.getenv('POSITION_INDEX_WARM_WINDOW_HOURS', '24'))
+POSITION_INDEX_WARM_MAX_ROWS = int(os.getenv('POSITION_INDEX_WARM_MAX_ROWS', '200000'))
+POSITION_INDEX_PAGE_SIZE = int(os.getenv('POSITION_INDEX_PAGE_SIZE', '1000'))
+LAST_ACTIVE_WRITE_INTERVAL = float(os.getenv('LAST_ACTIVE_WRITE_INTERVAL', '60'))
+# Organization lookups and last_active_at writes for ingested fixes run at most this often
+POSITION_SYNC_INTERVAL = float(os.getenv('POSITION_SYNC_INTERVAL', '1.0'))
+
+
+class PositionRecord:
+    """Last known position of one crew member (epoch-second timestamps)."""
+    __slots__ = ('latitude', 'longitude', 'timestamp', 'last_active_at')
+
+    def __init__(self, latitude, longitude, timestamp, last_active_at=None):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.timestamp = timestamp
+        self.last_active_at = last_active_at
+
+    def to_dict(self, crew_member_id):
+        return {
+            "crew_member_id": crew_member_id,
+            "latitude": self.latitude,
+            "longitude": self.longitude,
+            "timestamp": format_timestamp(self.timestamp) if self.timestamp is not None else None,
+            "last_active_at": format_timestamp(self.last_active_at) if self.last_active_at is not None else None,
+        }
+
+
+class LatestPositionIndex:
+    """
+    In-memory last-known-position index, fed by the location ingest path.
+    Serves current-location lookups per member and per organization without
+    touching crew_locations, and coalesces crew_members.last_active_at writes
+    to at most one per member per `last_active_interval` seconds.
+    """
+
+    def __init__(self, last_active_interval=LAST_ACTIVE_WRITE_INTERVAL):
+        self.last_active_interval = last_active_interval
+        self._positions = {}        # crew_member_id -> PositionRecord
+        self._org_by_member = {}    # crew_member_id -> organization_id
+        self._members_by_org = {}   # organization_id -> set(crew_member_id)
+        self._last_active_written = {}  # crew_member_id -> epoch of last DB write
+        self._last_active_pending = set()
+        self._unresolved = set()    # members seen on ingest with no known organization
+        self._lock = threading.Lock()
+        self._warm_lock = threading.Lock()
+        self._warm_pid = None
+        self._warm_done = threading.Event()
+        self.warmed = False
+        self.hits = 0
+        self.misses = 0
+        self.last_active_writes = 0
+
+    # --- Membership ---
+
+    def set_member_org(self, crew_member_id, organization_id, last_active_at=None):
+        crew_member_id = str(crew_member_id)
+        organization_id = str(organization_id) if organization_id else None
+        with self._lock:
+            previous = self._org_by_member.get(crew_member_id)
+            if previous and previous != organization_id:
+                self._members_by_org.get(previous, set()).discard(crew_member_id)
+            self._org_by_member[crew_member_id] = organization_id
+            self._unresolved.discard(crew_member_id)
+            if organization_id:
+                self._members_by_org.setdefault(organization_id, set()).add(crew_member_id)
+            if last_active_at is not None:
+                record = self._positions.get(crew_member_id)
+                if record is None:
+                    self._positions[crew_member_id] = PositionRecord(None, None, None, last_active_at)
+                elif record.last_active_at is None or record.last_active_at < last_active_at:
+                    record.last_active_at = last_active_at
+
+    def remove_member(self, crew_member_id):
+        crew_member_id = str(crew_member_id)
+        with self._lock:
+            organization_id = self._org_by_member.pop(crew_member_id, None)
+            if organization_id:
+                self._members_by_org.get(organization_id, set()).discard(crew_member_id)
+            self._positions.pop(crew_member_id, None)
+            self._last_active_written.pop(crew_member_id, None)
+            self._last_active_pending.discard(crew_member_id)
+
+    def organization_of(self, crew_member_id):
+        return self._org_by_member.get(str(crew_member_id))
+
+    def take_unresolved(self):
+        """Members seen on ingest whose organization still has to be looked up."""
+        with self._lock:
+            unresolved = list(self._unresolved)
+            self._unresolved.clear()
+        return unresolved
+
+    # --- Ingest ---
+
+    def record(self, crew_member_id, latitude, longitude, timestamp, now=None):
+        """Store a fix if it is newer than what we have. Returns True when the position changed."""
+        now = time.time() if now is None else now
+        with self._lock:
+            record = self._positions.get(crew_member_id)
+            if record is None:
+                self._positions[crew_member_id] = PositionRecord(latitude, longitude, timestamp, now)
+                changed = True
+            else:
+                record.last_active_at = now
+                changed = record.timestamp is None or timestamp >= record.timestamp
+                if changed:
+                    record.latitude = latitude
+                    record.longitude = longitude
+                    record.timestamp = timestamp
+            self._last_active_pending.add(crew_member_id)
+            if crew_member_id not in self._org_by_member:
+                self._unresolved.add(crew_member_id)
+        return changed
+
+    def seed(self, crew_member_id, latitude, longitude, timestamp):
+        """Store a position read back from the database (not activity, so last_active_at is untouched)."""
+        with self._lock:
+            record = self._positions.get(crew_member_id)
+            if record is None:
+                self._positions[crew_member_id] = PositionRecord(latitude, longitude, timestamp)
+            elif record.timestamp is None or record.timestamp < timestamp:
+                record.latitude = latitude
+                record.longitude = longitude
+                record.timestamp = timestamp
+
+    def record_rows(self, rows):
+        """Feed crew_locations rows to the index; returns the member ids whose position changed."""
+        now = time.time()
+        changed = []
+        for row in rows:
+            if self.record(row['crew_member_id'], float(row['latitude']), float(row['longitude']),
+                           parse_timestamp(row.get('timestamp')), now):
+                changed.append(row['crew_member_id'])
+        return changed
+
+    def take_due_last_active(self, now=None):
+        """
+        Members whose last_active_at should be written now: active since the last
+        write and not written within the coalescing interval.
+        """
+        now = time.time() if now is None else now
+        due = []
+        with self._lock:
+            for crew_member_id in list(self._last_active_pending):
+                if now - self._last_active_written.get(crew_member_id, 0.0) >= self.last_active_interval:
+                    due.append(crew_member_id)
+                    self._last_active_written[crew_member_id] = now
+                    self._last_active_pending.discard(crew_member_id)
+            self.last_active_writes += len(due)
+        return due
+
+    # --- Lookups ---
+
+    def get(self, crew_member_id):
+        with self._lock:
+            record = self._positions.get(crew_member_id)
+            if record is None or record.timestamp is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return record.to_dict(crew_member_id)
+
+    def for_org(self, organization_id):
+        """Latest positions for every known member of an organization."""
+        with self._lock:
+            members = self._members_by_org.get(str(organization_id), ())
+            return [self._positions[member_id].to_dict(member_id)
+                    for member_id in members
+                    if member_id in self._positions and self._positions[member_id].timestamp is not None]
+
+    def compact_rows(self, crew_member_ids):
+        """
+        [crew_member_id, latitude, longitude, timestamp, last_active_at] rows with
+        epoch-second times, for payloads where key names would dominate the size.
+        """
+        rows = []
+        with self._lock:
+            for crew_member_id in crew_member_ids:
+                record = self._positions.get(crew_member_id)
+                if record is None or record.timestamp is None:
+                    continue
+                rows.append([
+                    crew_member_id,
+                    round(record.latitude, 6),
+                    round(record.longitude, 6),
+                    round(record.timestamp, 3),
+                    round(record.last_active_at, 3) if record.last_active_at is not None else None,
+                ])
+        return rows
+
+    def members_of(self, organization_id):
+        with self._lock:
+            return list(self._members_by_org.get(str(organization_id), ()))
+
+    # --- Warm-up ---
+
+    def warm(self, client):
+        """Load org membership and the latest recent position of each member from the database."""
+        member_count = 0
+        for member in fetch_pages(
+                lambda: client.table('crew_members').select('id, organization_id, last_active_at').order('id'),
+                POSITION_INDEX_PAGE_SIZE, POSITION_INDEX_WARM_MAX_ROWS):
+            last_active_at = parse_timestamp(member['last_active_at']) if member.get('last_active_at') else None
+            self.set_member_org(member['id'], member.get('organization_id'), last_active_at)
+            member_count += 1
+
+        # Newest first: the first row seen per member is its latest position
+        since = datetime.now(timezone.utc) - timedelta(hours=POSITION_INDEX_WARM_WINDOW_HOURS)
+        seen = set()
+        for row in fetch_pages(
+                lambda: (client.table('crew_locations')
+                         .select('crew_member_id, latitude, longitude, timestamp')
+                         .gte('timestamp', since.isoformat())
+                         .order('timestamp', desc=True)),
+                POSITION_INDEX_PAGE_SIZE, POSITION_INDEX_WARM_MAX_ROWS):
+            crew_member_id = row.get('crew_member_id')
+            if not crew_member_id or crew_member_id in seen:
+                continue
+            seen.add(crew_member_id)
+            self.seed(crew_member_id, float(row['latitude']), float(row['longitude']),
+                      parse_timestamp(row['timestamp']))
+        self.warmed = True
+        log.info("Position index warmed: %s members, %s positions", member_count, len(seen))
+
+    def ensure_warm(self, client_factory):
+        """Warm the index once per process in a background thread."""
+        if self._warm_pid == os.getpid():
+            return
+        with self._warm_lock:
+            if self._warm_pid == os.getpid():
+                return
+            self._warm_pid = os.getpid()
+            self._warm_done = threading.Event()
+
+        def _run():
+            try:
+                client = client_factory()
+                if client is not None:
+                    self.warm(client)
+            except Exception as e:
+                log.error("Error warming position index: %s", e)
+            finally:
+                self._warm_done.set()
+
+        threading.Thread(target=_run, name='position-index-warm', daemon=True).start()
+
+    def wait_warm(self, timeout):
+        """Block until the startup warm-up finished (or failed), up to `timeout` seconds."""
+        return self._warm_done.wait(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "warmed": self.warmed,
+                "members": len(self._org_by_member),
+                "positions": sum(1 for record in self._positions.values() if record.timestamp is not None),
+                "organizations": len(self._members_by_org),
+                "hits": self.hits,
+                "misses": self.misses,
+                "last_active_pending": len(self._last_active_pending),
+                "last_active_writes": self.last_active_writes,
+            }
+
+
+class PositionIndexSync:
+    """
+    Runs `sync()` (the database round trips that follow ingest: organization
+    lookups and last_active_at writes) on a background thread after request(),
+    at most once per `interval` seconds, so single-fix requests do not wait on it.
+    """
+
+    def __init__(self, sync, interval=POSITION_SYNC_INTERVAL):
+        self.sync = sync
+        self.interval = interval
+        self.runs = 0
+        self._after_fork()
+
+    def _after_fork(self):
+        self._cond = threading.Condition()
+        self._pending = False
+        self._thread = None
+        self._pid = None
+
+    def request(self):
+        with self._cond:
+            self._pending = True
+            # Started lazily so each (forked) worker gets its own
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='position-index-sync', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                self._pending = False
+            try:
+                self.sync()
+            except Exception as e:
+                log.error("Error syncing position index: %s", e)
+            self.runs += 1
+            time.sleep(self.interval)
+
+
+def create_position_sync(sync, **kwargs):
+    sync_runner = PositionIndexSync(sync, **kwargs)
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=sync_runner._after_fork)
+    return sync_runner
+
+
+# Process-wide index shared by the ingest and read routes
+position_index = LatestPositionIndex()
@@ -0,0 +1,292 @@
+import contextvars
+import cProfile
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+
+from services.logs import get_logger
+
+log = get_logger('profiling')
+
+# Opt-in request profiler; everything below is inert unless this is set
+PROFILE_ENABLED = os.getenv('PROFILE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+# Fraction of requests profiled
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+# Requests carrying `<PROFILE_HEADER>: <PROFILE_TOKEN>` are always profiled (unset token = header ignored)
+PROFILE_HEADER = os.getenv('PROFILE_HEADER', 'X-Profile')
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')
+# "cprofile" (deterministic, .pstats) or "sample" (stack sampling, collapsed stacks)
+PROFILE_MODE = os.getenv('PROFILE_MODE', 'sample').lower()
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', '5'))
+# Requests at least this slow are captured: with their profile when profiled, metadata only otherwise
+PROFILE_SLOW_MS = float(os.getenv('PROFILE_SLOW_MS', '500'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'crewtrack-profiles'))
+PROFILE_MAX_CAPTURES = int(os.getenv('PROFILE_MAX_CAPTURES', '200'))
+# Upstream calls listed individually per capture (all are counted in the totals)
+PROFILE_MAX_UPSTREAM_CALLS = int(os.getenv('PROFILE_MAX_UPSTREAM_CALLS', '200'))
+
+CAPTURE_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+PROFILE_EXTENSIONS = {'cprofile': '.pstats', 'sample': '.collapsed'}
+
+# Upstream calls of the current request, or None when the request is not tracked
+_upstream_calls = contextvars.ContextVar('upstream_calls', default=None)
+
+
+def note_upstream(service, operation, target, status, seconds):
+    """Called by the Supabase transport for every call; a no-op outside tracked requests."""
+    calls = _upstream_calls.get()
+    if calls is not None:
+        calls.append((service, operation, target, status, seconds))
+
+
+class StackSampler:
+    """
+    Low-overhead sampling profiler: one daemon thread reads the stacks of the
+    registered request threads every `interval` seconds and counts them as
+    collapsed stacks (root;...;leaf), the input format of flamegraph tools.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._after_fork()
+
+    def _after_fork(self):
+        # The sampler thread does not survive fork(); the child starts its own lazily
+        self._targets = {}  # thread id -> Counter of collapsed stacks
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._running = False
+
+    def start(self, thread_id):
+        with self._wakeup:
+            if not self._running:
+                self._running = True
+                threading.Thread(target=self._run, name='stack-sampler', daemon=True).start()
+            self._targets[thread_id] = Counter()
+            self._wakeup.notify()
+
+    def stop(self, thread_id):
+        with self._lock:
+            return self._targets.pop(thread_id, Counter())
+
+    @staticmethod
+    def _collapse(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def _run(self):
+        while True:
+            with self._wakeup:
+                while not self._targets:
+                    self._wakeup.wait()
+                thread_ids = list(self._targets)
+            frames = sys._current_frames()
+            stacks = [(thread_id, self._collapse(frames[thread_id])) for thread_id in thread_ids if thread_id in frames]
+            with self._lock:
+                for thread_id, stack in stacks:
+                    counter = self._targets.get(thread_id)
+                    if counter is not None:
+                        counter[stack] += 1
+            time.sleep(self.interval)
+
+
+class RequestProfiler:
+    """
+    Per-request profiling driven by the Flask request hooks. begin() decides
+    whether a request is tracked and/or profiled; end() writes a capture
+    (JSON metadata + pstats/collapsed stacks) for requests at least `slow_ms`
+    slow. Captures live in `directory`, shared by all worker processes.
+    """
+
+    def __init__(self, enabled=PROFILE_ENABLED, sample_rate=PROFILE_SAMPLE_RATE, header=PROFILE_HEADER,
+                 token=PROFILE_TOKEN, mode=PROFILE_MODE, slow_ms=PROFILE_SLOW_MS, directory=PROFILE_DIR,
+                 max_captures=PROFILE_MAX_CAPTURES, sample_interval_ms=PROFILE_SAMPLE_INTERVAL_MS):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.header = header
+        self.token = token
+        self.mode = mode if mode in PROFILE_EXTENSIONS else 'sample'
+        self.slow_ms = slow_ms
+        self.directory = directory
+        self.max_captures = max_captures
+        self.sampler = StackSampler(sample_interval_ms / 1000.0)
+        self._lock = threading.Lock()
+        self.profiled = 0
+        self.captured = 0
+        self.capture_failures = 0
+
+    def _wants_profile(self, headers):
+        if self.token and headers.get(self.header) == self.token:
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def begin(self, headers):
+        """Start tracking the current request; returns state for end(), or None when off."""
+        if not self.enabled:
+            return None
+        state = {"calls_token": _upstream_calls.set([]), "profiler": None, "thread_id": None}
+        if self._wants_profile(headers):
+            if self.mode == 'cprofile':
+                profiler = cProfile.Profile()
+                try:
+                    profiler.enable()
+                    state["profiler"] = profiler
+                except ValueError:
+                    # Another profiler is already active on this thread
+                    pass
+            else:
+                state["thread_id"] = threading.get_ident()
+                self.sampler.start(state["thread_id"])
+        return state
+
+    def end(self, state, info):
+        """
+        Stop tracking. `info` carries method, path, route, status, organization_id
+        and duration_ms of the request.
+        """
+        if state is None:
+            return
+        calls = _upstream_calls.get() or []
+        try:
+            _upstream_calls.reset(state["calls_token"])
+        except ValueError:
+            # Ended from a different context than it began in
+            _upstream_calls.set(None)
+        profile = None
+        if state["profiler"] is not None:
+            state["profiler"].disable()
+            profile = state["profiler"]
+        elif state["thread_id"] is not None:
+            profile = self.sampler.stop(state["thread_id"])
+        if profile is not None:
+            with self._lock:
+                self.profiled += 1
+        if info["duration_ms"] < self.slow_ms:
+            return
+        threading.Thread(target=self._write_capture, args=(info, calls, profile),
+                         name='profile-capture', daemon=True).start()
+
+    def _write_capture(self, info, calls, profile):
+        capture_id = uuid.uuid4().hex
+        totals = {}
+        for service, operation, target, status, seconds in calls:
+            key = f'{service} {operation} {target}'.strip()
+            total = totals.setdefault(key, {"calls": 0, "ms": 0.0})
+            total["calls"] += 1
+            total["ms"] = round(total["ms"] + seconds * 1000, 3)
+        metadata = dict(info, id=capture_id, captured_at=time.time(), pid=os.getpid(), profile=None, upstream={
+            "calls": len(calls),
+            "ms": round(sum(call[4] for call in calls) * 1000, 3),
+            "by_operation": totals,
+            "timeline": [{"service": service, "operation": operation, "target": target, "status": status,
+                          "ms": round(seconds * 1000, 3)}
+                         for service, operation, target, status, seconds in calls[:PROFILE_MAX_UPSTREAM_CALLS]],
+        })
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            if isinstance(profile, cProfile.Profile):
+                profile.dump_stats(os.path.join(self.directory, capture_id + '.pstats'))
+                metadata["profile"] = 'pstats'
+            elif profile:
+                with open(os.path.join(self.directory, capture_id + '.collapsed'), 'w') as f:
+                    f.writelines(f'{stack} {count}\n' for stack, count in profile.most_common())
+                metadata["profile"] = 'collapsed'
+            # Metadata last: a capture is listed only once it is complete
+            path = os.path.join(self.directory, capture_id + '.json')
+            with open(path + '.tmp', 'w') as f:
+                json.dump(metadata, f, default=str)
+            os.replace(path + '.tmp', path)
+            with self._lock:
+                self.captured += 1
+            log.info("Slow request captured", extra={"capture_id": capture_id, "route": info.get("route"),
+                                                     "duration_ms": info.get("duration_ms")})
+            self._prune()
+        except Exception as e:
+            with self._lock:
+                self.capture_failures += 1
+            log.error("Error writing profile capture %s: %s", capture_id, e)
+
+    def _prune(self):
+        captures = sorted(self._metadata_paths(), key=os.path.getmtime, reverse=True)
+        for path in captures[self.max_captures:]:
+            capture_id = os.path.basename(path)[:-len('.json')]
+            for suffix in ('.json', '.pstats', '.collapsed'):
+                try:
+                    os.remove(os.path.join(self.directory, capture_id + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def _metadata_paths(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return [os.path.join(self.directory, name) for name in names
+                if name.endswith('.json') and CAPTURE_ID_RE.match(name[:-len('.json')])]
+
+    def list_captures(self, organization_id=None, limit=100):
+        """
+        Capture metadata newest first, without upstream timelines. With an
+        organization id, only that organization's and org-less captures.
+        """
+        captures = []
+        for path in self._metadata_paths():
+            try:
+                with open(path) as f:
+                    metadata = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if organization_id and metadata.get('organization_id') not in (None, str(organization_id)):
+                continue
+            metadata["upstream"] = {key: value for key, value in metadata.get("upstream", {}).items()
+                                    if key != 'timeline'}
+            captures.append(metadata)
+        captures.sort(key=lambda metadata: metadata.get('captured_at', 0), reverse=True)
+        return captures[:limit]
+
+    def get_capture(self, capture_id):
+        if not CAPTURE_ID_RE.match(capture_id or ''):
+            return None
+        try:
+            with open(os.path.join(self.directory, capture_id + '.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def profile_path(self, metadata):
+        """Path of the pstats/collapsed file of a capture, or None for metadata-only captures."""
+        extension = {'pstats': '.pstats', 'collapsed': '.collapsed'}.get(metadata.get('profile'))
+        if extension is None:
+            return None
+        path = os.path.join(self.directory, metadata['id'] + extension)
+        return path if os.path.exists(path) else None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "mode": self.mode,
+                "sample_rate": self.sample_rate,
+                "header_trigger": bool(self.token),
+                "slow_ms": self.slow_ms,
+                "profiled": self.profiled,
+                "captured": self.captured,
+                "capture_failures": self.capture_failures,
+            }
+
+
+# Process-wide profiler used by the app's request hooks
+request_profiler = RequestProfiler()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=request_profiler.sampler._after_fork)
@@ -0,0 +1,245 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from services.logs import get_logger
+
+log = get_logger('response_cache')
+
+# Read-through cache for per-organization GET responses (rosters, site lists)
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Upper bound on staleness for writes that bypass the backend (e.g. the Supabase dashboard)
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv('RESPONSE_CACHE_TTL_SECONDS', '30'))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '2048'))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+# Shared cache for all workers (needs `pip install redis`); unset = per-process memory
+RESPONSE_CACHE_REDIS_URL = os.getenv('RESPONSE_CACHE_REDIS_URL', '')
+RESPONSE_CACHE_PREFIX = os.getenv('RESPONSE_CACHE_PREFIX', 'crewtrack:cache')
+
+
+class MemoryCacheBackend:
+    """Per-process LRU + TTL store of bytes, bounded by entry count and total size."""
+
+    name = 'memory'
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES, max_bytes=RESPONSE_CACHE_MAX_BYTES,
+                 prefix=RESPONSE_CACHE_PREFIX):
+        self.prefix = prefix
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._after_fork()
+
+    def _after_fork(self):
+        self._entries = OrderedDict()  # key -> (value, expires_at)
+        self._generations = {}  # organization id -> int
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if now >= entry[1]:
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, ttl):
+        size = len(key) + len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        value, _ = self._entries.pop(key)
+        self._bytes -= len(key) + len(value)
+
+    def generation(self, organization_id):
+        with self._lock:
+            return self._generations.get(organization_id, 0)
+
+    def bump_generation(self, organization_id):
+        with self._lock:
+            self._generations[organization_id] = self._generations.get(organization_id, 0) + 1
+            # Entries of older generations are unreachable now; free them right away
+            stale = f'{self.prefix}:{organization_id}:'
+            for key in [key for key in self._entries if key.startswith(stale)]:
+                self._drop(key)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "max_entries": self.max_entries,
+                    "max_bytes": self.max_bytes, "evictions": self.evictions}
+
+
+class RedisCacheBackend:
+    """
+    Store shared by every worker in a Redis-compatible server. Eviction is the
+    server's (set maxmemory and an allkeys-lru policy); entries expire by TTL.
+    """
+
+    name = 'redis'
+
+    def __init__(self, url, prefix=RESPONSE_CACHE_PREFIX):
+        import redis  # optional dependency, only needed for a shared cache
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    def get(self, key):
+        return self._client.get(key)
+
+    def set(self, key, value, ttl):
+        self._client.set(key, value, px=max(1, int(ttl * 1000)))
+
+    def generation(self, organization_id):
+        return int(self._client.get(f'{self.prefix}:generation:{organization_id}') or 0)
+
+    def bump_generation(self, organization_id):
+        self._client.incr(f'{self.prefix}:generation:{organization_id}')
+
+    def stats(self):
+        return {}
+
+
+class ResponseCache:
+    """
+    Read-through cache of serialized responses keyed by organization. Each
+    organization has a generation number that is part of every key, so
+    invalidate() drops all of an organization's entries at once (and, with the
+    Redis backend, for every worker). Backend errors count as misses.
+    """
+
+    def __init__(self, backend, enabled=RESPONSE_CACHE_ENABLED, ttl_seconds=RESPONSE_CACHE_TTL_SECONDS,
+                 prefix=RESPONSE_CACHE_PREFIX):
+        self.backend = backend
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self._after_fork()
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._loading = {}  # key -> Event set when the first loader finishes
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+        self.errors = 0
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _key(self, organization_id, name, params):
+        generation = self.backend.generation(str(organization_id))
+        query = '&'.join(f'{key}={value}' for key, value in sorted(params.items()))
+        return f'{self.prefix}:{organization_id}:{generation}:{name}?{query}'
+
+    def get_or_load(self, organization_id, name, params, loader):
+        """
+        The cached bytes for (organization, name, params), or loader()'s bytes
+        after storing them. Returns (value, hit). Concurrent misses on the same
+        key in this process wait for a single load.
+        """
+        if not self.enabled:
+            return loader(), False
+        try:
+            key = self._key(organization_id, name, params)
+            value = self.backend.get(key)
+        except Exception as e:
+            self._count('errors')
+            log.warning("Response cache read failed: %s", e)
+            return loader(), False
+        if value is not None:
+            self._count('hits')
+            return value, True
+
+        with self._lock:
+            self.misses += 1
+            loading = self._loading.get(key)
+            if loading is None:
+                loading = self._loading[key] = threading.Event()
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+        if not leader:
+            loading.wait(self.ttl_seconds)
+            try:
+                value = self.backend.get(key)
+            except Exception:
+                value = None
+            return (value, True) if value is not None else (loader(), False)
+        try:
+            value = loader()
+            try:
+                self.backend.set(key, value, self.ttl_seconds)
+            except Exception as e:
+                self._count('errors')
+                log.warning("Response cache write failed: %s", e)
+            return value, False
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+            loading.set()
+
+    def invalidate(self, organization_id):
+        """Forget every cached response of an organization (call after writing its data)."""
+        if not self.enabled or not organization_id:
+            return
+        self._count('invalidations')
+        try:
+            self.backend.bump_generation(str(organization_id))
+        except Exception as e:
+            self._count('errors')
+            log.error("Response cache invalidation of org %s failed: %s", organization_id, e)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "enabled": self.enabled,
+                "backend": self.backend.name,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "coalesced": self.coalesced,
+                "invalidations": self.invalidations,
+                "errors": self.errors,
+            }
+        stats.update(self.backend.stats())
+        return stats
+
+
+def create_response_cache():
+    """The process-wide cache: Redis-backed when RESPONSE_CACHE_REDIS_URL is set, in memory otherwise."""
+    backend = None
+    if RESPONSE_CACHE_REDIS_URL:
+        try:
+            backend = RedisCacheBackend(RESPONSE_CACHE_REDIS_URL)
+        except ImportError:
+            log.warning("redis is not installed, falling back to the per-process response cache")
+    if backend is None:
+        backend = MemoryCacheBackend()
+    cache = ResponseCache(backend)
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=cache._after_fork)
+        if isinstance(backend, MemoryCacheBackend):
+            os.register_at_fork(after_in_child=backend._after_fork)
+    return cache
+
+
+response_cache = create_response_cache()
@@ -0,0 +1,317 @@
+import functools
+import os
+import threading
+import time
+
+import numpy as np
+
+from services.geo import haversine_m, haversine_matrix
+
+# Route optimization (/api/crew/<id>/route) configuration
+# Sites per organization kept in the cached distance matrix (float32, so 4 * N^2 bytes)
+ROUTE_MATRIX_MAX_SITES = int(os.getenv('ROUTE_MATRIX_MAX_SITES', '2000'))
+ROUTE_MAX_STOPS = int(os.getenv('ROUTE_MAX_STOPS', '500'))
+# Local search stops improving a route after this long and returns the best so far
+ROUTE_TIME_BUDGET_MS = float(os.getenv('ROUTE_TIME_BUDGET_MS', '50'))
+# Longest run of consecutive stops Or-opt moves as a block
+ROUTE_OR_OPT_MAX_SEGMENT = int(os.getenv('ROUTE_OR_OPT_MAX_SEGMENT', '3'))
+
+# Improvements smaller than this (metres) are float32 rounding, not moves worth making
+EPSILON_M = 0.5
+
+
+class OrgMatrix:
+    """Pairwise site distances of one organization in a buffer that grows by doubling."""
+
+    def __init__(self, capacity=64):
+        self.ids = []
+        self.position = {}  # location_id -> row/column in the matrix
+        self.lats = np.empty(capacity, dtype=np.float64)
+        self.lons = np.empty(capacity, dtype=np.float64)
+        self.matrix = np.zeros((capacity, capacity), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _reserve(self, size):
+        capacity = len(self.lats)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        n = len(self.ids)
+        lats, lons = np.empty(capacity), np.empty(capacity)
+        lats[:n], lons[:n] = self.lats[:n], self.lons[:n]
+        matrix = np.zeros((capacity, capacity), dtype=np.float32)
+        matrix[:n, :n] = self.matrix[:n, :n]
+        self.lats, self.lons, self.matrix = lats, lons, matrix
+
+    def add(self, sites):
+        """Append (location_id, lat, lon) sites, computing only the new rows and columns."""
+        if not sites:
+            return
+        start = len(self.ids)
+        end = start + len(sites)
+        self._reserve(end)
+        for offset, (location_id, lat, lon) in enumerate(sites):
+            self.ids.append(location_id)
+            self.position[location_id] = start + offset
+            self.lats[start + offset], self.lons[start + offset] = lat, lon
+        block = haversine_matrix(self.lats[start:end], self.lons[start:end], self.lats[:end], self.lons[:end])
+        self.matrix[start:end, :end] = block
+        self.matrix[:end, start:end] = block.T
+
+    def move(self, location_id, lat, lon):
+        """Recompute one site's row and column after its coordinates changed."""
+        i = self.position[location_id]
+        n = len(self.ids)
+        self.lats[i], self.lons[i] = lat, lon
+        row = haversine_m(lat, lon, self.lats[:n], self.lons[:n])
+        self.matrix[i, :n] = row
+        self.matrix[:n, i] = row
+
+    def sync(self, sites):
+        """Add unknown sites and refresh moved ones. Returns (added, moved) counts."""
+        new, moved, seen = [], 0, set()
+        for location_id, lat, lon in sites:
+            i = self.position.get(location_id)
+            if i is None:
+                if location_id not in seen:
+                    seen.add(location_id)
+                    new.append((location_id, lat, lon))
+            elif self.lats[i] != lat or self.lons[i] != lon:
+                self.move(location_id, lat, lon)
+                moved += 1
+        self.add(new)
+        return len(new), moved
+
+    def submatrix(self, location_ids):
+        indices = np.array([self.position[location_id] for location_id in location_ids], dtype=np.int64)
+        return self.matrix.take(indices, 0).take(indices, 1)
+
+    @property
+    def nbytes(self):
+        return self.matrix.nbytes + self.lats.nbytes + self.lons.nbytes
+
+
+class DistanceMatrixCache:
+    """
+    Per-organization cache of pairwise site distances for route optimization.
+    A matrix covers the sites that have been routed (or upserted once the
+    organization is loaded) and grows incrementally: adding k sites to n costs
+    k * (n + k) distances rather than a rebuild. Past `max_sites` an
+    organization's matrix starts over with just the sites being routed.
+    """
+
+    def __init__(self, max_sites=ROUTE_MATRIX_MAX_SITES):
+        self.max_sites = max_sites
+        self._orgs = {}  # organization_id -> OrgMatrix
+        self._after_fork()
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.added = 0
+        self.moved = 0
+        self.resets = 0
+
+    def distances(self, organization_id, sites):
+        """Distance matrix (metres) between `sites`, a list of (location_id, lat, lon) tuples."""
+        organization_id = str(organization_id)
+        sites = [(str(location_id), float(lat), float(lon)) for location_id, lat, lon in sites]
+        with self._lock:
+            matrix = self._orgs.get(organization_id)
+            if matrix is None or len(matrix) + len(sites) > self.max_sites:
+                if matrix is not None:
+                    self.resets += 1
+                matrix = self._orgs[organization_id] = OrgMatrix()
+            added, moved = matrix.sync(sites)
+            if not added and not moved:
+                self.hits += 1
+            self.added += added
+            self.moved += moved
+            return matrix.submatrix([location_id for location_id, _, _ in sites])
+
+    def upsert(self, row):
+        """Apply an inserted/updated location to its organization's matrix, if one is cached."""
+        if row.get('latitude') is None or row.get('longitude') is None:
+            return
+        with self._lock:
+            matrix = self._orgs.get(str(row.get('organization_id')))
+            if matrix is None or len(matrix) >= self.max_sites:
+                return
+            added, moved = matrix.sync([(str(row['id']), float(row['latitude']), float(row['longitude']))])
+            self.added += added
+            self.moved += moved
+
+    def remove(self, location_id, organization_id=None):
+        """
+        Drop the matrix holding a deleted location; it is rebuilt from the sites
+        of the next route. Delete webhooks may only carry the id, so without an
+        organization every cached matrix is checked.
+        """
+        location_id = str(location_id)
+        with self._lock:
+            for cached_org in list(self._orgs):
+                if organization_id is not None and cached_org != str(organization_id):
+                    continue
+                if location_id in self._orgs[cached_org].position:
+                    del self._orgs[cached_org]
+                    self.resets += 1
+
+    def invalidate(self, organization_id=None):
+        with self._lock:
+            if organization_id is None:
+                self._orgs.clear()
+            else:
+                self._orgs.pop(str(organization_id), None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "organizations": len(self._orgs),
+                "sites": sum(len(matrix) for matrix in self._orgs.values()),
+                "bytes": sum(matrix.nbytes for matrix in self._orgs.values()),
+                "max_sites": self.max_sites,
+                "hits": self.hits,
+                "added": self.added,
+                "moved": self.moved,
+                "resets": self.resets,
+            }
+
+
+def nearest_neighbour(dist):
+    """Greedy tour over a (m, m) matrix starting and fixed at node 0."""
+    m = len(dist)
+    tour = np.empty(m, dtype=np.int64)
+    tour[0] = 0
+    visited = np.zeros(m, dtype=bool)
+    visited[0] = True
+    current = 0
+    for step in range(1, m):
+        row = np.where(visited, np.inf, dist[current])
+        current = int(np.argmin(row))
+        tour[step] = current
+        visited[current] = True
+    return tour
+
+
+def tour_length(dist, tour):
+    return float(dist[tour, np.roll(tour, -1)].sum(dtype=np.float64))
+
+
+def tour_matrix(dist, tour):
+    """
+    Distances in tour order, (m + 1, m + 1) with node 0 repeated at the end:
+    entry [i, j] is the distance from the i-th to the j-th stop of the tour,
+    so every move below is evaluated on slices of one gathered matrix.
+    """
+    closed = np.append(tour, tour[0])
+    return dist.take(closed, 0).take(closed, 1)
+
+
+@functools.lru_cache(maxsize=64)
+def two_opt_blocked(m):
+    """Pairs of edges (i, j) that are not a 2-opt move: j < i + 2, and the two edges around node 0."""
+    blocked = ~np.triu(np.ones((m, m), dtype=bool), 2)
+    blocked[0, m - 1] = True
+    return blocked
+
+
+@functools.lru_cache(maxsize=64)
+def or_opt_blocked(m, length):
+    """Insertion edges p inside or next to each segment starting at 1..m - length."""
+    starts = np.arange(1, m - length + 1)
+    positions = np.arange(m)
+    return (positions[None, :] >= (starts - 1)[:, None]) & (positions[None, :] <= (starts + length - 1)[:, None])
+
+
+def two_opt_move(ordered):
+    """Best 2-opt move (reverse tour[i+1..j]) as (delta, i, j), all pairs evaluated at once."""
+    m = len(ordered) - 1
+    edge = np.diagonal(ordered, 1)  # edge[i] = tour[i] -> tour[i + 1]
+    # Edge (a=tour[i], b=tour[i+1]) against edge (c=tour[j], d=tour[j+1]), i < j
+    delta = ordered[:m, :m] + ordered[1:, 1:]
+    delta -= edge[:, None]
+    delta -= edge[None, :]
+    delta[two_opt_blocked(m)] = np.inf
+    i, j = divmod(int(np.argmin(delta)), m)
+    return float(delta[i, j]), i, j
+
+
+def or_opt_move(ordered, max_segment):
+    """
+    Best Or-opt move: relocate a run of 1..max_segment stops (optionally
+    reversed) between two other consecutive stops, as (delta, start, length,
+    after, reverse) with `after` the tour index of the stop it follows.
+    """
+    m = len(ordered) - 1
+    edge = np.diagonal(ordered, 1)
+    best = (np.inf, 0, 0, 0, False)
+    for length in range(1, min(max_segment, m - 2) + 1):
+        starts = np.arange(1, m - length + 1)  # node 0 never moves
+        ends = starts + length - 1
+        removal = (ordered[starts - 1, starts] + ordered[ends, ends + 1]
+                   - ordered[starts - 1, ends + 1])
+        blocked = or_opt_blocked(m, length)
+        # Insert between tour[p] and tour[p + 1]: rows are segments, columns p
+        for reverse, (head, tail) in ((False, (starts, ends)), (True, (ends, starts))):
+            delta = ordered[:m, head].T + ordered[tail, 1:]
+            delta -= edge[None, :]
+            delta -= removal[:, None]
+            delta[blocked] = np.inf
+            s, p = divmod(int(np.argmin(delta)), m)
+            if delta[s, p] < best[0]:
+                best = (float(delta[s, p]), int(starts[s]), length, p, reverse)
+    return best
+
+
+def apply_or_opt(tour, start, length, after, reverse):
+    segment = tour[start:start + length]
+    if reverse:
+        segment = segment[::-1]
+    rest = np.concatenate((tour[:start], tour[start + length:]))
+    at = after + 1 if after < start else after + 1 - length
+    return np.concatenate((rest[:at], segment, rest[at:]))
+
+
+def optimize_route(dist, origin_row=None, time_budget_ms=ROUTE_TIME_BUDGET_MS,
+                   max_segment=ROUTE_OR_OPT_MAX_SEGMENT):
+    """
+    Visiting order for stops with pairwise distances `dist` (n, n), starting at
+    an origin `origin_row[k]` metres from stop k (None: start anywhere) and
+    ending at the last stop. Nearest-neighbour seed, then best-improvement
+    2-opt and Or-opt until neither helps or the time budget is spent.
+    Returns (order, seed_length_m, length_m, passes).
+    """
+    n = len(dist)
+    if n == 0:
+        return [], 0.0, 0.0, 0
+    # Node 0 is the origin; edges back into it are free, which makes the
+    # closed tour over m = n + 1 nodes equivalent to an open path from the origin
+    full = np.zeros((n + 1, n + 1), dtype=np.float32)
+    full[1:, 1:] = dist
+    if origin_row is not None:
+        full[0, 1:] = origin_row
+    tour = nearest_neighbour(full)
+    seed_length = tour_length(full, tour)
+    deadline = time.perf_counter() + time_budget_ms / 1000
+    passes = 0
+    while n > 2 and time.perf_counter() < deadline:
+        passes += 1
+        ordered = tour_matrix(full, tour)
+        delta, i, j = two_opt_move(ordered)
+        if delta < -EPSILON_M:
+            tour[i + 1:j + 1] = tour[i + 1:j + 1][::-1].copy()
+            continue
+        delta, start, length, after, reverse = or_opt_move(ordered, max_segment)
+        if delta < -EPSILON_M:
+            tour = apply_or_opt(tour, start, length, after, reverse)
+            continue
+        break
+    return [int(node) - 1 for node in tour[1:]], seed_length, tour_length(full, tour), passes
+
+
+distance_matrices = DistanceMatrixCache()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=distance_matrices._after_fork)
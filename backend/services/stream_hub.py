@@ -0,0 +1,152 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Live position stream (server-sent events) configuration
+STREAM_DEFAULT_INTERVAL = float(os.getenv('STREAM_DEFAULT_INTERVAL', '1.0'))
+STREAM_MIN_INTERVAL = float(os.getenv('STREAM_MIN_INTERVAL', '0.25'))
+STREAM_MAX_INTERVAL = float(os.getenv('STREAM_MAX_INTERVAL', '60'))
+STREAM_HEARTBEAT_SECONDS = float(os.getenv('STREAM_HEARTBEAT_SECONDS', '15'))
+STREAM_MAX_PENDING = int(os.getenv('STREAM_MAX_PENDING', '5000'))
+STREAM_MAX_SUBSCRIBERS_PER_ORG = int(os.getenv('STREAM_MAX_SUBSCRIBERS_PER_ORG', '200'))
+
+
+def encode_event(event, data):
+    """Serialize one server-sent event frame."""
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class Subscriber:
+    """
+    One open stream. Pending events are keyed (e.g. per crew member), so a newer
+    position replaces a stale one that has not been sent yet instead of queueing
+    behind it; the queue is bounded by the number of distinct keys.
+    """
+
+    def __init__(self, organization_id, interval, max_pending=STREAM_MAX_PENDING):
+        self.organization_id = organization_id
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending = OrderedDict()  # key -> encoded frame
+        self._cond = threading.Condition()
+        self.closed = False
+        self.sent = 0
+        self.superseded = 0
+        self.overflowed = 0
+
+    def offer(self, key, frame):
+        with self._cond:
+            if self.closed:
+                return
+            if key in self._pending:
+                del self._pending[key]
+                self.superseded += 1
+            elif len(self._pending) >= self.max_pending:
+                self._pending.popitem(last=False)
+                self.overflowed += 1
+            self._pending[key] = frame
+            self._cond.notify()
+
+    def drain(self, timeout):
+        """Wait up to `timeout` seconds for events and take all that are pending."""
+        with self._cond:
+            if not self._pending and not self.closed:
+                self._cond.wait(timeout)
+            frames = list(self._pending.values())
+            self._pending.clear()
+        self.sent += len(frames)
+        return frames
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class StreamHub:
+    """
+    Per-organization fan-out of live updates from the ingest path to SSE viewers.
+    Each update is serialized once and the same frame is handed to every viewer.
+    Viewers only see events published by the worker process they are connected
+    to, so the stream route refuses to run with more than one worker.
+    """
+
+    def __init__(self, max_subscribers_per_org=STREAM_MAX_SUBSCRIBERS_PER_ORG):
+        self.max_subscribers_per_org = max_subscribers_per_org
+        self._subscribers = {}  # organization_id -> set(Subscriber)
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self, organization_id, interval=STREAM_DEFAULT_INTERVAL):
+        """Register a viewer; returns None when the organization is at its viewer limit."""
+        interval = min(max(interval, STREAM_MIN_INTERVAL), STREAM_MAX_INTERVAL)
+        subscriber = Subscriber(str(organization_id), interval)
+        with self._lock:
+            subscribers = self._subscribers.setdefault(subscriber.organization_id, set())
+            if len(subscribers) >= self.max_subscribers_per_org:
+                return None
+            subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        subscriber.close()
+        with self._lock:
+            subscribers = self._subscribers.get(subscriber.organization_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[subscriber.organization_id]
+
+    def has_subscribers(self, organization_id):
+        return str(organization_id) in self._subscribers
+
+    def publish(self, organization_id, event, items):
+        """Send (key, data) items as `event` frames to every viewer of the organization."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(str(organization_id), ()))
+        if not subscribers:
+            return
+        frames = [(key, encode_event(event, data)) for key, data in items]
+        for subscriber in subscribers:
+            for key, frame in frames:
+                subscriber.offer(key, frame)
+        self.published += len(frames)
+
+    def stream(self, subscriber, initial_frames=()):
+        """Generator of SSE text for one viewer; unsubscribes when the client goes away."""
+        try:
+            yield "retry: 3000\n\n"
+            for frame in initial_frames:
+                yield frame
+            last_sent = 0.0
+            while not subscriber.closed:
+                # Per-viewer throttle: newer updates keep coalescing meanwhile
+                remaining = subscriber.interval - (time.monotonic() - last_sent)
+                if remaining > 0:
+                    time.sleep(remaining)
+                frames = subscriber.drain(STREAM_HEARTBEAT_SECONDS)
+                if frames:
+                    yield "".join(frames)
+                    last_sent = time.monotonic()
+                else:
+                    yield ": keepalive\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self):
+        with self._lock:
+            subscribers = [subscriber for group in self._subscribers.values() for subscriber in group]
+            return {
+                "organizations": len(self._subscribers),
+                "subscribers": len(subscribers),
+                "published": self.published,
+                "pending": sum(len(subscriber._pending) for subscriber in subscribers),
+                "superseded": sum(subscriber.superseded for subscriber in subscribers),
+                "overflowed": sum(subscriber.overflowed for subscriber in subscribers),
+            }
+
+
+# Process-wide hub shared by the ingest and stream routes
+stream_hub = StreamHub()
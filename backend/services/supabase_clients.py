@@ -0,0 +1,260 @@
+import os
+import random
+import threading
+import time
+import weakref
+
+import httpx
+from supabase import create_client, Client, SupabaseAuthClient
+from postgrest.utils import SyncClient as PostgrestHttpClient
+from gotrue.http_clients import SyncClient as GoTrueHttpClient
+
+from services.metrics import upstream_duration, upstream_operation, upstream_requests
+from services.profiling import note_upstream
+
+# Supabase configuration
+SUPABASE_URL = os.getenv('SUPABASE_URL', '')
+SUPABASE_KEY = os.getenv('SUPABASE_KEY', '') # Public anon key
+SUPABASE_SERVICE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY', '') # Service role key
+
+# Connection pool / HTTP tuning (per worker process)
+SUPABASE_POOL_MAX_CONNECTIONS = int(os.getenv('SUPABASE_POOL_MAX_CONNECTIONS', '20'))
+SUPABASE_POOL_MAX_KEEPALIVE = int(os.getenv('SUPABASE_POOL_MAX_KEEPALIVE', '10'))
+SUPABASE_POOL_KEEPALIVE_EXPIRY = float(os.getenv('SUPABASE_POOL_KEEPALIVE_EXPIRY', '30'))
+SUPABASE_HTTP_TIMEOUT = float(os.getenv('SUPABASE_HTTP_TIMEOUT', '10'))
+SUPABASE_HTTP_CONNECT_TIMEOUT = float(os.getenv('SUPABASE_HTTP_CONNECT_TIMEOUT', '5'))
+SUPABASE_HTTP2 = os.getenv('SUPABASE_HTTP2', 'true').lower() in ('1', 'true', 'yes')
+SUPABASE_HTTP_RETRIES = int(os.getenv('SUPABASE_HTTP_RETRIES', '2'))
+SUPABASE_HTTP_BACKOFF = float(os.getenv('SUPABASE_HTTP_BACKOFF', '0.2'))
+
+# Only these methods are retried after the request may have reached the server
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+RETRYABLE_STATUS_CODES = {502, 503, 504}
+# Raised before any of the request was written, so retrying is safe for every method
+UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+def fetch_pages(query_factory, page_size=1000, max_rows=1000000):
+    """Yield rows from a PostgREST query in `range()` pages."""
+    start = 0
+    while start < max_rows:
+        end = min(start + page_size, max_rows) - 1
+        page = query_factory().range(start, end).execute().data or []
+        yield from page
+        if len(page) < end - start + 1:
+            return
+        start = end + 1
+
+
+class PooledTransport(httpx.BaseTransport):
+    """
+    Keep-alive connection pool with retry/backoff and usage counters.
+    Failures to connect are retried for every method (nothing was sent);
+    dropped connections and gateway errors only for idempotent methods, since
+    the server may already have applied the request.
+    """
+
+    def __init__(self, name, max_connections, max_keepalive, keepalive_expiry,
+                 http2=True, retries=0, backoff=0.2):
+        self.name = name
+        self.retries = retries
+        self.backoff = backoff
+        self._transport = httpx.HTTPTransport(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+                keepalive_expiry=keepalive_expiry,
+            ),
+        )
+        self._lock = threading.Lock()
+        self._seen_streams = weakref.WeakSet()  # network streams (connections) responses came over
+        self.max_connections = max_connections
+        self.checked_out = 0
+        self.requests = 0
+        self.connections_opened = 0
+        self.retried = 0
+        self.failures = 0
+
+    def _sleep_before_retry(self, attempt):
+        # Exponential backoff with full jitter, capped at 5 seconds
+        delay = min(5.0, self.backoff * (2 ** attempt))
+        time.sleep(random.uniform(0, delay))
+
+    def _track_connection(self, response):
+        stream = response.extensions.get('network_stream')
+        if stream is None:
+            return
+        with self._lock:
+            if stream not in self._seen_streams:
+                self._seen_streams.add(stream)
+                self.connections_opened += 1
+
+    def handle_request(self, request):
+        with self._lock:
+            self.checked_out += 1
+            self.requests += 1
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            attempt = 0
+            while True:
+                try:
+                    response = self._transport.handle_request(request)
+                except (*UNSENT_ERRORS, httpx.RemoteProtocolError) as e:
+                    status = 'error'
+                    if (attempt >= self.retries
+                            or (not isinstance(e, UNSENT_ERRORS) and request.method not in IDEMPOTENT_METHODS)):
+                        with self._lock:
+                            self.failures += 1
+                        raise
+                else:
+                    self._track_connection(response)
+                    status = response.status_code
+                    if (response.status_code not in RETRYABLE_STATUS_CODES
+                            or request.method not in IDEMPOTENT_METHODS
+                            or attempt >= self.retries):
+                        return response
+                    response.close()
+                with self._lock:
+                    self.retried += 1
+                self._sleep_before_retry(attempt)
+                attempt += 1
+        finally:
+            with self._lock:
+                self.checked_out -= 1
+            # Time to response headers; bodies are read by the caller afterwards
+            elapsed = time.perf_counter() - started
+            labels = upstream_operation(request.method, request.url.path)
+            upstream_duration.observe(elapsed, *labels)
+            upstream_requests.inc(*labels, str(status))
+            note_upstream(*labels, status, elapsed)
+
+    def close(self):
+        self._transport.close()
+
+    def stats(self):
+        with self._lock:
+            reuse_rate = 1 - (self.connections_opened / self.requests) if self.requests else 0.0
+            return {
+                "max_connections": self.max_connections,
+                "checked_out": self.checked_out,
+                "requests": self.requests,
+                "connections_opened": self.connections_opened,
+                "reuse_rate": round(max(reuse_rate, 0.0), 4),
+                "retries": self.retried,
+                "failures": self.failures,
+            }
+
+
+class SupabaseClientManager:
+    """
+    Process-wide owner of the Supabase clients and their connection pools.
+    PostgREST and GoTrue traffic each get their own keep-alive pool, shared by
+    the anon and service-role clients. State is rebuilt in a forked child
+    (e.g. gunicorn workers) so sockets are never shared across processes.
+    """
+
+    def __init__(self, url=SUPABASE_URL, anon_key=SUPABASE_KEY, service_key=SUPABASE_SERVICE_KEY):
+        self.url = url
+        self.anon_key = anon_key
+        self.service_key = service_key
+        self.timeout = httpx.Timeout(SUPABASE_HTTP_TIMEOUT, connect=SUPABASE_HTTP_CONNECT_TIMEOUT)
+        self._lock = threading.Lock()
+        self._reset_state()
+
+    def _reset_state(self):
+        self._pid = os.getpid()
+        self._clients = {}
+        self._transports = {}
+
+    def _after_fork(self):
+        # Drop (without closing) anything inherited from the parent process;
+        # closing would tear down the parent's live connections.
+        self._lock = threading.Lock()
+        self._reset_state()
+
+    def _transport(self, name):
+        transport = self._transports.get(name)
+        if transport is None:
+            transport = PooledTransport(
+                name,
+                max_connections=SUPABASE_POOL_MAX_CONNECTIONS,
+                max_keepalive=SUPABASE_POOL_MAX_KEEPALIVE,
+                keepalive_expiry=SUPABASE_POOL_KEEPALIVE_EXPIRY,
+                http2=SUPABASE_HTTP2,
+                retries=SUPABASE_HTTP_RETRIES,
+                backoff=SUPABASE_HTTP_BACKOFF,
+            )
+            self._transports[name] = transport
+        return transport
+
+    def _build(self, key):
+        client: Client = create_client(self.url, key)
+        # Swap the per-client httpx sessions for ones backed by the shared pools
+        postgrest = client.postgrest
+        default_session = postgrest.session
+        postgrest.session = PostgrestHttpClient(
+            base_url=default_session.base_url,
+            headers=default_session.headers,
+            timeout=self.timeout,
+            follow_redirects=True,
+            transport=self._transport('postgrest'),
+        )
+        default_session.close()
+        # The auth client (and its admin API) take their session through the constructor
+        auth_session = GoTrueHttpClient(
+            timeout=self.timeout,
+            follow_redirects=True,
+            transport=self._transport('gotrue'),
+        )
+        default_auth = client.auth
+        client.auth = SupabaseAuthClient(
+            url=client.auth_url,
+            headers=client.options.headers,
+            auto_refresh_token=client.options.auto_refresh_token,
+            persist_session=client.options.persist_session,
+            storage=client.options.storage,
+            flow_type=client.options.flow_type,
+            http_client=auth_session,
+        )
+        client.auth.on_auth_state_change(client._listen_to_auth_events)
+        default_auth.close()
+        return client
+
+    def _get(self, name, key):
+        if not self.url or not key:
+            return None
+        if os.getpid() != self._pid:
+            self._after_fork()
+        client = self._clients.get(name)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(name)
+                if client is None:
+                    client = self._build(key)
+                    self._clients[name] = client
+        return client
+
+    def public(self):
+        """Client using the anon key, or None when it is not configured."""
+        return self._get('public', self.anon_key)
+
+    def admin(self):
+        """Client using the service role key, or None when it is not configured."""
+        return self._get('admin', self.service_key)
+
+    def stats(self):
+        return {name: transport.stats() for name, transport in self._transports.items()}
+
+    def close(self):
+        with self._lock:
+            for transport in self._transports.values():
+                transport.close()
+            self._reset_state()
+
+
+# Process-wide manager shared by app.py and the route blueprints
+clients = SupabaseClientManager()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=clients._after_fork)
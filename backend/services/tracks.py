@@ -0,0 +1,164 @@
+import math
+import os
+import threading
+
+import numpy as np
+
+from services.geo import METERS_PER_DEGREE_LAT
+
+# Dead-band filter on crew_locations writes (0 metres disables it)
+LOCATION_DEADBAND_METERS = float(os.getenv('LOCATION_DEADBAND_METERS', '0'))
+# A fix is always stored once this long has passed since the last stored one
+LOCATION_DEADBAND_SECONDS = float(os.getenv('LOCATION_DEADBAND_SECONDS', '300'))
+
+# Track replay (/api/crew/<id>/track) configuration
+TRACK_DEFAULT_TOLERANCE_M = float(os.getenv('TRACK_DEFAULT_TOLERANCE_M', '10'))
+TRACK_MAX_TOLERANCE_M = float(os.getenv('TRACK_MAX_TOLERANCE_M', '1000'))
+TRACK_DEFAULT_WINDOW_HOURS = float(os.getenv('TRACK_DEFAULT_WINDOW_HOURS', '12'))
+TRACK_MAX_WINDOW_HOURS = float(os.getenv('TRACK_MAX_WINDOW_HOURS', '48'))
+TRACK_MAX_RAW_POINTS = int(os.getenv('TRACK_MAX_RAW_POINTS', '500000'))
+TRACK_PAGE_SIZE = int(os.getenv('TRACK_PAGE_SIZE', '1000'))
+# Points simplified together; bounds memory per track request
+TRACK_SIMPLIFY_WINDOW = int(os.getenv('TRACK_SIMPLIFY_WINDOW', '5000'))
+
+
+def _flat_distance_m(lat1, lon1, lat2, lon2):
+    dx = (lon2 - lon1) * METERS_PER_DEGREE_LAT * math.cos(math.radians(lat1))
+    dy = (lat2 - lat1) * METERS_PER_DEGREE_LAT
+    return math.hypot(dx, dy)
+
+
+class DeadBandFilter:
+    """
+    Drops fixes within `meters` and `seconds` of the member's last stored fix,
+    so a parked truck writes one row per `seconds` instead of one per fix.
+    admit() only decides; remember() records what was actually written, so a
+    failed insert that is retried is filtered the same way again.
+    """
+
+    def __init__(self, meters=LOCATION_DEADBAND_METERS, seconds=LOCATION_DEADBAND_SECONDS):
+        self.meters = meters
+        self.seconds = seconds
+        self._last = {}  # crew_member_id -> (latitude, longitude, epoch_timestamp)
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.dropped = 0
+
+    @property
+    def enabled(self):
+        return self.meters > 0
+
+    def admit(self, fixes):
+        """
+        Filter (crew_member_id, latitude, longitude, epoch_timestamp) fixes.
+        Returns the indices of fixes to store, in input order.
+        """
+        if not self.enabled:
+            return list(range(len(fixes)))
+        with self._lock:
+            last = {}
+            kept = []
+            for i in sorted(range(len(fixes)), key=lambda i: fixes[i][3]):
+                crew_member_id, latitude, longitude, timestamp = fixes[i]
+                previous = last.get(crew_member_id) or self._last.get(crew_member_id)
+                if (previous is not None
+                        and 0 <= timestamp - previous[2] < self.seconds
+                        and _flat_distance_m(previous[0], previous[1], latitude, longitude) < self.meters):
+                    continue
+                kept.append(i)
+                if previous is None or timestamp >= previous[2]:
+                    last[crew_member_id] = (latitude, longitude, timestamp)
+            self.admitted += len(kept)
+            self.dropped += len(fixes) - len(kept)
+        return sorted(kept)
+
+    def remember(self, fixes):
+        """Record stored fixes as the new reference points."""
+        if not self.enabled:
+            return
+        with self._lock:
+            for crew_member_id, latitude, longitude, timestamp in fixes:
+                previous = self._last.get(crew_member_id)
+                if previous is None or timestamp >= previous[2]:
+                    self._last[crew_member_id] = (latitude, longitude, timestamp)
+
+    def forget_member(self, crew_member_id):
+        with self._lock:
+            self._last.pop(str(crew_member_id), None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "meters": self.meters,
+                "seconds": self.seconds,
+                "members": len(self._last),
+                "admitted": self.admitted,
+                "dropped": self.dropped,
+            }
+
+
+def douglas_peucker(lats, lons, tolerance_m):
+    """
+    Boolean mask of the points kept by Douglas-Peucker simplification.
+    Distances use a local flat projection, which is accurate at track scale.
+    """
+    count = len(lats)
+    keep = np.zeros(count, dtype=bool)
+    if count == 0:
+        return keep
+    keep[0] = keep[-1] = True
+    if count < 3:
+        return keep
+    x = (lons - lons[0]) * METERS_PER_DEGREE_LAT * np.cos(np.radians(lats[0]))
+    y = (lats - lats[0]) * METERS_PER_DEGREE_LAT
+    stack = [(0, count - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        px, py = x[start + 1:end] - x[start], y[start + 1:end] - y[start]
+        length_sq = dx * dx + dy * dy
+        if length_sq > 0:
+            t = np.clip((px * dx + py * dy) / length_sq, 0.0, 1.0)
+            distances = np.hypot(px - t * dx, py - t * dy)
+        else:
+            distances = np.hypot(px, py)
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance_m:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return keep
+
+
+def simplify_stream(points, tolerance_m, window=TRACK_SIMPLIFY_WINDOW):
+    """
+    Douglas-Peucker over an iterable of (latitude, longitude, epoch_timestamp)
+    points in time order, yielding kept points as it goes. The track is cut into
+    windows of `window` points that share their boundary point, so memory stays
+    bounded however long the track is.
+    """
+    window = max(window, 2)
+    buffer = []
+    for point in points:
+        buffer.append(point)
+        if len(buffer) >= window:
+            kept = _simplify_window(buffer, tolerance_m)
+            yield from kept[:-1]
+            buffer = [kept[-1]]
+    if buffer:
+        yield from _simplify_window(buffer, tolerance_m)
+
+
+def _simplify_window(points, tolerance_m):
+    lats = np.fromiter((point[0] for point in points), dtype=np.float64, count=len(points))
+    lons = np.fromiter((point[1] for point in points), dtype=np.float64, count=len(points))
+    keep = douglas_peucker(lats, lons, tolerance_m)
+    return [points[i] for i in np.flatnonzero(keep).tolist()]
+
+
+# Process-wide filter used by both ingest paths
+deadband_filter = DeadBandFilter()
@@ -0,0 +1,326 @@
+import gzip
+import json
+import os
+import threading
+import zlib
+
+import numpy as np
+from flask.json.provider import DefaultJSONProvider
+
+from services.logs import get_logger
+
+log = get_logger('wire')
+
+# JSON encoder behind jsonify/get_json: "orjson" (needs `pip install orjson`) or "stdlib"
+WIRE_JSON_ENCODER = os.getenv('WIRE_JSON_ENCODER', 'orjson').lower()
+# MessagePack bodies (Content-Type/Accept: application/msgpack, needs the msgpack package)
+WIRE_MSGPACK_ENABLED = os.getenv('WIRE_MSGPACK_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Responses smaller than this are sent uncompressed
+WIRE_COMPRESS_MIN_BYTES = int(os.getenv('WIRE_COMPRESS_MIN_BYTES', '1024'))
+WIRE_GZIP_LEVEL = int(os.getenv('WIRE_GZIP_LEVEL', '6'))
+# Brotli (Content-Encoding: br) needs the brotli package; gzip is used without it
+WIRE_BROTLI_QUALITY = int(os.getenv('WIRE_BROTLI_QUALITY', '5'))
+# Largest request body accepted after decompression
+WIRE_MAX_REQUEST_BYTES = int(os.getenv('WIRE_MAX_REQUEST_BYTES', str(16 * 1024 * 1024)))
+
+MSGPACK_MIMETYPES = ('application/msgpack', 'application/x-msgpack')
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/msgpack', 'application/x-msgpack', 'text/csv',
+                          'text/plain', 'text/html')
+
+# Columnar bodies carry these as integer deltas: micro-degrees (~0.1m) and milliseconds
+COORDINATE_SCALE = 1_000_000
+TIME_SCALE = 1000
+
+
+class WireError(Exception):
+    """A request body that cannot be decoded; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _load_orjson():
+    try:
+        import orjson  # optional dependency, only needed for the fast JSON path
+    except ImportError:
+        log.warning("orjson is not installed, falling back to the standard library JSON encoder")
+        return None
+    return orjson
+
+
+def _load_msgpack():
+    if not WIRE_MSGPACK_ENABLED:
+        return None
+    try:
+        import msgpack  # optional dependency, only needed for application/msgpack bodies
+    except ImportError:
+        log.warning("msgpack is not installed, application/msgpack bodies are not accepted")
+        return None
+    return msgpack
+
+
+def _load_brotli():
+    try:
+        import brotli  # optional dependency, only needed for Content-Encoding: br
+    except ImportError:
+        return None
+    return brotli
+
+
+orjson = _load_orjson() if WIRE_JSON_ENCODER == 'orjson' else None
+msgpack = _load_msgpack()
+brotli = _load_brotli()
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider on orjson: same output as the default provider (sorted
+    keys, compact separators, HTTP dates) except that non-ASCII text is sent
+    as UTF-8 instead of \\u escapes, and several times faster. Anything orjson
+    cannot encode, and calls with stdlib-only keyword arguments, fall back to
+    the default provider.
+    """
+
+    options = 0
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.options = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            self.options |= orjson.OPT_SORT_KEYS
+
+    def dumps_bytes(self, obj):
+        try:
+            return orjson.dumps(obj, default=self.default, option=self.options)
+        except TypeError:
+            return super().dumps(obj, separators=(',', ':')).encode()
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return self.dumps_bytes(obj).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj) + b"\n", mimetype=self.mimetype)
+
+
+def json_provider(app):
+    """The JSON provider for WIRE_JSON_ENCODER, the default one when orjson is unavailable."""
+    return FastJSONProvider(app) if orjson is not None else DefaultJSONProvider(app)
+
+
+def encode_columns(fields, rows, scales=None):
+    """
+    Compact columnar form of uniform rows (lists in `fields` order): one list
+    per field instead of one object per row. Fields in `scales` (field ->
+    multiplier) become integer deltas of round(value * multiplier) from the
+    previous row, so a slowly moving truck costs a byte or two per value in
+    MessagePack; their null values are listed in "nulls" (and count as the
+    previous value). A column whose values are all equal is sent once.
+    """
+    scales = scales or {}
+    columns, nulls, used_scales = {}, {}, {}
+    for index, field in enumerate(fields):
+        values = [row[index] for row in rows]
+        if field in scales:
+            missing = [i for i, value in enumerate(values) if value is None]
+            if missing:
+                nulls[field] = missing
+                values = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+                filled = np.isnan(values)
+                # Nulls repeat the previous value, so they encode as zero deltas
+                previous = np.maximum.accumulate(np.where(filled, 0, np.arange(len(values))))
+                values = np.nan_to_num(values[previous])
+            scaled = np.rint(np.asarray(values, dtype=np.float64) * scales[field]).astype(np.int64)
+            columns[field] = np.diff(scaled, prepend=0).tolist()
+            used_scales[field] = scales[field]
+        elif values and all(value == values[0] for value in values):
+            columns[field] = values[0]
+        else:
+            columns[field] = values
+    body = {"fields": list(fields), "count": len(rows), "columns": columns}
+    if used_scales:
+        body["scales"] = used_scales
+    if nulls:
+        body["nulls"] = nulls
+    return body
+
+
+def decode_columns(body):
+    """Rows (lists in body["fields"] order) of a columnar body; raises WireError when malformed."""
+    try:
+        fields, count, columns = body['fields'], int(body['count']), body['columns']
+        scales = body.get('scales') or {}
+        nulls = body.get('nulls') or {}
+        decoded = []
+        for field in fields:
+            values = columns[field]
+            if not isinstance(values, list):
+                values = [values] * count
+            elif len(values) != count:
+                raise WireError(f"Column {field} has {len(values)} values, expected {count}")
+            if field in scales:
+                values = (np.cumsum(np.asarray(values, dtype=np.int64)) / float(scales[field])).tolist()
+                for index in nulls.get(field, ()):
+                    values[index] = None
+            decoded.append(values)
+    except WireError:
+        raise
+    except (KeyError, TypeError, ValueError, OverflowError, IndexError) as e:
+        raise WireError(f"Malformed columnar body: {e}")
+    return [list(row) for row in zip(*decoded)] if decoded else [[] for _ in range(count)]
+
+
+def decode_fix_columns(body, max_rows):
+    """Fix dicts (as accepted by normalize_fix) from a columnar body with epoch-second timestamps."""
+    fields = body.get('fields') if isinstance(body, dict) else None
+    if not isinstance(fields, list):
+        raise WireError("Columnar body needs a list of fields")
+    if not isinstance(body.get('count'), int) or body['count'] > max_rows:
+        raise WireError(f"Columnar body needs a count of at most {max_rows} fixes", 413)
+    return [dict(zip(fields, row)) for row in decode_columns(body)]
+
+
+class WireCodec:
+    """Request body decoding and response encoding/compression, with counters for /admin/stats."""
+
+    def __init__(self, max_request_bytes=WIRE_MAX_REQUEST_BYTES, compress_min_bytes=WIRE_COMPRESS_MIN_BYTES,
+                 gzip_level=WIRE_GZIP_LEVEL, brotli_quality=WIRE_BROTLI_QUALITY):
+        self.max_request_bytes = max_request_bytes
+        self.compress_min_bytes = compress_min_bytes
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self._after_fork()
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self.requests = {}           # body format -> count
+        self.request_encodings = {}  # Content-Encoding -> count
+        self.responses = {}          # body format -> count
+        self.compressed = {}         # Content-Encoding -> count
+        self.bytes_before = 0
+        self.bytes_after = 0
+
+    def _count(self, counter, key):
+        with self._lock:
+            counter[key] = counter.get(key, 0) + 1
+
+    @property
+    def msgpack_available(self):
+        return msgpack is not None
+
+    @property
+    def response_mimetypes(self):
+        """Body types responses can be negotiated to, preferred first."""
+        return ('application/json',) + (MSGPACK_MIMETYPES if msgpack is not None else ())
+
+    @property
+    def response_encodings(self):
+        return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+    @staticmethod
+    def _inflate(data, wbits, limit):
+        inflater = zlib.decompressobj(wbits)
+        output = inflater.decompress(data, limit + 1)
+        if not inflater.eof and len(output) <= limit:
+            raise WireError("Truncated compressed body")
+        return output
+
+    def decompress(self, data, encoding):
+        """Undo a request's Content-Encoding, refusing bodies that inflate past max_request_bytes."""
+        encoding = (encoding or 'identity').strip().lower()
+        if encoding == 'identity':
+            return data
+        limit = self.max_request_bytes
+        try:
+            if encoding in ('gzip', 'x-gzip', 'deflate'):
+                try:
+                    # wbits 47 reads both gzip and zlib headers
+                    output = self._inflate(data, 47, limit)
+                except zlib.error:
+                    if encoding != 'deflate':
+                        raise
+                    # Some clients send Content-Encoding: deflate as a raw stream without the zlib header
+                    output = self._inflate(data, -15, limit)
+            elif encoding == 'br' and brotli is not None:
+                try:
+                    output = brotli.Decompressor().process(data, output_buffer_limit=limit + 1)
+                except TypeError:  # brotli < 1.2 has no output limit
+                    output = brotli.decompress(data)
+            else:
+                raise WireError(f"Unsupported Content-Encoding: {encoding}", 415)
+        except (zlib.error, getattr(brotli, 'error', zlib.error)) as e:
+            raise WireError(f"Could not decompress the request body: {e}")
+        if len(output) > limit:
+            raise WireError(f"Request body is larger than {limit} bytes once decompressed", 413)
+        self._count(self.request_encodings, encoding)
+        return output
+
+    def decode(self, data, mimetype, encoding=None, json_loads=json.loads):
+        """The request body as Python objects: JSON, or MessagePack when the Content-Type says so."""
+        data = self.decompress(data, encoding)
+        if mimetype in MSGPACK_MIMETYPES:
+            if msgpack is None:
+                raise WireError("MessagePack bodies are not supported by this server", 415)
+            try:
+                payload = msgpack.unpackb(data, raw=False, strict_map_key=False)
+            except (ValueError, msgpack.UnpackException) as e:
+                raise WireError(f"Invalid MessagePack body: {e}")
+            self._count(self.requests, 'msgpack')
+            return payload
+        if mimetype == 'application/json' or mimetype.endswith('+json'):
+            try:
+                payload = json_loads(data)
+            except ValueError as e:
+                raise WireError(f"Invalid JSON body: {e}")
+            self._count(self.requests, 'json')
+            return payload
+        raise WireError("Expected an application/json or application/msgpack body", 415)
+
+    def pack(self, payload):
+        """MessagePack bytes of a response payload."""
+        self._count(self.responses, 'msgpack')
+        return msgpack.packb(payload, use_bin_type=True)
+
+    def record_json_response(self):
+        self._count(self.responses, 'json')
+
+    def compress(self, data, encoding):
+        """`data` compressed with a Content-Encoding from response_encodings."""
+        if encoding == 'br':
+            output = brotli.compress(data, quality=self.brotli_quality)
+        else:
+            output = gzip.compress(data, compresslevel=self.gzip_level, mtime=0)
+        with self._lock:
+            self.compressed[encoding] = self.compressed.get(encoding, 0) + 1
+            self.bytes_before += len(data)
+            self.bytes_after += len(output)
+        return output
+
+    def stats(self):
+        with self._lock:
+            return {
+                "json_encoder": 'orjson' if orjson is not None else 'stdlib',
+                "msgpack": msgpack is not None,
+                "brotli": brotli is not None,
+                "requests": dict(self.requests),
+                "request_encodings": dict(self.request_encodings),
+                "responses": dict(self.responses),
+                "compressed_responses": dict(self.compressed),
+                "compressed_bytes_before": self.bytes_before,
+                "compressed_bytes_after": self.bytes_after,
+            }
+
+
+wire_codec = WireCodec()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=wire_codec._after_fork)
@@ -0,0 +1,17 @@
+import os
+
+
+def worker_processes():
+    """
+    Worker processes serving the app: gunicorn's worker count (gunicorn.conf.py
+    exports the effective one to each worker), 1 under the Flask dev server.
+    """
+    try:
+        return max(1, int(os.getenv('GUNICORN_WORKERS', '1')))
+    except ValueError:
+        return 1
+
+
+def single_worker():
+    """True when in-process state (position index, stream hub, ...) sees every request."""
+    return worker_processes() == 1
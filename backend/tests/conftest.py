@@ -0,0 +1,64 @@
+import os
+import tempfile
+import time
+import uuid
+
+import jwt
+import pytest
+from supabase import create_client
+
+from benchmarks.fake_supabase import FakeSupabase
+
+JWT_SECRET = 'test-jwt-secret-of-at-least-32-bytes'
+
+# Services read their configuration at import: keep the tests off any real
+# Supabase project and out of the temp paths a local server would use
+_scratch = tempfile.mkdtemp(prefix='crewtrack-tests-')
+os.environ.update({
+    'SUPABASE_URL': '',
+    'SUPABASE_KEY': '',
+    'SUPABASE_SERVICE_ROLE_KEY': '',
+    'LOCATION_SPOOL_PATH': os.path.join(_scratch, 'location-spool.db'),
+    'COVERAGE_PATH': os.path.join(_scratch, 'coverage.db'),
+    'ARCHIVE_DIR': os.path.join(_scratch, 'archive'),
+    'PROFILE_DIR': os.path.join(_scratch, 'profiles'),
+    'DB_WEBHOOK_SECRET': 'test-webhook-secret',
+    'JWT_SECRET_KEY': JWT_SECRET,
+    # Test tokens carry role and organization_id, so no GoTrue lookup is needed
+    'AUTH_TRUST_JWT_CLAIMS': 'true',
+})
+os.environ.pop('GUNICORN_WORKERS', None)
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    import app
+    app.app.config['TESTING'] = True
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def auth_headers():
+    """Authorization headers for a signed-in user of an organization"""
+    def headers(organization_id, role='admin'):
+        now = int(time.time())
+        token = jwt.encode({'sub': str(uuid.uuid4()), 'aud': 'authenticated', 'iat': now, 'exp': now + 3600,
+                            'user_metadata': {'role': role, 'organization_id': organization_id}},
+                           JWT_SECRET, algorithm='HS256')
+        return {'Authorization': f'Bearer {token}'}
+    return headers
+
+
+@pytest.fixture
+def database(app_module, monkeypatch):
+    """The app's service-role client pointed at a fake Supabase"""
+    fake = FakeSupabase().start()
+    supabase = create_client(fake.url, jwt.encode({'role': 'service_role'}, JWT_SECRET, algorithm='HS256'))
+    monkeypatch.setattr(app_module.clients, 'admin', lambda: supabase)
+    yield fake
+    fake.stop()
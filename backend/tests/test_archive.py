@@ -0,0 +1,79 @@
+import time
+import uuid
+
+import jwt
+import pytest
+from supabase import create_client
+
+from benchmarks.fake_supabase import FakeSupabase
+from services.archive import LocationArchive, day_of
+from services.location_ingest import format_timestamp, parse_timestamp
+
+ORG = 'org-1'
+DAY = 86400
+
+
+@pytest.fixture
+def fake():
+    fake = FakeSupabase().start()
+    yield fake
+    fake.stop()
+
+
+def make_rows(member_id, start, count, step=600):
+    return [{"id": str(uuid.uuid4()), "crew_member_id": member_id, "latitude": 39.7 + i * 1e-4,
+             "longitude": -104.9 - i * 1e-4, "timestamp": format_timestamp(start + i * step)}
+            for i in range(count)]
+
+
+def archived(archive, **kwargs):
+    found = {}
+    for member_id, ids, lats, lons, timestamps in archive.query(ORG, with_ids=True, **kwargs):
+        for row_id, lat, lon, ms in zip(ids.tolist(), lats.tolist(), lons.tolist(), timestamps.tolist()):
+            found[str(uuid.UUID(bytes=row_id))] = (member_id, round(lat, 6), round(lon, 6), ms)
+    return found
+
+
+def test_compact_moves_whole_days_and_round_trips(fake, tmp_path):
+    members = [str(uuid.uuid4()), str(uuid.uuid4())]
+    midnight = (int(time.time()) // DAY - 40) * DAY
+    old = make_rows(members[0], midnight, 50) + make_rows(members[1], midnight + DAY, 30)
+    recent = make_rows(members[0], time.time() - 3600, 5)
+    fake.insert('crew_locations', old + recent)
+    client = create_client(fake.url, jwt.encode({'role': 'service_role'}, 'test-jwt-secret-of-at-least-32-bytes', algorithm='HS256'))
+
+    archive = LocationArchive(root=str(tmp_path))
+    results = archive.compact(client, ORG, members, time.time() - 30 * DAY)
+    assert [(result['day'], result['rows']) for result in results] == [
+        (day_of(midnight), 50), (day_of(midnight + DAY), 30)]
+    # Archived rows left the live table; recent ones stayed
+    assert fake.count('crew_locations') == len(recent)
+
+    found = archived(archive)
+    assert len(found) == len(old)
+    for row in old:
+        member_id, lat, lon, ms = found[row['id']]
+        assert member_id == row['crew_member_id']
+        # float32 columns: about a metre
+        assert lat == pytest.approx(row['latitude'], abs=1e-5)
+        assert lon == pytest.approx(row['longitude'], abs=1e-5)
+        assert ms == round(parse_timestamp(row['timestamp']) * 1000)
+    assert len(archived(archive, crew_member_id=members[1])) == 30
+    assert len(archived(archive, from_ts=midnight + DAY, to_ts=midnight + 2 * DAY)) == 30
+
+    # A rerun finds nothing to move, and rewriting a day skips rows already archived
+    assert archive.compact(client, ORG, members, time.time() - 30 * DAY) == []
+    assert archive.write_day(ORG, day_of(midnight), old[:10]) == 0
+    assert archive.write_day(ORG, day_of(midnight), make_rows(members[0], midnight + 40000, 3)) == 3
+    assert len(archived(archive)) == len(old) + 3
+
+
+def test_ids_ending_in_zero_bytes_round_trip(tmp_path):
+    midnight = (int(time.time()) // DAY - 40) * DAY
+    rows = make_rows(str(uuid.uuid4()), midnight, 3)
+    rows[0]['id'] = str(uuid.UUID(bytes=uuid.uuid4().bytes[:14] + b'\0\0'))
+    archive = LocationArchive(root=str(tmp_path))
+    assert archive.write_day(ORG, day_of(midnight), rows) == 3
+    assert set(archived(archive)) == {row['id'] for row in rows}
+    # Rewriting the day recognizes every id as already archived
+    assert archive.write_day(ORG, day_of(midnight), rows) == 0
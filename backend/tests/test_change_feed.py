@@ -0,0 +1,78 @@
+import os
+
+from services.change_feed import ChangeFeed, change_feed
+
+ORG = 'org-1'
+
+
+def test_unknown_org_gets_no_state():
+    feed = ChangeFeed()
+    cursor = feed.cursor('never-seen')
+    assert cursor == f"{feed.epoch}.0"
+    assert feed.parse_cursor('never-seen', cursor) == 0
+    assert feed.parse_cursor('never-seen', f"{feed.epoch}.7") is None
+    assert feed.changes_since('never-seen', 0) == ([], [], [])
+    assert feed.stats()['organizations'] == 0
+
+
+def test_delta_since_cursor():
+    feed = ChangeFeed()
+    first = feed.cursor(ORG)
+    feed.member_upserted(ORG, {"id": "m1", "name": "Ann"})
+    feed.positions_changed(ORG, ["m1", "m2"])
+    since = feed.parse_cursor(ORG, first)
+    assert since == 0
+    positions, members, removed = feed.changes_since(ORG, since)
+    assert sorted(positions) == ["m1", "m2"]
+    assert members == [{"id": "m1", "name": "Ann"}]
+    assert removed == []
+
+    second = feed.cursor(ORG)
+    feed.member_removed(ORG, "m2")
+    positions, members, removed = feed.changes_since(ORG, feed.parse_cursor(ORG, second))
+    assert (positions, members, removed) == ([], [], ["m2"])
+
+
+def test_cursor_of_another_epoch_or_org_forces_full_sync():
+    feed, other = ChangeFeed(), ChangeFeed()
+    feed.positions_changed(ORG, ["m1"])
+    other.positions_changed(ORG, ["m1"])
+    assert feed.parse_cursor(ORG, other.cursor(ORG)) is None
+    assert feed.parse_cursor(ORG, "garbage") is None
+    assert feed.parse_cursor(ORG, f"{feed.epoch}.99") is None
+    # An org first tracked after other changes cannot vouch for cursors from before
+    untracked = feed.cursor('org-2')
+    feed.positions_changed('org-2', ["m9"])
+    assert feed.parse_cursor('org-2', untracked) is None
+
+
+def test_forgotten_tombstones_force_full_sync():
+    feed = ChangeFeed(max_tombstones=1)
+    cursor = feed.cursor(ORG)
+    feed.member_removed(ORG, "m1")
+    feed.member_removed(ORG, "m2")
+    assert feed.parse_cursor(ORG, cursor) is None
+
+
+def test_forked_worker_gets_a_new_epoch():
+    change_feed.positions_changed(ORG, ["m1"])
+    parent_epoch = change_feed.epoch
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_end)
+        os.write(write_end, f"{change_feed.epoch} {change_feed.stats()['organizations']}".encode())
+        os._exit(0)
+    os.close(write_end)
+    child_epoch, child_orgs = os.read(read_end, 100).decode().split()
+    os.waitpid(pid, 0)
+    assert child_epoch != parent_epoch
+    assert child_orgs == '0'
+
+
+def test_changes_require_a_member_of_the_organization(app_module, client, auth_headers, monkeypatch):
+    monkeypatch.setattr(app_module.position_index, 'warmed', True)
+    assert client.get('/api/organization/org-1/changes').status_code == 401
+    assert client.get('/api/organization/org-1/changes', headers=auth_headers('org-2')).status_code == 403
+    response = client.get('/api/organization/org-1/changes', headers=auth_headers('org-1', role='crew'))
+    assert response.status_code == 200 and response.get_json()['full']
@@ -0,0 +1,67 @@
+from services.geofence import GeofenceEngine, parse_geofence
+from services.location_index import LocationIndex
+
+ORG = 'org-1'
+MEMBER = 'member-1'
+SITE = {"id": "site-1", "organization_id": ORG, "latitude": 39.7, "longitude": -104.9,
+        "geofence_details": {"radius_m": 50}}
+METRE = 1 / 111_320  # degrees of latitude
+
+
+def engine(**kwargs):
+    index = LocationIndex(lambda organization_id: [SITE] if organization_id == ORG else [])
+    return GeofenceEngine(index, exit_margin_m=25, enter_confirmations=2, exit_confirmations=2,
+                          min_service_seconds=60, **kwargs)
+
+
+def north(metres, timestamp):
+    return (MEMBER, SITE['latitude'] + metres * METRE, SITE['longitude'], timestamp)
+
+
+def test_parse_geofence_shapes():
+    assert parse_geofence({"radius": 30}, 1.0, 2.0) == ('circle', 1.0, 2.0, 30.0)
+    kind, lats, lons = parse_geofence({"polygon": [[0, 0], [0, 1], [1, 1]]}, 5, 5)
+    assert kind == 'polygon' and list(lats) == [0, 0, 1] and list(lons) == [0, 1, 1]
+    kind, lats, lons = parse_geofence('{"type": "Polygon", "coordinates": [[[2, 1], [3, 1], [3, 2]]]}', 5, 5)
+    assert kind == 'polygon' and list(lats) == [1, 1, 2] and list(lons) == [2, 3, 3]
+    assert parse_geofence("not json", 1.0, 2.0)[0] == 'circle'
+
+
+def test_single_fix_inside_does_not_arrive():
+    fences = engine()
+    assert fences.process(ORG, [north(0, 0), north(500, 10), north(0, 20)]) == []
+
+
+def test_arrival_needs_confirmation_and_dates_from_first_fix():
+    fences = engine()
+    assert fences.process(ORG, [north(10, 100)]) == []
+    events = fences.process(ORG, [north(5, 110)])
+    assert [(event['type'], event['timestamp']) for event in events] == [('enter', 100)]
+
+
+def test_hysteresis_band_holds_the_visit():
+    fences = engine()
+    fences.process(ORG, [north(0, 0), north(0, 10)])
+    # 60m is outside the 50m fence but inside the 25m exit margin: still on site
+    assert fences.process(ORG, [north(60, t) for t in range(20, 200, 10)]) == []
+    # One fix beyond the margin is not yet a departure, the second is
+    assert fences.process(ORG, [north(300, 200)]) == []
+    events = fences.process(ORG, [north(300, 210)])
+    assert len(events) == 1
+    exit_event = events[0]
+    assert exit_event['type'] == 'exit' and exit_event['entered_at'] == 0
+    assert exit_event['dwell_seconds'] == 210 and exit_event['serviced']
+    assert fences.stats()['members_tracked'] == 0
+
+
+def test_short_visit_is_not_serviced():
+    fences = engine()
+    events = fences.process(ORG, [north(0, 0), north(0, 10), north(400, 20), north(400, 30)])
+    assert [event['type'] for event in events] == ['enter', 'exit']
+    assert not events[1]['serviced']
+
+
+def test_fixes_are_processed_in_time_order():
+    fences = engine()
+    events = fences.process(ORG, [north(400, 30), north(0, 0), north(400, 20), north(0, 10)])
+    assert [event['type'] for event in events] == ['enter', 'exit']
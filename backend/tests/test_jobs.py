@@ -0,0 +1,120 @@
+import time
+
+import pytest
+
+from services.jobs import JobRegistry, PermanentJobError, QueueFullError
+
+
+def wait_finished(job, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not job.finished and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return job.finished
+
+
+def test_idempotency_key_returns_original_job():
+    registry = JobRegistry()
+    job, created = registry.create('crew_removal', 'org-1', 2, 'key-1')
+    again, created_again = registry.create('crew_removal', 'org-1', 2, 'key-1')
+    assert created and not created_again
+    assert again is job
+    assert registry.find_by_key('crew_removal', 'org-1', 'key-1') is job
+    # Keys are scoped to the kind and organization
+    assert registry.create('crew_removal', 'org-2', 2, 'key-1')[1]
+    assert registry.create('user_deletion', 'org-1', 1, 'key-1')[1]
+    # Deletions find their key per deleted user, whatever organization the job belongs to
+    deletion, _ = registry.create('user_deletion', 'org-1', 1, 'key-2', key_scope='user:u-1')
+    assert deletion.organization_id == 'org-1'
+    assert registry.find_by_key('user_deletion', 'user:u-1', 'key-2') is deletion
+    assert registry.find_by_key('user_deletion', 'org-1', 'key-2') is None
+
+
+def test_full_queue_releases_the_key():
+    registry = JobRegistry(max_queued_items=1)
+    job, _ = registry.create('crew_removal', 'org-1', 2, 'key-1')
+    with pytest.raises(QueueFullError):
+        registry.enqueue(job, ['a', 'b'], lambda item: None)
+    assert job.status == 'failed'
+    assert registry.get(job.id) is job
+    # The client's retry with the same key gets a fresh job that is actually queued
+    assert registry.find_by_key('crew_removal', 'org-1', 'key-1') is None
+    retry, created = registry.create('crew_removal', 'org-1', 1, 'key-1')
+    assert created and retry is not job
+    registry.enqueue(retry, ['a'], lambda item: {"deleted": item})
+    assert wait_finished(retry)
+    assert retry.status == 'completed'
+    assert retry.results == [{"item": 'a', "status": 'succeeded', "attempts": 1, "deleted": 'a'}]
+
+
+def test_items_retry_until_permanent_failure():
+    registry = JobRegistry(workers=2, max_attempts=3, retry_backoff=0.001)
+    attempts = {}
+
+    def handler(item):
+        attempts[item] = attempts.get(item, 0) + 1
+        if item == 'flaky' and attempts[item] < 2:
+            raise ConnectionError("reset")
+        if item == 'gone':
+            raise PermanentJobError("not found")
+        if item == 'broken':
+            raise ConnectionError("always down")
+
+    job, _ = registry.create('crew_removal', 'org-1', 4)
+    registry.enqueue(job, ['flaky', 'gone', 'broken', 'fine'], handler)
+    assert wait_finished(job)
+    statuses = {result['item']: (result['status'], result['attempts']) for result in job.results}
+    assert statuses == {'flaky': ('succeeded', 2), 'gone': ('failed', 1), 'broken': ('failed', 3),
+                        'fine': ('succeeded', 1)}
+    assert job.status == 'completed_with_errors'
+    assert job.to_dict()['failed'] == 2
+
+
+def test_background_job_records_error():
+    registry = JobRegistry()
+    job, _ = registry.create('location_archive', 'org-1', 1)
+
+    def run(job):
+        raise RuntimeError("disk full")
+
+    registry.run_in_background(job, run)
+    assert wait_finished(job)
+    assert job.to_dict()['error'] == "disk full"
+
+
+def test_refused_removal_keeps_tokens_valid(app_module, monkeypatch):
+    def full(job, items, handler):
+        raise QueueFullError("Job queue is full")
+
+    monkeypatch.setattr(app_module.jobs, 'enqueue', full)
+    user_id = 'f3a9c1d2-7b4e-4c8a-9d6f-2e1b3a5c7d90'
+    issued = {'sub': user_id, 'iat': time.time() - 1}
+    with app_module.app.test_request_context('/crew-members', method='DELETE'):
+        response, status = app_module.enqueue_crew_removals(
+            [{"id": 'member-1', "organization_id": 'org-1', "user_id": user_id}], 'org-1')
+    assert status == 503
+    assert not app_module.identity_cache.is_revoked(issued)
+
+
+def test_jobs_are_visible_to_their_organizations_admins(app_module, client, auth_headers):
+    job, _ = app_module.jobs.create('user_deletion', 'org-1', 1)
+    assert client.get(f'/jobs/{job.id}', headers=auth_headers('org-2')).status_code == 404
+    assert client.get(f'/jobs/{job.id}', headers=auth_headers('org-1', role='crew')).status_code == 403
+    assert client.get(f'/jobs/{job.id}', headers=auth_headers('org-1')).get_json()['id'] == job.id
+    unowned, _ = app_module.jobs.create('user_deletion', None, 1)
+    assert client.get(f'/jobs/{unowned.id}', headers=auth_headers('org-1')).status_code == 404
+
+
+def test_user_deletion_job_belongs_to_the_users_organization(database, client, auth_headers):
+    user = database.add_user('crew@org-1.test', {'role': 'crew', 'organization_id': 'org-1'})
+    headers = {'Idempotency-Key': 'delete-1'}
+    response = client.delete(f"/api/users/delete/{user['id']}", headers=headers)
+    assert response.status_code == 202
+    job_id = response.get_json()['job_id']
+    assert client.get(f'/jobs/{job_id}', headers=auth_headers('org-2')).status_code == 404
+    assert client.get(f'/jobs/{job_id}', headers=auth_headers('org-1')).get_json()['organization_id'] == 'org-1'
+    # A retry after the user is gone still returns the original job
+    deadline = time.monotonic() + 5
+    while database.get_user(user['id']) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    retry = client.delete(f"/api/users/delete/{user['id']}", headers=headers)
+    assert retry.status_code == 200 and retry.get_json()['job_id'] == job_id
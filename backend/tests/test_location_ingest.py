@@ -0,0 +1,166 @@
+import threading
+
+import pytest
+from postgrest.exceptions import APIError
+
+from services.location_ingest import LocationWriteBuffer, is_permanent_write_error, normalize_fix, \
+    parse_time_param, write_isolating_bad_rows
+
+MEMBER_ID = '6f1c2b8e-3d4a-4f6b-9a2e-1c3d5e7f9a0b'
+
+
+def fix(**overrides):
+    raw = {"crew_member_id": MEMBER_ID, "latitude": 39.7392, "longitude": -104.9903,
+           "timestamp": "2024-01-15T08:30:00Z"}
+    raw.update(overrides)
+    return raw
+
+
+class RecordingWriter:
+    """Bulk writer that refuses batches containing a poisoned crew member, like Postgres would."""
+
+    def __init__(self, poisoned=(), error_code='23503'):
+        self.poisoned = set(poisoned)
+        self.error_code = error_code
+        self.rows = []
+        self.calls = 0
+        self.written = threading.Event()
+
+    def __call__(self, rows):
+        self.calls += 1
+        if any(row['crew_member_id'] in self.poisoned for row in rows):
+            raise APIError({"message": "refused", "code": self.error_code, "hint": None, "details": None})
+        self.rows.extend(rows)
+        self.written.set()
+
+
+def test_normalize_fix_builds_row():
+    row, error = normalize_fix(fix(fix_id=7))
+    assert error is None
+    assert row['crew_member_id'] == MEMBER_ID
+    assert row['timestamp'] == '2024-01-15T08:30:00+00:00'
+    assert row['id'] == normalize_fix(fix(fix_id=7))[0]['id']
+
+
+def test_normalize_fix_rejects_unrepresentable_timestamps():
+    for timestamp in (1e20, -1e20, float('inf'), float('nan'), True, "not a date"):
+        row, error = normalize_fix(fix(timestamp=timestamp))
+        assert row is None
+        assert error == "Invalid timestamp"
+
+
+def test_time_params():
+    assert parse_time_param(None) is None and parse_time_param('') is None
+    assert parse_time_param('1700000000') == 1700000000.0
+    assert parse_time_param('1700000000000') == 1700000000.0
+    assert parse_time_param('2023-11-14T22:13:20Z') == 1700000000.0
+    with pytest.raises(ValueError):
+        parse_time_param('yesterday')
+
+
+def test_normalize_fix_requires_uuid_member():
+    assert normalize_fix(fix(crew_member_id='not-a-uuid'))[1] == "Invalid crew_member_id"
+    assert normalize_fix(fix(crew_member_id=None))[1] == "Missing crew_member_id"
+    row, error = normalize_fix(fix(crew_member_id=None), MEMBER_ID.upper())
+    assert error is None
+    assert row['crew_member_id'] == MEMBER_ID
+
+
+def test_normalize_fix_rejects_bad_coordinates():
+    assert normalize_fix(fix(latitude=91))[1] == "Latitude/longitude out of range"
+    assert normalize_fix(fix(longitude="east"))[1] == "Invalid latitude/longitude"
+    assert normalize_fix({"crew_member_id": MEMBER_ID})[1] == "Missing latitude/longitude"
+    assert normalize_fix(fix(fix_id=''))[1] == "Invalid fix_id"
+
+
+def test_permanent_errors():
+    assert is_permanent_write_error(APIError({"code": "22P02"}))
+    assert is_permanent_write_error(APIError({"code": "23503"}))
+    assert is_permanent_write_error(APIError({"code": 400}))
+    assert not is_permanent_write_error(APIError({"code": 503}))
+    assert not is_permanent_write_error(APIError({"code": "42501"}))
+    assert not is_permanent_write_error(APIError({"code": "PGRST301"}))
+    assert not is_permanent_write_error(ConnectionError("reset"))
+
+
+def test_bisection_isolates_bad_rows():
+    writer = RecordingWriter(poisoned={'bad'})
+    rows = [dict(normalize_fix(fix())[0]) for _ in range(9)]
+    rows[4]['crew_member_id'] = 'bad'
+    dropped = write_isolating_bad_rows(writer, rows)
+    assert [row for row, _ in dropped] == [rows[4]]
+    assert writer.rows == rows[:4] + rows[5:]
+
+
+def test_bisection_raises_transient_errors():
+    writer = RecordingWriter(poisoned={MEMBER_ID}, error_code='PGRST301')
+    try:
+        write_isolating_bad_rows(writer, [normalize_fix(fix())[0]])
+    except APIError:
+        pass
+    else:
+        raise AssertionError("transient error was swallowed")
+
+
+def test_buffer_drops_poisoned_row_and_keeps_flushing():
+    writer = RecordingWriter(poisoned={'deleted-member'})
+    buffer = LocationWriteBuffer(writer, batch_size=21, max_age=0.01, retry_backoff=0.01)
+    poisoned = dict(normalize_fix(fix())[0], crew_member_id='deleted-member')
+    good = [normalize_fix(fix())[0] for _ in range(20)]
+    assert buffer.submit([poisoned] + good)
+    buffer.close()
+    stats = buffer.stats()
+    assert writer.rows == good
+    assert stats['queue_depth'] == 0
+    assert stats['flushed'] == 20
+    assert stats['dropped'] == 1
+    assert stats['flush_failures'] == 0
+
+
+def test_buffer_retries_transient_failures():
+    writer = RecordingWriter()
+    failures = iter([ConnectionError("reset")])
+
+    def flaky(rows):
+        error = next(failures, None)
+        if error is not None:
+            raise error
+        writer(rows)
+
+    buffer = LocationWriteBuffer(flaky, batch_size=5, max_age=0.01, retry_backoff=0.01)
+    rows = [normalize_fix(fix())[0] for _ in range(5)]
+    buffer.submit(rows)
+    assert writer.written.wait(5)
+    buffer.close()
+    assert writer.rows == rows
+    assert buffer.stats()['flush_failures'] == 1
+
+
+def test_batch_endpoint_rejects_bad_fixes_individually(client):
+    response = client.post('/api/crew/location/batch', json={"fixes": [
+        fix(timestamp=1e20), fix(crew_member_id='not-a-uuid'), fix(fix_id='route-1')]})
+    assert response.status_code == 202
+    body = response.get_json()
+    assert body["accepted"] == 1
+    assert body["rejected"] == [{"index": 0, "error": "Invalid timestamp"},
+                                {"index": 1, "error": "Invalid crew_member_id"}]
+
+
+def test_batch_endpoint_refuses_empty_or_invalid_batches(client):
+    assert client.post('/api/crew/location/batch', json={"fixes": []}).status_code == 400
+    response = client.post('/api/crew/location/batch', json=[fix(timestamp=1e20)])
+    assert response.status_code == 400
+    assert response.get_json()["rejected"] == [{"index": 0, "error": "Invalid timestamp"}]
+
+
+def test_batch_endpoint_limits_batch_size(app_module, client):
+    fixes = [fix()] * (app_module.LOCATION_BATCH_MAX_FIXES + 1)
+    assert client.post('/api/crew/location/batch', json={"fixes": fixes}).status_code == 413
+
+
+def test_single_fix_endpoint_validates(client):
+    assert client.post('/api/crew/location', json={"latitude": 1, "longitude": 2}).status_code == 400
+    assert client.post('/api/crew/location', json=fix(timestamp=1e20)).status_code == 400
+    response = client.post('/api/crew/location', json=fix())
+    assert response.status_code == 200
+    assert response.get_json()["queued"]
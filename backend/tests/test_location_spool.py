@@ -0,0 +1,132 @@
+import time
+import uuid
+
+import pytest
+from postgrest.exceptions import APIError
+
+from services.location_ingest import normalize_fix
+from services.location_spool import LocationSpool
+
+
+class Writer:
+    """Bulk writer that refuses any batch holding a row Postgres would reject."""
+
+    def __init__(self, poisoned_code='22P02'):
+        self.poisoned_code = poisoned_code
+        self.rows = []
+
+    def __call__(self, rows):
+        for row in rows:
+            try:
+                uuid.UUID(row['crew_member_id'])
+            except ValueError:
+                raise APIError({"message": "invalid input syntax for type uuid", "code": self.poisoned_code,
+                                "hint": None, "details": None})
+        self.rows.extend(rows)
+
+
+def good_rows(count):
+    member_id = str(uuid.uuid4())
+    return [normalize_fix({"crew_member_id": member_id, "latitude": 39.7, "longitude": -104.9,
+                           "timestamp": 1700000000 + i, "fix_id": i})[0] for i in range(count)]
+
+
+@pytest.fixture
+def make_spool(tmp_path):
+    spools = []
+
+    def make(writer, **kwargs):
+        kwargs.setdefault('batch_size', 50)
+        spool = LocationSpool(writer, path=str(tmp_path / 'spool.db'), max_age=0.01, retry_backoff=0.01,
+                              poll_interval=0.01, **kwargs)
+        spools.append(spool)
+        return spool
+
+    yield make
+    for spool in spools:
+        spool.close()
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_forwards_in_order_and_dedupes(make_spool):
+    writer = Writer()
+    spool = make_spool(writer)
+    rows = good_rows(30)
+    assert spool.submit(rows)
+    assert spool.submit(rows[:10])
+    assert wait_for(lambda: spool.stats()['depth'] == 0)
+    assert writer.rows == rows
+    stats = spool.stats()
+    assert stats['appended'] == 30
+    assert stats['duplicates'] == 10
+    assert stats['forwarded'] == 30
+
+
+@pytest.mark.parametrize('code', ['22P02', '23503'])
+def test_poison_row_does_not_block_forwarding(make_spool, code):
+    writer = Writer(code)
+    spool = make_spool(writer, batch_size=500)
+    poison = dict(good_rows(1)[0], id=str(uuid.uuid4()), crew_member_id='not-a-uuid')
+    rows = good_rows(20)
+    assert spool.submit([poison] + rows)
+    assert wait_for(lambda: spool.stats()['depth'] == 0)
+    stats = spool.stats()
+    assert writer.rows == rows
+    assert stats['forwarded'] == 20
+    assert stats['dropped'] == 1
+    assert stats['forward_failures'] == 0
+    # Later fixes keep flowing
+    more = good_rows(5)
+    spool.submit(more)
+    assert wait_for(lambda: spool.stats()['depth'] == 0)
+    assert writer.rows == rows + more
+
+
+def test_transient_failure_holds_the_watermark(make_spool):
+    writer = Writer()
+    attempts = []
+
+    def flaky(rows):
+        attempts.append(len(rows))
+        if len(attempts) < 3:
+            raise ConnectionError("upstream down")
+        writer(rows)
+
+    spool = make_spool(flaky)
+    rows = good_rows(10)
+    spool.submit(rows)
+    assert wait_for(lambda: spool.stats()['depth'] == 0)
+    assert writer.rows == rows
+    assert spool.stats()['forward_failures'] == 2
+    assert spool.stats()['dropped'] == 0
+
+
+def test_full_spool_refuses(make_spool):
+    spool = make_spool(Writer(), max_rows=5, ready=lambda: False)
+    assert spool.submit(good_rows(5))
+    assert not spool.submit(good_rows(1))
+    assert spool.stats()['rejected'] == 1
+
+
+def test_depth_after_purge(make_spool):
+    writer = Writer()
+    spool = make_spool(writer, max_rows=5, dedupe_seconds=0)
+    assert spool.submit(good_rows(5))
+    assert wait_for(lambda: len(writer.rows) == 5)
+    conn = spool._connection()
+    spool._purge(conn)
+    assert conn.execute('SELECT COUNT(*) FROM fixes').fetchone()[0] == 0
+    assert spool._depth(conn) == 0 and spool.stats()['depth'] == 0
+
+    spool.ready = lambda: False  # hold what comes next in the spool
+    assert spool.submit(good_rows(1))
+    assert spool.depth == 1
+    assert not spool.submit(good_rows(5))
@@ -0,0 +1,61 @@
+from services.routing import DistanceMatrixCache
+
+ORG = 'org-1'
+SITES = [('site-a', 39.70, -104.90), ('site-b', 39.71, -104.91), ('site-c', 39.72, -104.92)]
+
+
+def test_matrix_grows_and_forgets_deleted_sites():
+    cache = DistanceMatrixCache()
+    first = cache.distances(ORG, SITES[:2])
+    assert first.shape == (2, 2) and first[0, 1] > 0
+    assert cache.distances(ORG, SITES).shape == (3, 3)
+    assert cache.stats()['added'] == 3
+    cache.distances('org-2', [('site-z', 40.0, -105.0)])
+    # Delete webhooks may carry only the id
+    cache.remove('site-b')
+    assert cache.stats()['organizations'] == 1
+    cache.remove('site-z', organization_id='another-org')
+    assert cache.stats()['organizations'] == 1
+
+
+def test_webhook_requires_secret(client):
+    record = {"id": "site-a", "organization_id": ORG, "latitude": 39.7, "longitude": -104.9}
+    assert client.post('/hooks/locations', json={"type": "INSERT", "record": record}).status_code == 403
+    assert client.post('/hooks/locations', json={"type": "INSERT", "record": record},
+                       headers={'X-Webhook-Secret': 'wrong'}).status_code == 403
+
+
+def test_webhook_delete_drops_cached_matrix(app_module, client):
+    app_module.distance_matrices.distances(ORG, SITES)
+    cached = app_module.distance_matrices.stats()['organizations']
+    response = client.post('/hooks/locations', json={"type": "DELETE", "old_record": {"id": "site-c"}},
+                           headers={'X-Webhook-Secret': 'test-webhook-secret'})
+    assert response.status_code == 200
+    assert app_module.distance_matrices.stats()['organizations'] == cached - 1
+
+
+def test_rank_locations_validates_location_ids(client, auth_headers):
+    headers = auth_headers(ORG, role='crew')
+    response = client.post(f'/api/organization/{ORG}/rank-locations', headers=headers,
+                           json={"origins": [{"latitude": 39.7, "longitude": -104.9}], "location_ids": "site-a"})
+    assert response.status_code == 400
+    response = client.post(f'/api/organization/{ORG}/rank-locations', headers=headers,
+                           json={"origins": [{"latitude": 39.7, "longitude": -104.9}], "location_ids": ["site-a"]})
+    assert response.status_code == 200
+
+
+def test_site_lookups_are_limited_to_the_callers_organization(app_module, client, auth_headers):
+    member_id = '6f0c3a8e-2b1d-4c5e-9f7a-1d2e3c4b5a69'
+    app_module.position_index.record(member_id, 39.7, -104.9, 1700000000.0)
+    app_module.position_index.set_member_org(member_id, 'org-2')
+    origins = {"origins": [{"crew_member_id": member_id}]}
+    assert client.post(f'/api/organization/{ORG}/rank-locations', json=origins).status_code == 401
+    assert client.post('/api/organization/org-2/rank-locations', json=origins,
+                       headers=auth_headers(ORG)).status_code == 403
+    response = client.post(f'/api/organization/{ORG}/rank-locations', json=origins, headers=auth_headers(ORG))
+    assert response.get_json()['unresolved'] == [{"index": 0, "error": "No location found"}]
+
+    assert client.get(f'/api/crew/{member_id}/nearby-locations').status_code == 401
+    assert client.get(f'/api/crew/{member_id}/nearby-locations', headers=auth_headers(ORG)).status_code == 404
+    response = client.get(f'/api/crew/{member_id}/nearby-locations', headers=auth_headers('org-2'))
+    assert response.status_code == 200 and response.get_json()['origin'] == {"latitude": 39.7, "longitude": -104.9}
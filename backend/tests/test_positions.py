@@ -0,0 +1,52 @@
+import time
+
+from services.positions import LatestPositionIndex, PositionIndexSync
+from services.workers import single_worker, worker_processes
+
+MEMBER_ID = '0b7e1c2a-5d4f-4e3b-8a9c-2f1e3d5c7b9a'
+
+
+def test_index_keeps_newest_fix():
+    index = LatestPositionIndex()
+    assert index.record(MEMBER_ID, 39.7, -104.9, 1700000100.0)
+    assert not index.record(MEMBER_ID, 39.0, -104.0, 1700000000.0)
+    index.seed(MEMBER_ID, 38.0, -103.0, 1600000000.0)
+    position = index.get(MEMBER_ID)
+    assert (position['latitude'], position['longitude']) == (39.7, -104.9)
+    assert index.take_unresolved() == [MEMBER_ID]
+    index.set_member_org(MEMBER_ID, 'org-1')
+    assert [row[0] for row in index.compact_rows(index.members_of('org-1'))] == [MEMBER_ID]
+
+
+def test_sync_runs_in_background_and_coalesces():
+    runs = []
+    sync = PositionIndexSync(lambda: runs.append(time.monotonic()), interval=0.2)
+    for _ in range(50):
+        sync.request()
+    deadline = time.monotonic() + 5
+    while not runs and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.05)
+    assert 1 <= len(runs) <= 2
+
+
+def test_worker_count(monkeypatch):
+    monkeypatch.delenv('GUNICORN_WORKERS', raising=False)
+    assert worker_processes() == 1 and single_worker()
+    monkeypatch.setenv('GUNICORN_WORKERS', '4')
+    assert worker_processes() == 4 and not single_worker()
+
+
+def test_current_location_reads_the_database(app_module, client, monkeypatch):
+    # The crew app inserts fixes into Supabase directly, so an indexed fix may be stale
+    app_module.position_index.record(MEMBER_ID, 1.5, 2.5, 1700000000.0)
+    monkeypatch.setattr(app_module.position_index, 'warmed', True)
+    assert client.get(f'/api/crew/current-location/{MEMBER_ID}').get_json()['latitude'] == 39.7392
+
+
+def test_positions_require_a_member_of_the_organization(app_module, client, auth_headers, monkeypatch):
+    monkeypatch.setattr(app_module.position_index, 'warmed', True)
+    assert client.get('/api/organization/org-1/positions').status_code == 401
+    assert client.get('/api/organization/org-1/positions', headers=auth_headers('org-2')).status_code == 403
+    response = client.get('/api/organization/org-1/positions', headers=auth_headers('org-1', role='crew'))
+    assert response.status_code == 200
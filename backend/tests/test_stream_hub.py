@@ -0,0 +1,30 @@
+from services.stream_hub import StreamHub, encode_event
+
+ORG = 'org-1'
+
+
+def test_newer_update_replaces_pending_one():
+    hub = StreamHub()
+    viewer = hub.subscribe(ORG, interval=0)
+    hub.publish(ORG, 'position', [('m1', {"lat": 1}), ('m2', {"lat": 2})])
+    hub.publish(ORG, 'position', [('m1', {"lat": 3})])
+    assert viewer.drain(0) == [encode_event('position', {"lat": 2}), encode_event('position', {"lat": 3})]
+    assert viewer.superseded == 1
+    hub.publish('other-org', 'position', [('m1', {"lat": 4})])
+    assert viewer.drain(0) == []
+
+
+def test_viewer_limit_and_unsubscribe():
+    hub = StreamHub(max_subscribers_per_org=1)
+    viewer = hub.subscribe(ORG)
+    assert hub.subscribe(ORG) is None
+    hub.unsubscribe(viewer)
+    assert not hub.has_subscribers(ORG)
+    assert hub.subscribe(ORG) is not None
+
+
+def test_stream_route_refuses_several_workers(client, monkeypatch):
+    monkeypatch.setenv('GUNICORN_WORKERS', '3')
+    response = client.get(f'/api/organization/{ORG}/stream')
+    assert response.status_code == 503
+    assert 'single worker' in response.get_json()['error']
@@ -0,0 +1,29 @@
+import httpx
+import pytest
+
+from benchmarks.fake_supabase import FakeSupabase
+from services.supabase_clients import PooledTransport
+
+
+@pytest.fixture
+def fake():
+    fake = FakeSupabase().start()
+    yield fake
+    fake.stop()
+
+
+def test_pool_counts_reused_connections(fake):
+    transport = PooledTransport('test', 5, 5, 30, http2=False)
+    with httpx.Client(transport=transport) as http:
+        for _ in range(3):
+            http.get(f"{fake.url}/rest/v1/crew_locations").read()
+        stats = transport.stats()
+        assert stats["requests"] == 3
+        assert stats["connections_opened"] == 1
+        assert stats["reuse_rate"] == pytest.approx(2 / 3, abs=1e-4)
+
+
+def test_metrics_render_every_gauge(client):
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'failed' not in body
+    assert 'supabase_pool_reuse_ratio' in body
@@ -0,0 +1,65 @@
+import time
+import uuid
+
+from services.archive import day_of
+from services.location_ingest import format_timestamp
+
+ORG = 'org-track'
+
+
+def add_member(database, organization_id, fixes):
+    member_id = str(uuid.uuid4())
+    database.insert('crew_members', [{"id": member_id, "name": "Truck", "organization_id": organization_id}])
+    start = time.time() - 3600
+    database.insert('crew_locations', [
+        {"id": str(uuid.uuid4()), "crew_member_id": member_id, "latitude": 39.7 + i * 1e-3,
+         "longitude": -104.9 + (i % 2) * 1e-3, "timestamp": format_timestamp(start + i * 60)}
+        for i in range(fixes)])
+    return member_id
+
+
+def test_track_is_limited_to_the_callers_organization(database, client, auth_headers):
+    member_id = add_member(database, ORG, 10)
+    assert client.get(f'/api/crew/{member_id}/track').status_code == 401
+    assert client.get(f'/api/crew/{member_id}/track', headers=auth_headers('org-other')).status_code == 404
+
+    response = client.get(f'/api/crew/{member_id}/track?tolerance=0', headers=auth_headers(ORG, role='crew'))
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['raw_points'] == 10 and len(body['points']) == 10
+
+
+def test_route_is_limited_to_the_callers_organization(database, client, auth_headers):
+    member_id = add_member(database, ORG, 1)
+    assert client.get(f'/api/crew/{member_id}/route').status_code == 401
+    assert client.get(f'/api/crew/{member_id}/route', headers=auth_headers('org-other')).status_code == 404
+    response = client.get(f'/api/crew/{member_id}/route', headers=auth_headers(ORG, role='crew'))
+    assert response.status_code == 200 and response.get_json()['stops'] == []
+
+
+def test_history_is_limited_to_the_organizations_members(database, client, auth_headers):
+    member_id = add_member(database, ORG, 5)
+    add_member(database, 'org-other', 3)
+    assert client.get(f'/api/organization/{ORG}/locations/history').status_code == 401
+    assert client.get(f'/api/organization/{ORG}/locations/history',
+                      headers=auth_headers('org-other')).status_code == 403
+    response = client.get(f'/api/organization/{ORG}/locations/history', headers=auth_headers(ORG, role='crew'))
+    assert response.status_code == 200
+    assert {row[0] for row in response.get_json()['rows']} == {member_id}
+
+
+def test_track_merges_archived_fixes_once(app_module, database, client, auth_headers):
+    member_id = add_member(database, ORG, 0)
+    start = (int(time.time()) // 86400 - 1) * 86400 + 3600
+    rows = [{"id": str(uuid.UUID(bytes=uuid.uuid4().bytes[:15] + b'\0')), "crew_member_id": member_id,
+             "latitude": 39.7 + i * 1e-3, "longitude": -104.9 + (i % 2) * 1e-3,
+             "timestamp": format_timestamp(start + i * 60)} for i in range(20)]
+    app_module.location_archive.write_day(ORG, day_of(start), rows[:12])
+    # An interrupted archive run left rows 8-11 in the live table too
+    database.insert('crew_locations', rows[8:])
+
+    response = client.get(f'/api/crew/{member_id}/track?tolerance=0&from={start - 60}&to={start + 3600}',
+                          headers=auth_headers(ORG))
+    body = response.get_json()
+    assert body['raw_points'] == 20
+    assert [point[2] for point in body['points']] == [start + i * 60 for i in range(20)]
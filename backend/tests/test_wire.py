@@ -0,0 +1,94 @@
+import gzip
+import zlib
+
+import pytest
+
+from services import wire
+from services.wire import TIME_SCALE, WireCodec, WireError, decode_columns, decode_fix_columns, encode_columns
+
+FIELDS = ["crew_member_id", "latitude", "longitude", "timestamp"]
+SCALES = {"latitude": 1_000_000, "longitude": 1_000_000, "timestamp": TIME_SCALE}
+
+
+def test_columns_round_trip_with_nulls_and_constants():
+    rows = [["m1", 39.7392, -104.9903, 1700000000.123],
+            ["m1", None, -104.9904, 1700000001.456],
+            ["m1", 39.7394, None, 1700000002.789]]
+    body = encode_columns(FIELDS, rows, SCALES)
+    assert body["columns"]["crew_member_id"] == "m1"
+    assert body["nulls"] == {"latitude": [1], "longitude": [2]}
+    decoded = decode_columns(body)
+    assert [row[0] for row in decoded] == ["m1"] * 3
+    assert decoded[1][1] is None and decoded[2][2] is None
+    for original, row in zip(rows, decoded):
+        for value, got in zip(original[1:], row[1:]):
+            if value is not None:
+                assert got == pytest.approx(value, abs=1e-6)
+
+
+def test_malformed_columns_are_wire_errors():
+    with pytest.raises(WireError):
+        decode_columns({"fields": ["a"], "count": 2, "columns": {"a": [1]}})
+    with pytest.raises(WireError):
+        decode_columns({"fields": ["a"], "count": 1, "columns": {}})
+    with pytest.raises(WireError):
+        decode_columns({"fields": ["a"], "count": 1, "columns": {"a": ["x"]}, "scales": {"a": 10}})
+
+
+def test_fix_columns_limit_rows_before_decoding():
+    body = encode_columns(FIELDS, [["m1", 1.0, 2.0, 3.0]] * 5, SCALES)
+    assert len(decode_fix_columns(body, max_rows=5)) == 5
+    with pytest.raises(WireError) as error:
+        decode_fix_columns(body, max_rows=4)
+    assert error.value.status == 413
+    # A huge claimed count is refused without allocating anything
+    with pytest.raises(WireError) as error:
+        decode_fix_columns(dict(body, count=10 ** 12), max_rows=1000)
+    assert error.value.status == 413
+    with pytest.raises(WireError) as error:
+        decode_fix_columns({"fields": "nope"}, max_rows=10)
+    assert error.value.status == 400
+
+
+def test_decompression_is_bounded():
+    codec = WireCodec(max_request_bytes=1000)
+    assert codec.decompress(gzip.compress(b"x" * 1000), 'gzip') == b"x" * 1000
+    assert codec.decompress(zlib.compress(b"y" * 10), 'deflate') == b"y" * 10
+    raw = zlib.compressobj(wbits=-15)
+    assert codec.decompress(raw.compress(b"z" * 10) + raw.flush(), 'deflate') == b"z" * 10
+    with pytest.raises(WireError) as error:
+        raw = zlib.compressobj(wbits=-15)
+        codec.decompress(raw.compress(b"z" * 10_000) + raw.flush(), 'deflate')
+    assert error.value.status == 413
+    with pytest.raises(WireError) as error:
+        codec.decompress(gzip.compress(b"x" * 10_000_000), 'gzip')
+    assert error.value.status == 413
+    with pytest.raises(WireError) as error:
+        codec.decompress(gzip.compress(b"x" * 100)[:-12], 'gzip')
+    assert error.value.status == 400
+    with pytest.raises(WireError) as error:
+        codec.decompress(b"garbage", 'gzip')
+    assert error.value.status == 400
+    with pytest.raises(WireError) as error:
+        codec.decompress(b"data", 'compress')
+    assert error.value.status == 415
+
+
+def test_decode_json_and_content_types():
+    codec = WireCodec()
+    assert codec.decode(b'{"a": 1}', 'application/json') == {"a": 1}
+    with pytest.raises(WireError) as error:
+        codec.decode(b'{"a": ', 'application/json')
+    assert error.value.status == 400
+    with pytest.raises(WireError) as error:
+        codec.decode(b'a=1', 'application/x-www-form-urlencoded')
+    assert error.value.status == 415
+
+
+def test_decode_msgpack():
+    if wire.msgpack is None:
+        pytest.skip("msgpack is not installed")
+    codec = WireCodec()
+    assert codec.decode(wire.msgpack.packb({"a": [1, 2]}), 'application/msgpack') == {"a": [1, 2]}
+    with pytest.raises(WireError):
+        codec.decode(b'\xc1', 'application/msgpack')
@@ -0,0 +1,18 @@
+-- Migration adding an indexed email lookup in auth.users for the backend
+
+-- The backend keeps an in-memory email -> auth user index and confirms misses
+-- with this function instead of paging through the GoTrue admin user list.
+-- GoTrue stores emails lower-cased, so the lookup can use auth.users' email index.
+CREATE OR REPLACE FUNCTION public.auth_user_id_by_email(p_email TEXT)
+RETURNS UUID AS $$
+    SELECT id
+    FROM auth.users
+    WHERE email = lower(trim(p_email))
+    LIMIT 1;
+$$ LANGUAGE sql STABLE SECURITY DEFINER SET search_path = '';
+
+-- Only the backend (service role) may probe for registered emails
+REVOKE ALL ON FUNCTION public.auth_user_id_by_email(TEXT) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.auth_user_id_by_email(TEXT) TO service_role;
+
+-- Note: Apply this migration to your Supabase project.
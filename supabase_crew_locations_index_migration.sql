@@ -0,0 +1,12 @@
+-- Migration to speed up latest-position lookups on crew_locations
+
+-- Latest fix per crew member (ORDER BY timestamp DESC LIMIT 1) and the
+-- backend's position index warm-up both read crew_locations by member + time
+CREATE INDEX IF NOT EXISTS idx_crew_locations_member_timestamp
+ON public.crew_locations (crew_member_id, "timestamp" DESC);
+
+-- Warm-up also scans recent fixes across all members
+CREATE INDEX IF NOT EXISTS idx_crew_locations_timestamp
+ON public.crew_locations ("timestamp" DESC);
+
+-- Note: Apply this migration to your Supabase project.